@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+
+"""
+fake_server.py
+
+A local HTTP server standing in for YouTube's media servers. It serves synthetic audio streams, as WAV files of whatever size is asked for, so that either ffmpeg or the stand-in in benchmarks/bin can convert them. Each request can be delayed by a fixed latency and each connection limited to a bandwidth, and the first requests can be throttled with 429 responses. It supports HEAD requests, Range headers and pytube's range parameter and keeps connections alive, as the real servers do.
+
+Used by run_benchmarks.py, or on its own with:
+
+    python fake_server.py [--port PORT] [--latency SECONDS] [--bandwidth RATE] [--throttle REQUESTS]
+"""
+
+import sys
+import math
+import time
+import getopt
+import struct
+import threading
+import http.server
+import urllib.parse
+
+# Format of the synthetic audio
+SAMPLE_RATE = 44100
+CHANNEL_COUNT = 2
+SAMPLE_WIDTH = 2
+WAV_HEADER_SIZE = 44
+
+def build_audio_block():
+    """ Build one second of a 440Hz tone, repeated to fill each stream
+
+    Returns:
+        audio_block - bytes - 16-bit stereo PCM samples
+    """
+
+    samples = bytearray()
+    for c in range(SAMPLE_RATE):
+        sample = int(math.sin(2 * math.pi * 440 * c / SAMPLE_RATE) * 8000)
+        samples += struct.pack("<hh", sample, sample)
+
+    return bytes(samples)
+
+def build_wav_header(size):
+    """ Build the header of a WAV file
+
+    Arguments:
+        size - int - Size of the whole file, in bytes
+
+    Returns:
+        header - bytes - The 44 byte header
+    """
+
+    data_size = max(0, size - WAV_HEADER_SIZE)
+    block_align = CHANNEL_COUNT * SAMPLE_WIDTH
+    return b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVEfmt " + struct.pack("<IHHIIHH", 16, 1, CHANNEL_COUNT, SAMPLE_RATE, SAMPLE_RATE * block_align, block_align, SAMPLE_WIDTH * 8) + b"data" + struct.pack("<I", data_size)
+
+class MediaRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serve /media/VIDEO_ID/ITAG?size=BYTES as a WAV file of that size
+
+    Methods:
+        do_HEAD() - Send the headers of a stream
+        do_GET() - Send all or part of a stream
+        send_stream() - Send the headers and, optionally, the body of a stream
+        write_body() - Write part of a stream within the bandwidth limit
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """ Keep request logs out of benchmark output """
+
+    def do_HEAD(self):
+        """ Send the headers of a stream """
+
+        self.send_stream(False)
+
+    def do_GET(self):
+        """ Send all or part of a stream """
+
+        self.send_stream(True)
+
+    def send_stream(self, send_body):
+        """ Send the headers and, optionally, the body of a stream, after the server's latency
+
+        Arguments:
+            self - self - This object
+            send_body - bool - Send the body as well as the headers
+        """
+
+        parsed_url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed_url.query)
+        if parsed_url.path.startswith("/media/") == False or "size" not in query:
+            self.send_error(404)
+            return
+
+        size = int(query["size"][0])
+        start = 0
+        end = size - 1
+
+        time.sleep(self.server.latency)
+
+        # Throttle the first requests, as YouTube does when it is asked for too much at once
+        if self.server.take_throttled_request() == True:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # pytube asks for ranges with a range parameter, which YouTube answers with a plain 200 holding just that range
+        range_header = self.headers.get("Range")
+        if "range" in query:
+            range_start, range_end = query["range"][0].split("-")
+            start = int(range_start)
+            end = min(int(range_end), size - 1)
+            self.send_response(200)
+
+        # Serve a single byte range if one was asked for
+        elif range_header != None and range_header.startswith("bytes=") == True:
+            range_start, range_end = range_header[len("bytes="):].split("-")
+            start = int(range_start)
+            end = min(int(range_end), size - 1) if range_end != "" else size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        if send_body == True:
+            self.write_body(size, start, end)
+
+    def write_body(self, size, start, end):
+        """ Write bytes start to end of a stream, a chunk at a time, within the connection's bandwidth
+
+        Arguments:
+            self - self - This object
+            size - int - Size of the whole stream
+            start - int - First byte to write
+            end - int - Last byte to write
+        """
+
+        header = build_wav_header(size)
+        audio_block = self.server.audio_block
+        chunk_size = 64 * 1024
+        started = time.monotonic()
+        written = 0
+
+        position = start
+        while position <= end:
+            chunk_end = min(end + 1, position + chunk_size)
+
+            # The header comes first, then the tone repeated from the start of the data
+            chunk = b""
+            if position < WAV_HEADER_SIZE:
+                chunk = header[position:min(chunk_end, WAV_HEADER_SIZE)]
+            audio_position = max(position, WAV_HEADER_SIZE) - WAV_HEADER_SIZE
+            while len(chunk) < chunk_end - position:
+                block_position = audio_position % len(audio_block)
+                piece = audio_block[block_position:block_position + chunk_end - position - len(chunk)]
+                chunk += piece
+                audio_position += len(piece)
+
+            self.wfile.write(chunk)
+            written += len(chunk)
+            position = chunk_end
+
+            # Sleep off any time the connection is ahead of its bandwidth
+            if self.server.bandwidth != None:
+                ahead = written / self.server.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+class BenchmarkServer(http.server.ThreadingHTTPServer):
+    """ The media server, run on a background thread
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Start serving on a background thread
+        stop() - Stop serving
+        take_throttled_request() - Check whether a request should be throttled
+        handle_error() - Report errors other than clients hanging up
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None, throttle_count=0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            port - int - Port to listen on, or 0 for any free port
+            latency - float - Seconds to wait before answering each request
+            bandwidth - int or None - Bytes per second each connection may send, or None for no limit
+            throttle_count - int - Number of requests, from the first, answered with 429 Too Many Requests
+        """
+
+        http.server.ThreadingHTTPServer.__init__(self, ("127.0.0.1", port), MediaRequestHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_count = throttle_count
+        self.throttle_lock = threading.Lock()
+        self.audio_block = build_audio_block()
+        self.thread = None
+
+    def start(self):
+        """ Start serving on a background thread
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            base_url - string - URL of the server
+        """
+
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def stop(self):
+        """ Stop serving
+
+        Arguments:
+            self - self - This object
+        """
+
+        self.shutdown()
+        self.server_close()
+
+    def take_throttled_request(self):
+        """ Check whether a request should be throttled, counting it against the requests left to throttle
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            throttled - bool - Whether to answer the request with 429 Too Many Requests
+        """
+
+        with self.throttle_lock:
+            if self.throttle_count <= 0:
+                return False
+            self.throttle_count -= 1
+            return True
+
+    def handle_error(self, request, client_address):
+        """ Report an error handling a request, except for clients hanging up, which pytube does with the response it only takes the size from
+
+        Arguments:
+            self - self - This object
+            request - socket - The client's connection
+            client_address - tuple - The client's address
+        """
+
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)) == True:
+            return
+        http.server.ThreadingHTTPServer.handle_error(self, request, client_address)
+
+def parse_rate(rate):
+    """ Parse a rate in bytes per second, with an optional K or M suffix
+
+    Arguments:
+        rate - string - The rate
+
+    Returns:
+        rate - int - The rate in bytes per second
+    """
+
+    multipliers = {"K": 1024, "M": 1024 * 1024}
+    if rate[-1].upper() in multipliers:
+        return int(float(rate[:-1]) * multipliers[rate[-1].upper()])
+
+    return int(rate)
+
+def main(argv):
+    """ Run the server in the foreground
+
+    Arguments:
+        argv - list - Provided CLI arguments
+    """
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "port=", "latency=", "bandwidth=", "throttle="])
+    except getopt.GetoptError as err_msg:
+        print(err_msg)
+        exit(0)
+
+    port = 8000
+    latency = 0.0
+    bandwidth = None
+    throttle_count = 0
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print("USAGE: {} [--port PORT] [--latency SECONDS] [--bandwidth RATE] [--throttle REQUESTS]".format(sys.argv[0]))
+            exit(0)
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--latency":
+            latency = float(arg)
+        elif opt == "--bandwidth":
+            bandwidth = parse_rate(arg)
+        elif opt == "--throttle":
+            throttle_count = int(arg)
+
+    server = BenchmarkServer(port, latency, bandwidth, throttle_count)
+    print("[I] Serving synthetic streams on http://127.0.0.1:{}".format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+# Run the server
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,260 @@
+# benchmarks/fake_youtube/pytube/__init__.py
+# A stand-in for pytube that serves synthetic videos from the local benchmark server
+
+"""
+Only the parts of pytube that bulk-yt-mp3 uses are here. Every video ID is valid, its title and length are made up from the ID, and its audio streams are served by benchmarks/fake_server.py. Settings are read from environment variables, which the benchmark driver sets:
+
+    BENCH_MEDIA_URL - Base URL of the benchmark server
+    BENCH_TRACK_SIZE - Size of each audio stream, in bytes, or of a three minute stream if BENCH_LENGTHS is set
+    BENCH_LENGTHS - Comma separated lengths in seconds, given to the videos in turn by their number, with stream sizes following the lengths
+    BENCH_LOOKUP_LATENCY - Seconds each video lookup takes, standing in for YouTube's watch page
+    BENCH_PLAYLIST_LENGTH - Number of videos in every playlist
+"""
+
+import os
+import time
+from pytube import request
+from pytube import extract
+
+__version__ = "0.0.0-benchmark"
+
+def get_setting(name, default):
+    """ Read a setting from the environment
+
+    Arguments:
+        name - string - Name of the environment variable
+        default - any - Value to use if it isn't set
+
+    Returns:
+        value - string or any - The setting
+    """
+
+    return os.environ.get(name, default)
+
+class Stream(object):
+    """ One audio stream of a video
+
+    Methods:
+        __init__() - Initialize the object
+        download() - Download the stream to a file
+    """
+
+    def __init__(self, youtube, itag, mime_type, abr, audio_codec, filesize):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            youtube - YouTube object - The video the stream belongs to
+            itag - int - YouTube's format code
+            mime_type - string - MIME type of the stream
+            abr - string - Audio bitrate, such as "128kbps"
+            audio_codec - string - Codec of the audio
+            filesize - int - Size of the stream in bytes
+        """
+
+        self.youtube = youtube
+        self.itag = itag
+        self.mime_type = mime_type
+        self.type, self.subtype = mime_type.split("/")
+        self.abr = abr
+        self.bitrate = int(abr.rstrip("kbps")) * 1000
+        self.audio_codec = audio_codec
+        self.filesize = filesize
+        self.includes_audio_track = True
+        self.includes_video_track = False
+        self.is_adaptive = True
+        self.url = "{0}/media/{1}/{2}?size={3}".format(get_setting("BENCH_MEDIA_URL", "http://127.0.0.1:8000"), youtube.video_id, itag, filesize)
+
+    def download(self, output_path=None, filename=None, skip_existing=True, timeout=None, max_retries=0):
+        """ Download the stream to a file, reporting progress to the video's callback
+
+        Arguments:
+            self - self - This object
+            output_path - string or None - Directory to download to
+            filename - string or None - Name of the file
+            skip_existing - bool - Ignored
+            timeout - int or None - Socket timeout in seconds
+            max_retries - int - Ignored
+
+        Returns:
+            file_path - filename - Path of the downloaded file
+        """
+
+        file_path = filename or "{}.{}".format(self.youtube.video_id, self.subtype)
+        if output_path != None:
+            file_path = os.path.join(output_path, file_path)
+
+        bytes_remaining = self.filesize
+        with open(file_path, "wb") as open_file:
+            for chunk in request.stream(self.url, timeout=timeout):
+                open_file.write(chunk)
+                bytes_remaining -= len(chunk)
+                if self.youtube.on_progress_callback != None:
+                    self.youtube.on_progress_callback(self, chunk, bytes_remaining)
+
+        return file_path
+
+class StreamQuery(list):
+    """ A list of streams that can be filtered and ordered, as in pytube
+
+    Methods:
+        filter() - Keep the streams matching some attributes
+        order_by() - Sort the streams by an attribute
+        desc() - Reverse the order
+        asc() - Keep the order
+        first() - Get the first stream
+        last() - Get the last stream
+        get_by_itag() - Get a stream by its format code
+    """
+
+    def filter(self, only_audio=False, only_video=False, **attributes):
+        """ Keep the streams whose attributes match, all of which are audio only """
+
+        streams = [stream for stream in self if only_video == False]
+        for name, value in attributes.items():
+            streams = [stream for stream in streams if getattr(stream, name, None) == value]
+        return StreamQuery(streams)
+
+    def order_by(self, attribute):
+        """ Sort the streams by an attribute, smallest first """
+
+        return StreamQuery(sorted(self, key=lambda stream: getattr(stream, attribute)))
+
+    def desc(self):
+        """ Reverse the order of the streams """
+
+        return StreamQuery(reversed(self))
+
+    def asc(self):
+        """ Keep the order of the streams """
+
+        return self
+
+    def first(self):
+        """ Get the first stream, or None if there are none """
+
+        return self[0] if len(self) > 0 else None
+
+    def last(self):
+        """ Get the last stream, or None if there are none """
+
+        return self[-1] if len(self) > 0 else None
+
+    def get_by_itag(self, itag):
+        """ Get the stream with a format code, or None if there isn't one """
+
+        for stream in self:
+            if stream.itag == itag:
+                return stream
+        return None
+
+class YouTube(object):
+    """ A synthetic video, looked up once with a configurable delay
+
+    Methods:
+        __init__() - Initialize the object
+        fetch() - Stand in for fetching the watch page
+        check_availability() - Check that the video can be downloaded
+    """
+
+    def __init__(self, url, on_progress_callback=None, on_complete_callback=None, use_oauth=False, allow_oauth_cache=True):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            url - string - URL of the video
+            on_progress_callback - callable or None - Called after each downloaded chunk
+        """
+
+        self.watch_url = url
+        self.video_id = extract.video_id(url)
+        self.on_progress_callback = on_progress_callback
+        self.fetched = False
+
+    def fetch(self):
+        """ Wait for the lookup latency, once per video, as pytube fetches the watch page once
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.fetched == False:
+            time.sleep(float(get_setting("BENCH_LOOKUP_LATENCY", "0")))
+            self.fetched = True
+
+    def check_availability(self):
+        """ Every synthetic video is available, but checking costs a lookup """
+
+        self.fetch()
+
+    @property
+    def title(self):
+        """ Title made up from the video ID """
+
+        self.fetch()
+        return "Track {}".format(self.video_id)
+
+    @property
+    def length(self):
+        """ Length in seconds, made up from the video ID """
+
+        self.fetch()
+        lengths = get_setting("BENCH_LENGTHS", "")
+        if lengths != "":
+            lengths = lengths.split(",")
+            return int(lengths[int(self.video_id[-6:]) % len(lengths)])
+
+        return 120 + int(self.video_id[-3:]) % 240
+
+    @property
+    def streams(self):
+        """ The audio streams, of which the first is the largest """
+
+        self.fetch()
+        track_size = int(get_setting("BENCH_TRACK_SIZE", str(4 * 1024 * 1024)))
+
+        # Scale the size to the length, as a stream of a given bitrate does
+        if get_setting("BENCH_LENGTHS", "") != "":
+            track_size = track_size * self.length // 180
+        return StreamQuery([
+            Stream(self, 251, "audio/webm", "160kbps", "opus", track_size),
+            Stream(self, 140, "audio/mp4", "128kbps", "mp4a.40.2", track_size * 4 // 5),
+            Stream(self, 249, "audio/webm", "50kbps", "opus", track_size // 3)
+        ])
+
+class Playlist(object):
+    """ A synthetic playlist of BENCH_PLAYLIST_LENGTH videos
+
+    Methods:
+        __init__() - Initialize the object
+        url_generator() - Yield the URL of each video
+    """
+
+    def __init__(self, url):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            url - string - URL of the playlist
+        """
+
+        self.playlist_url = url
+        self.playlist_id = extract.playlist_id(url)
+
+    @property
+    def title(self):
+        """ Title made up from the playlist ID """
+
+        return "Playlist {}".format(self.playlist_id)
+
+    def url_generator(self):
+        """ Yield the URL of each video, as pytube does while paging through a playlist """
+
+        for c in range(int(get_setting("BENCH_PLAYLIST_LENGTH", "20"))):
+            yield "https://www.youtube.com/watch?v=bench{:06d}".format(c)
+
+    @property
+    def video_urls(self):
+        """ URLs of every video """
+
+        return list(self.url_generator())
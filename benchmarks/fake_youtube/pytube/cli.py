@@ -0,0 +1,11 @@
+# benchmarks/fake_youtube/pytube/cli.py
+# pytube's progress callback, which prints nothing here
+
+def on_progress(stream, chunk, bytes_remaining):
+    """ Progress callback, ignored so benchmark output isn't cluttered
+
+    Arguments:
+        stream - Stream object - The stream being downloaded
+        chunk - bytes - The chunk just downloaded
+        bytes_remaining - int - Bytes left to download
+    """
@@ -0,0 +1,26 @@
+# benchmarks/fake_youtube/pytube/exceptions.py
+# The pytube exceptions used by the download manager
+
+class PytubeError(Exception):
+    """ Base class of the stand-in's exceptions """
+
+class MaxRetriesExceeded(PytubeError):
+    """ A range of a stream timed out on every try """
+
+class RegexMatchError(PytubeError):
+    """ A URL didn't contain what was looked for """
+
+class VideoUnavailable(PytubeError):
+    """ The video can't be downloaded """
+
+class AgeRestrictedError(VideoUnavailable):
+    """ The video is age restricted """
+
+class LiveStreamError(VideoUnavailable):
+    """ The video is a live stream """
+
+class VideoPrivate(VideoUnavailable):
+    """ The video is private """
+
+class VideoRegionBlocked(VideoUnavailable):
+    """ The video is blocked in this region """
@@ -0,0 +1,37 @@
+# benchmarks/fake_youtube/pytube/extract.py
+# Pull video and playlist IDs out of URLs, as pytube does
+
+import re
+from pytube.exceptions import RegexMatchError
+
+def video_id(url):
+    """ Get the ID of a video from its URL
+
+    Arguments:
+        url - string - The URL of the video
+
+    Returns:
+        video_id - string - The ID of the video
+    """
+
+    match = re.search(r"(?:v=|\/)([0-9A-Za-z_-]{11}).*", url)
+    if match == None:
+        raise RegexMatchError("video_id: no match in {}".format(url))
+
+    return match.group(1)
+
+def playlist_id(url):
+    """ Get the ID of a playlist from its URL
+
+    Arguments:
+        url - string - The URL of the playlist
+
+    Returns:
+        playlist_id - string - The ID of the playlist
+    """
+
+    match = re.search(r"list=([0-9A-Za-z_-]+)", url)
+    if match == None:
+        raise RegexMatchError("playlist_id: no match in {}".format(url))
+
+    return match.group(1)
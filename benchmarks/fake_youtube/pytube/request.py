@@ -0,0 +1,90 @@
+# benchmarks/fake_youtube/pytube/request.py
+# The parts of pytube's request module the download manager uses, including _execute_request so the shared transport can replace it
+
+import socket
+import http.client
+import urllib.error
+import urllib.request
+from pytube import exceptions
+
+# Size of each ranged request made by stream(), as in pytube
+default_range_size = 9 * 1024 * 1024
+
+def _execute_request(url, method=None, headers=None, data=None, timeout=None):
+    """ Make a request with urllib, until the transport replaces this function
+
+    Arguments:
+        url - string - The URL to request
+        method - string or None - The HTTP method
+        headers - dict or None - Extra request headers
+        data - bytes or None - The request body
+        timeout - int or None - Socket timeout in seconds
+
+    Returns:
+        response - HTTPResponse object - The response
+    """
+
+    url_request = urllib.request.Request(url, headers=headers or {}, method=method, data=data)
+    return urllib.request.urlopen(url_request, timeout=timeout)
+
+def head(url):
+    """ Get the headers of a URL
+
+    Arguments:
+        url - string - The URL
+
+    Returns:
+        headers - dict - Response headers, with lowercase names
+    """
+
+    response = _execute_request(url, method="HEAD")
+    return {name.lower(): value for name, value in response.info().items()}
+
+def stream(url, timeout=None, max_retries=0):
+    """ Fetch a URL a chunk at a time, following the control flow of pytube's request.stream
+
+    As in pytube, ranges are asked for with a range query parameter, the first range is requested before the size is known, and the size is then read from the Content-Length of a second, full-range GET whose body is never read or closed, so the transport sees the same unread responses it does in production.
+
+    Arguments:
+        url - string - The URL
+        timeout - int or None - Socket timeout in seconds
+        max_retries - int - Number of times to retry a range that times out
+
+    Returns:
+        chunks - generator of bytes - The body of the response
+    """
+
+    # The real size isn't known until after the first range has been requested
+    file_size = default_range_size
+    downloaded = 0
+    while downloaded < file_size:
+        stop_position = min(downloaded + default_range_size, file_size) - 1
+        tries = 0
+
+        while True:
+            if tries >= 1 + max_retries:
+                raise exceptions.MaxRetriesExceeded()
+            try:
+                response = _execute_request("{0}&range={1}-{2}".format(url, downloaded, stop_position), method="GET", timeout=timeout)
+            except urllib.error.URLError as err_msg:
+                if isinstance(err_msg.reason, socket.timeout) == False:
+                    raise
+            except http.client.IncompleteRead:
+                pass
+            else:
+                break
+            tries += 1
+
+        if file_size == default_range_size:
+            try:
+                size_response = _execute_request("{0}&range={1}-{2}".format(url, 0, 99999999999), method="GET", timeout=timeout)
+                file_size = int(size_response.info()["Content-Length"])
+            except (KeyError, IndexError, ValueError):
+                pass
+
+        while True:
+            chunk = response.read()
+            if len(chunk) == 0:
+                break
+            downloaded += len(chunk)
+            yield chunk
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+"""
+import_time.py
+
+Cold start check for bulk-yt-mp3. Runs the program's quick paths (help, version and a bad option) under `python -X importtime`, several times each, and reports the median time spent importing modules, the median wall time of the whole process, and the slowest imports. It fails, with exit status 1, if the median import time of any path is over budget or if any path imports one of the heavy dependencies (pytube, eyed3, NumPy, PyAV, SQLite or asyncio), which should only be loaded once a download actually needs them.
+
+Run it before and after a change that touches imports, or from CI:
+
+    python import_time.py [-h] [-n RUNS] [--budget MILLISECONDS] [--wall-budget MILLISECONDS] [--top COUNT] [-o OUTPUT_FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import statistics
+import subprocess
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+PROGRAM_FILE = os.path.join(REPOSITORY_DIRECTORY, "bulk-yt-mp3.py")
+
+# Paths through the program that never download anything, as its arguments
+CASES = {
+    "help": ["-h"],
+    "version": ["-v"],
+    "bad-option": ["--no-such-option"]
+}
+
+# Modules that none of the cases should import
+HEAVY_MODULES = ("pytube", "eyed3", "numpy", "av", "sqlite3", "asyncio")
+
+def parse_import_times(stderr):
+    """ Parse the output of -X importtime
+
+    Arguments:
+        stderr - string - Standard error of the process
+
+    Returns:
+        imports - dict - Self time of each imported module in microseconds, keyed by module name
+    """
+
+    imports = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") == False:
+            continue
+
+        self_time, cumulative_time, module_name = line[len("import time:"):].split("|")
+
+        # Skip the header line
+        if self_time.strip().isdigit() == False:
+            continue
+
+        imports[module_name.strip()] = int(self_time)
+
+    return imports
+
+def measure_case(arguments, runs):
+    """ Run the program with some arguments several times and measure its imports
+
+    Arguments:
+        arguments - list of strings - Arguments to run the program with
+        runs - int - Number of times to run it
+
+    Returns:
+        result - dict - Median import and wall time in milliseconds, the modules imported, the heavy modules among them, and the median self time of each module
+    """
+
+    import_times = []
+    wall_times = []
+    module_times = {}
+
+    # Run against the installed packages only, not any stand-ins on the path
+    environment = dict(os.environ)
+    environment.pop("PYTHONPATH", None)
+
+    for c in range(runs):
+        started = time.perf_counter()
+        child_process = subprocess.run([sys.executable, "-X", "importtime", PROGRAM_FILE] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=REPOSITORY_DIRECTORY, env=environment)
+        wall_times.append(time.perf_counter() - started)
+
+        imports = parse_import_times(child_process.stderr.decode("utf-8", "replace"))
+        import_times.append(sum(imports.values()))
+        for module_name, self_time in imports.items():
+            module_times.setdefault(module_name, []).append(self_time)
+
+    return {
+        "import_ms": statistics.median(import_times) / 1000,
+        "wall_ms": statistics.median(wall_times) * 1000,
+        "module_count": len(module_times),
+        "heavy_modules": sorted(set(module_name.split(".")[0] for module_name in module_times) & set(HEAVY_MODULES)),
+        "modules": {module_name: statistics.median(self_times) / 1000 for module_name, self_times in module_times.items()}
+    }
+
+def main(argv):
+    """ Process command line arguments, measure each case and check it against the budget
+
+    Arguments:
+        argv - list - Provided CLI arguments
+    """
+
+    try:
+        opts, args = getopt.getopt(argv, "hn:o:", ["help", "runs=", "budget=", "wall-budget=", "top=", "output="])
+    except getopt.GetoptError as err_msg:
+        print(err_msg)
+        exit(0)
+
+    # Set variables with default values
+    runs = 5
+    budget = 40.0
+    wall_budget = None
+    top_count = 5
+    output_file = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            exit(0)
+        elif opt in ("-n", "--runs"):
+            runs = int(arg)
+        elif opt == "--budget":
+            budget = float(arg)
+        elif opt == "--wall-budget":
+            wall_budget = float(arg)
+        elif opt == "--top":
+            top_count = int(arg)
+        elif opt in ("-o", "--output"):
+            output_file = arg
+
+    results = {}
+    failures = []
+    for case_name, arguments in CASES.items():
+        result = measure_case(arguments, runs)
+        results[case_name] = result
+
+        print("[I] {0}: {1:.1f} ms importing {2} modules, {3:.1f} ms in all".format(case_name, result["import_ms"], result["module_count"], result["wall_ms"]))
+        for module_name, self_time in sorted(result["modules"].items(), key=lambda module: module[1], reverse=True)[:top_count]:
+            print("\t[i] {0:.2f} ms {1}".format(self_time, module_name))
+
+        # Check the case against the budget
+        if result["import_ms"] > budget:
+            failures.append("{0} spent {1:.1f} ms importing, over the {2:.1f} ms budget".format(case_name, result["import_ms"], budget))
+        if wall_budget != None and result["wall_ms"] > wall_budget:
+            failures.append("{0} took {1:.1f} ms, over the {2:.1f} ms budget".format(case_name, result["wall_ms"], wall_budget))
+        if len(result["heavy_modules"]) > 0:
+            failures.append("{0} imported {1}".format(case_name, ", ".join(result["heavy_modules"])))
+
+    if output_file != None:
+        with open(output_file, "w") as open_output_file:
+            json.dump(results, open_output_file, indent=2)
+        print("[I] Results saved to {}".format(output_file))
+
+    # Fail with a non-zero exit status, so scripts and CI can tell
+    if len(failures) > 0:
+        for failure in failures:
+            print("[E] {}".format(failure))
+        sys.exit(1)
+
+    print("[I] All cases within budget")
+
+# Run the check
+if __name__ == "__main__":
+    main(sys.argv[1:])
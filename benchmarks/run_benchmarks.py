@@ -0,0 +1,373 @@
+#!/usr/bin/python3
+
+"""
+run_benchmarks.py
+
+Offline end-to-end benchmarks of bulk-yt-mp3. Each scenario downloads a queue of synthetic videos through process_queued_videos(), exactly as the program does, but with pytube replaced by the stand-in in fake_youtube/ and YouTube's media servers replaced by fake_server.py. Nothing touches the network.
+
+Each scenario runs in its own process, so its peak memory is its own, and reports tracks per second, MB per second of audio downloaded, the median and 95th percentile time spent in each stage, and peak RSS. The results are printed and saved as JSON, and can be compared against an earlier run to spot regressions between commits. With --mixed-lengths, every track is three minutes long except the last, which is an hour long mix, with stream sizes to match, which is the worst case for downloading in queue order; compare the threaded and threaded-longest scenarios with a bandwidth limit to see what ordering longest first saves.
+
+USAGE:
+    python run_benchmarks.py [-h] [-n TRACKS] [-j JOBS] [--size BYTES] [--latency SECONDS] [--lookup-latency SECONDS] [--bandwidth RATE] [--scenarios NAMES] [--mixed-lengths] [--fake-ffmpeg] [-o OUTPUT_FILE] [--compare OLD_OUTPUT_FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import resource
+import tempfile
+import threading
+import contextlib
+import subprocess
+import importlib.util
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+
+# Scenarios, as process_queued_videos() keyword arguments, plus the order_video_queue() order
+SCENARIOS = {
+    "sequential": {"use_threading": False},
+    "threaded": {"use_threading": True},
+    "threaded-longest": {"use_threading": True, "order": "longest"},
+    "threaded-stream": {"use_threading": True, "streaming": True},
+    "threaded-batch": {"use_threading": True, "convert_batch_size": 4},
+    "async": {"use_threading": False, "use_async": True}
+}
+DEFAULT_SCENARIOS = ["sequential", "threaded", "threaded-batch"]
+
+# Download manager methods timed as stages
+TIMED_METHODS = {
+    "resolve_video": "resolve",
+    "download": "download",
+    "convert": "convert",
+    "convert_batch": "convert_batch",
+    "stream_and_convert": "stream"
+}
+
+class StageTimer(object):
+    """ Record how long each call to a stage takes
+
+    Methods:
+        __init__() - Initialize the object
+        wrap() - Time every call to a function
+        summary() - Get the median and 95th percentile of each stage
+    """
+
+    def __init__(self):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+        """
+
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, stage_name, function):
+        """ Time every call to a function
+
+        Arguments:
+            self - self - This object
+            stage_name - string - Name to record the calls under
+            function - callable - The function to time
+
+        Returns:
+            timed_function - callable - The function, recording the duration of each call
+        """
+
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                with self.lock:
+                    self.durations.setdefault(stage_name, []).append(duration)
+
+        return timed_function
+
+    def summary(self):
+        """ Get the number of calls and the median and 95th percentile duration of each stage
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            summary - dict - Count, p50 and p95 in seconds, keyed by stage name
+        """
+
+        summary = {}
+        with self.lock:
+            for stage_name, durations in self.durations.items():
+                durations = sorted(durations)
+                summary[stage_name] = {
+                    "count": len(durations),
+                    "p50": get_percentile(durations, 50),
+                    "p95": get_percentile(durations, 95)
+                }
+
+        return summary
+
+def get_percentile(sorted_values, percentile):
+    """ Get a percentile of some values, using the nearest rank
+
+    Arguments:
+        sorted_values - list of floats - The values, in ascending order
+        percentile - int - The percentile
+
+    Returns:
+        value - float - The value at the percentile
+    """
+
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[rank - 1]
+
+def load_program():
+    """ Load bulk-yt-mp3.py as a module, since its name can't be imported
+
+    Returns:
+        program - module - The loaded program
+    """
+
+    program_spec = importlib.util.spec_from_file_location("bulk_yt_mp3", os.path.join(REPOSITORY_DIRECTORY, "bulk-yt-mp3.py"))
+    program = importlib.util.module_from_spec(program_spec)
+    program_spec.loader.exec_module(program)
+    return program
+
+def run_scenario(scenario_name, config):
+    """ Run one scenario in this process, against a fresh server and output directory
+
+    Arguments:
+        scenario_name - string - Name of the scenario
+        config - dict - Benchmark settings
+
+    Returns:
+        result - dict - Measurements of the run
+    """
+
+    # Put the pytube stand-in ahead of any installed pytube, and the program's own modules after it
+    sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, "fake_youtube"))
+    sys.path.insert(1, REPOSITORY_DIRECTORY)
+    if config["fake_ffmpeg"] == True:
+        os.environ["PATH"] = os.path.join(BENCHMARK_DIRECTORY, "bin") + os.pathsep + os.environ.get("PATH", "")
+
+    sys.path.insert(2, BENCHMARK_DIRECTORY)
+    import fake_server
+
+    server = fake_server.BenchmarkServer(0, config["latency"], config["bandwidth"])
+    os.environ["BENCH_MEDIA_URL"] = server.start()
+    os.environ["BENCH_TRACK_SIZE"] = str(config["size"])
+    os.environ["BENCH_LOOKUP_LATENCY"] = str(config["lookup_latency"])
+    if config["mixed_lengths"] == True:
+        os.environ["BENCH_LENGTHS"] = ",".join(str(length) for length in get_mixed_lengths(config["tracks"]))
+
+    program = load_program()
+    from lib import manager
+    from lib import tag_editor
+    from lib import transport
+
+    # Route requests through the shared transport, as main() does
+    http_transport = transport.Transport()
+    http_transport.install()
+
+    # Time each stage of the download manager and the tag editor
+    stage_timer = StageTimer()
+    download_manager = manager.DownloadManager(False, transport=http_transport)
+    for method_name, stage_name in TIMED_METHODS.items():
+        setattr(download_manager, method_name, stage_timer.wrap(stage_name, getattr(download_manager, method_name)))
+    tag_editor.Editor.insert_metadata = stage_timer.wrap("tag", tag_editor.Editor.insert_metadata)
+
+    # Count the bytes of every audio stream that is picked for download
+    downloaded_bytes = [0]
+    get_audio_stream = download_manager.get_audio_stream
+    def counted_get_audio_stream(video_url):
+        stream = get_audio_stream(video_url)
+        downloaded_bytes[0] += stream.filesize
+        return stream
+    download_manager.get_audio_stream = counted_get_audio_stream
+
+    video_urls = ["https://www.youtube.com/watch?v=bench{:06d}".format(c) for c in range(config["tracks"])]
+    outdir = tempfile.mkdtemp(prefix="bulk-yt-mp3-benchmark-")
+    try:
+        # Keep the program's own output out of the results
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            scenario = dict(SCENARIOS[scenario_name])
+            order = scenario.pop("order", "queue")
+
+            start = time.perf_counter()
+            video_queue = program.build_video_queue(download_manager, video_urls, None, outdir, None, config["jobs"])
+            if order != "queue":
+                video_queue = program.order_video_queue(download_manager, video_queue, order)
+            results, errors = program.process_queued_videos(False, download_manager=download_manager, video_queue=video_queue, worker_count=config["jobs"], **scenario)
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+        server.stop()
+
+    return {
+        "tracks": len(results),
+        "failures": len(errors),
+        "seconds": elapsed,
+        "tracks_per_second": len(results) / elapsed,
+        "mb_per_second": downloaded_bytes[0] / (1024 * 1024) / elapsed,
+        "stages": stage_timer.summary(),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "http": http_transport.stats()
+    }
+
+def get_mixed_lengths(track_count):
+    """ Get the lengths of a queue of three minute tracks ending in an hour long mix
+
+    Arguments:
+        track_count - int - Number of tracks
+
+    Returns:
+        lengths - list of ints - Length of each track in seconds, in queue order
+    """
+
+    return [180] * (track_count - 1) + [3600]
+
+def get_commit():
+    """ Get the commit being benchmarked
+
+    Returns:
+        commit - string or None - The current commit hash, or None outside of a git checkout
+    """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_DIRECTORY, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(scenario_name, result):
+    """ Print the measurements of a scenario
+
+    Arguments:
+        scenario_name - string - Name of the scenario
+        result - dict - Measurements of the run
+    """
+
+    print("[I] {0}: {1} tracks ({2} failed) in {3:.2f}s, {4:.2f} tracks/s, {5:.2f} MB/s, peak RSS {6} KB".format(scenario_name, result["tracks"], result["failures"], result["seconds"], result["tracks_per_second"], result["mb_per_second"], result["peak_rss_kb"]))
+    for stage_name, stage in sorted(result["stages"].items()):
+        print("\t[i] {0}: {1} calls, p50 {2:.4f}s, p95 {3:.4f}s".format(stage_name, stage["count"], stage["p50"], stage["p95"]))
+
+def compare_results(old_results, new_results):
+    """ Print how throughput changed since an earlier run
+
+    Arguments:
+        old_results - dict - Results of the earlier run
+        new_results - dict - Results of this run
+    """
+
+    print("[I] Compared with {}:".format(old_results.get("commit") or "earlier run"))
+    for scenario_name, result in new_results["scenarios"].items():
+        old_result = old_results["scenarios"].get(scenario_name)
+        if old_result == None:
+            continue
+
+        change = result["tracks_per_second"] / old_result["tracks_per_second"] - 1
+        print("\t[i] {0}: {1:.2f} -> {2:.2f} tracks/s ({3:+.1%})".format(scenario_name, old_result["tracks_per_second"], result["tracks_per_second"], change))
+
+def main(argv):
+    """ Process command line arguments and run each scenario in its own process
+
+    Arguments:
+        argv - list - Provided CLI arguments
+    """
+
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:o:", ["help", "tracks=", "jobs=", "size=", "latency=", "lookup-latency=", "bandwidth=", "scenarios=", "mixed-lengths", "fake-ffmpeg", "output=", "compare=", "run-scenario="])
+    except getopt.GetoptError as err_msg:
+        print(err_msg)
+        exit(0)
+
+    # Set variables with default values
+    config = {
+        "tracks": 20,
+        "jobs": 4,
+        "size": 4 * 1024 * 1024,
+        "latency": 0.02,
+        "lookup_latency": 0.05,
+        "bandwidth": None,
+        "mixed_lengths": False,
+        "fake_ffmpeg": shutil.which("ffmpeg") == None
+    }
+    scenario_names = DEFAULT_SCENARIOS
+    output_file = "benchmark-results.json"
+    compare_file = None
+    child_scenario = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            exit(0)
+        elif opt in ("-n", "--tracks"):
+            config["tracks"] = int(arg)
+        elif opt in ("-j", "--jobs"):
+            config["jobs"] = int(arg)
+        elif opt == "--size":
+            config["size"] = int(arg)
+        elif opt == "--latency":
+            config["latency"] = float(arg)
+        elif opt == "--lookup-latency":
+            config["lookup_latency"] = float(arg)
+        elif opt == "--bandwidth":
+            sys.path.insert(0, BENCHMARK_DIRECTORY)
+            import fake_server
+            config["bandwidth"] = fake_server.parse_rate(arg)
+        elif opt == "--scenarios":
+            scenario_names = arg.split(",")
+            for scenario_name in scenario_names:
+                if scenario_name not in SCENARIOS:
+                    print("[E] Unknown scenario: {0}, choose from {1}".format(scenario_name, ", ".join(SCENARIOS)))
+                    exit(0)
+        elif opt == "--mixed-lengths":
+            config["mixed_lengths"] = True
+        elif opt == "--fake-ffmpeg":
+            config["fake_ffmpeg"] = True
+        elif opt in ("-o", "--output"):
+            output_file = arg
+        elif opt == "--compare":
+            compare_file = arg
+        elif opt == "--run-scenario":
+            child_scenario = arg
+
+    # Run a single scenario and hand its result back to the parent process
+    if child_scenario != None:
+        config = json.loads(sys.stdin.read())
+        result = run_scenario(child_scenario, config)
+        sys.stdout.write(json.dumps(result))
+        return
+
+    results = {
+        "commit": get_commit(),
+        "timestamp": time.time(),
+        "config": config,
+        "scenarios": {}
+    }
+
+    for scenario_name in scenario_names:
+        child_process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", scenario_name], input=json.dumps(config).encode(), stdout=subprocess.PIPE)
+        if child_process.returncode != 0:
+            print("[E] {} failed, see the error above".format(scenario_name))
+            continue
+
+        result = json.loads(child_process.stdout.decode())
+        results["scenarios"][scenario_name] = result
+        print_result(scenario_name, result)
+
+    with open(output_file, "w") as open_output_file:
+        json.dump(results, open_output_file, indent=2)
+    print("[I] Results saved to {}".format(output_file))
+
+    if compare_file != None:
+        with open(compare_file) as open_compare_file:
+            compare_results(json.load(open_compare_file), results)
+
+# Run the benchmarks
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -10,63 +10,681 @@ By Brandon REDACTED
 
 import os
 import sys
-import time
 import getopt
-import threading
-from lib import manager
-from lib import tag_editor
 
-def process_queued_videos(verbosity, use_threading, download_manager, video_queue):
-    """ Download all queued videos and create threads if enabled
+# The lib modules are imported by the functions that use them, so that pytube, eyed3 and asyncio are only loaded on the code paths that need them, and help, version, argument errors and daemon clients start quickly
+
+# Options a daemon can apply to a single job, by flag, with the name each is sent to the daemon under
+JOB_OPTION_FLAGS = {
+    "-m": "use_threading", "--multithreading": "use_threading",
+    "-j": "worker_count", "--jobs": "worker_count",
+    "-S": "streaming", "--stream": "streaming",
+    "--no-library": "use_library",
+    "--async": "use_async",
+    "--job-timeout": "job_timeout",
+    "--convert-batch": "convert_batch_size",
+    "--format": "output_format",
+    "--stream-policy": "stream_policy",
+    "--replaygain": "replaygain",
+    "--order": "order",
+    "--priority": "priority_sources",
+    "--order-window": "order_window"
+}
+
+# Options that set up the process itself, which a running daemon can't change for a job
+PROCESS_OPTION_FLAGS = ("--no-cache", "--refresh", "--cache-file", "--cache-ttl", "--connections", "--segment-size", "--max-rate", "--host-connections", "--adaptive", "--encoder", "--cover-size", "--metrics-out", "--profile")
+
+# Values each job option that takes a choice can have
+JOB_OPTION_CHOICES = {
+    "output_format": ("mp3", "m4a", "opus"),
+    "stream_policy": ("codec", "best", "smallest"),
+    "order": ("queue", "longest")
+}
+
+# Sources that --priority can rank
+PRIORITY_SOURCES = ("resumed", "videos", "playlist")
+
+def check_job_options(options):
+    """ Check the type and value of each job option sent to a daemon, as the command line checks its flags, so a bad job is refused before it is queued
+
+    Arguments:
+        options - dict - Job options, keyed by their names in JOB_OPTION_FLAGS
+
+    Raises:
+        ValueError - An option is unknown or has a value of the wrong type or out of range
+    """
+
+    for option_name, value in options.items():
+        if option_name in ("use_threading", "streaming", "use_library", "use_async", "replaygain"):
+            if isinstance(value, bool) == False:
+                raise ValueError("{} must be true or false".format(option_name))
+
+        elif option_name in ("worker_count", "convert_batch_size", "order_window"):
+            if isinstance(value, int) == False or isinstance(value, bool) == True:
+                raise ValueError("{} must be an integer".format(option_name))
+            if value < (0 if option_name == "order_window" else 1):
+                raise ValueError("{0} must be at least {1}".format(option_name, 0 if option_name == "order_window" else 1))
+
+        elif option_name == "job_timeout":
+            if value != None and (isinstance(value, (int, float)) == False or isinstance(value, bool) == True or value <= 0):
+                raise ValueError("job_timeout must be a positive number of seconds")
+
+        elif option_name in JOB_OPTION_CHOICES:
+            if value not in JOB_OPTION_CHOICES[option_name]:
+                raise ValueError("{0} must be one of {1}".format(option_name, ", ".join(JOB_OPTION_CHOICES[option_name])))
+
+        elif option_name == "priority_sources":
+            if value != None and (isinstance(value, list) == False or any(source not in PRIORITY_SOURCES for source in value)):
+                raise ValueError("priority_sources must be a list of {}".format(", ".join(PRIORITY_SOURCES)))
+
+        else:
+            raise ValueError("Unknown job option: {}".format(option_name))
+
+def process_queued_videos(verbosity, use_threading, download_manager, video_queue, worker_count=4, streaming=False, controller=None, use_async=False, job_timeout=None, convert_batch_size=1, job_journal=None):
+    """ Download all queued videos, using a pool of worker threads if enabled
 
     Arguments:
         verbosity - bool - Verbose output
         use_threading - bool - Use multithreading
         download_manager - Manager object - Download management tool
-        video_queue - list of tuples - A list of video url/title/filename tuples
+        video_queue - iterable of tuples - Video url/title/filename/metadata tuples, which may be a generator
+        worker_count - int - Number of worker threads to use with multithreading
+        streaming - bool - Pipe downloads straight into ffmpeg instead of using temporary files
+        controller - AdaptiveController object or None - Adjusts how many of the worker_count download threads may download at once, and retries throttled downloads
+        use_async - bool - Run worker_count downloads at once as coroutines on an asyncio event loop instead of threads
+        job_timeout - float or None - Seconds each download may take with the asyncio engine before it is cancelled
+        convert_batch_size - int - Number of downloads to convert with each ffmpeg invocation when multithreading
+        job_journal - Journal object or None - Records the stage each video reaches, so an interrupted run can be resumed
+
+    Returns:
+        results - dict - Resulting MP3 filenames, keyed by queue position
+        errors - dict - Exceptions raised by failed downloads, keyed by queue position
     """
+    from lib import manager
+    from lib import pipeline
+    from lib import tag_editor
+
     # Initialize the tag editor
-    editor = tag_editor.Editor(verbosity)
+    editor = tag_editor.Editor(verbosity, download_manager.artwork_cache, download_manager.recorder)
 
     # Initialize the downloader
-    downloader = manager.Downloader(download_manager, editor)
+    downloader = manager.Downloader(download_manager, editor, streaming, controller, job_journal)
+
+    # URL of each queued video, by queue position, for reporting failures
+    queued_urls = []
     
     """
-    Logic for downloading queued videos with multithreading
+    Logic for downloading queued videos with multithreading. Each video passes through a download, a conversion and a tagging stage, and each stage has its own pool of worker threads joined to the next by a bounded queue. The download pool is sized by worker_count since it mostly waits on the network, while the conversion pool is sized to the number of CPU cores that ffmpeg can keep busy
     """
+    # If the asyncio engine is enabled
+    if use_async == True:
+        import asyncio
+        from lib import async_manager
+
+        print("[I] Starting asyncio engine with {} concurrent downloads, downloads now in progress...".format(worker_count))
+
+        # Note the URL of each video as the engine reads it off the queue
+        def note_queued_videos():
+            for video in video_queue:
+                queued_urls.append(video[0])
+                yield video
+
+        async_downloader = async_manager.AsyncDownloader(download_manager, editor, worker_count, job_timeout, job_journal=job_journal)
+        results, errors = asyncio.run(async_downloader.run(note_queued_videos()))
+
     # If multithreading is enabled
-    if use_threading == True:
-        # Initialize a list of all threads
-        thread_list = []
+    elif use_threading == True:
+        # Size the conversion pool to the CPU cores
+        convert_worker_count = os.cpu_count() or 1
 
         # Output message
-        print("[I] Generating download threads...")
-        
-        # Create a new thread for each video and add it to the list
+        print("[I] Starting {0} download threads and {1} conversion threads, downloads now in progress...".format(worker_count, convert_worker_count))
+
+        # Build the pipeline, merging downloading and conversion into one stage when streaming
+        if streaming == True:
+            download_pipeline = pipeline.Pipeline([
+                ("stream", downloader.stream_stage, worker_count),
+                ("tag", downloader.tag_stage, 1)
+            ])
+        elif convert_batch_size > 1:
+            download_pipeline = pipeline.Pipeline([
+                ("download", downloader.download_stage, worker_count),
+                ("convert", downloader.convert_batch_stage, convert_worker_count, convert_batch_size),
+                ("tag", downloader.tag_stage, 1)
+            ])
+        else:
+            download_pipeline = pipeline.Pipeline([
+                ("download", downloader.download_stage, worker_count),
+                ("convert", downloader.convert_stage, convert_worker_count),
+                ("tag", downloader.tag_stage, 1)
+            ])
+
+        # Start the pipeline and feed it the queue
+        download_pipeline.start()
+
+        c = 0
         for video in video_queue:
-            new_thread = threading.Thread(target=downloader.download_and_convert, args=(video[0], video[1], video[2], video[3]))
-            thread_list.append(new_thread) 
+            queued_urls.append(video[0])
+            download_pipeline.submit(c, video[0], video[1], video[2], video[3])
 
-            # Output message
-            print("\t[i] Created thread for video: {}".format(video[0]))
+            # Verbose output
+            if verbosity == True:
+                print("\t[d] Queued video for download: {}".format(video[0]))
 
-        # Start all the threads, then wait for them to finish
-        print("[I] Starting threads, downloads now in progress...")
-        for thread in thread_list:
-            thread.start()
-        for thread in thread_list:
-            thread.join()
+            c += 1
 
-        # Output message
-        print("[I] Downloads complete. Adding tags...")
+        # Wait for every video to pass through all stages
+        results, errors = download_pipeline.join()
 
     else:
         # Download normally
         print("[I] Downloads now in progress...")
+        results = {}
+        errors = {}
+
+        c = 0
         for video in video_queue:
+            queued_urls.append(video[0])
             print("\t[i] Downloading {0} ({1})".format(video[1], video[0]))
-            downloader.download_and_convert(video[0], video[1], video[2], video[3])
-        
+            try:
+                results[c] = downloader.download_and_convert(video[0], video[1], video[2], video[3])
+            except Exception as err_msg:
+                errors[c] = err_msg
+
+            c += 1
+
+    # Count the outcome of every video
+    download_manager.recorder.count("videos_succeeded", len(results))
+    download_manager.recorder.count("videos_failed", len(errors))
+
+    # Report any videos that failed to download
+    print("[I] Downloads complete. {0} of {1} videos succeeded, {2} failed.".format(len(results), len(queued_urls), len(errors)))
+    for video_position, err_msg in sorted(errors.items()):
+        print("\t[E] {0}: {1}".format(queued_urls[video_position], err_msg))
+
+    return results, errors
+
+def build_video_queue(download_manager, video_urls, playlist_url, outdir, tag_manifest, worker_count, library_index=None, queued_videos=None, deferred_links=None, job_journal=None):
+    """ Build the download queue, handing out each video as soon as it has been looked up
+
+    All videos to be downloaded must be added to the queue, which is a sequence of tuples containing the video's URL, its title, the desired filename for the end download, and a variable containing either Nonetype or tag data, if it was provided. If the video is to be downloaded into a subdirectory inside of the main output directory, say in the case of an album playlist, said subdirectory must be appended to the beginning of the filename. The download manager keeps the metadata it fetched for each URL while the queue is built, so downloading a video doesn't look it up a second time. The queue is a generator, so the first video can be downloaded while the rest of a long playlist is still being looked up
+
+    Arguments:
+        download_manager - Manager object - Download management tool
+        video_urls - list of strings - URLs of individual videos to download
+        playlist_url - string or None - URL of a playlist to download
+        outdir - string - Directory to download to
+        tag_manifest - TagManifest object or None - Tag data for the videos, by video ID or queue position
+        worker_count - int - Number of videos to look up at once
+        library_index - LibraryIndex object or None - Index of videos downloaded by earlier runs, which are linked into place instead of downloaded again
+        queued_videos - dict or None - Filled with a filename/tagged tuple for each queued video, keyed by video ID
+        deferred_links - list or None - Filled with video ID/directory tuples for videos queued more than once, to be linked into place once downloaded
+        job_journal - Journal object or None - Records each queued video, and skips videos already in it
+
+    Returns:
+        video_queue - generator of tuples - A video url/title/filename/metadata tuple for each video
+    """
+
+    if queued_videos == None:
+        queued_videos = {}
+    if deferred_links == None:
+        deferred_links = []
+
+    """
+    Logic for handling and queueing individual videos, specified with either the -s/--single option, or passed as a program argument. This essentially fetches the title associated with each YouTube video URL, builds a filename based off of it and the output directory, and adds all of this data to the download queue
+    """
+    
+    # Handle individual videos
+    if len(video_urls) > 0:
+        # Output message
+        print("[I] Adding video(s) to queue...")
+
+        yield from queue_videos(download_manager, video_urls, outdir, tag_manifest, worker_count, library_index, queued_videos, deferred_links, job_journal)
+
+    """
+    Logic for building the queue from playlists specified with -p/--playlist. It retrieves the playlists title and creates a subdirectory with it, then looks up the URL and title of each of its videos as the playlist is read, giving each video a filename derived from the subdirectory name and the video's title before adding to the queue. If the subdirectory already exists, only videos that aren't in it yet are queued
+    """
+    # Parse playlists and add their videos to the queue
+    if playlist_url != None:
+        # Get the playlist title
+        playlist_title = download_manager.get_playlist_title(playlist_url)
+
+        # Create the directory to download to, unless this is a sync of an earlier download
+        playlist_download_directory = os.path.join(outdir, "{}".format(playlist_title))
+        os.makedirs(playlist_download_directory, exist_ok=True)
+
+        # Display the name of the playlist and where the outdir is
+        print("[I] Name of playlist: {}".format(playlist_title))
+        print("[I] Download location for playlist videos: {}".format(playlist_download_directory))
+        print("[I] Adding video(s) to queue...")
+
+        # Add a filename for each video from the playlist as it is looked up
+        playlist_video_urls = download_manager.iter_playlist_urls(playlist_url)
+        yield from queue_videos(download_manager, playlist_video_urls, playlist_download_directory, tag_manifest, worker_count, library_index, queued_videos, deferred_links, job_journal)
+
+def queue_videos(download_manager, video_urls, download_directory, tag_manifest, worker_count, library_index, queued_videos, deferred_links, job_journal=None):
+    """ Look up videos concurrently and yield a queue entry for each one that still needs downloading
+
+    Videos already in the library index are linked into the download directory instead, and videos already queued by this run are deferred until their first download has finished.
+
+    Arguments:
+        download_manager - Manager object - Download management tool
+        video_urls - iterable of strings - URLs of the videos, which may be a generator
+        download_directory - string - Directory to download the videos to
+        tag_manifest - TagManifest object or None - Tag data for the videos, by video ID or queue position
+        worker_count - int - Number of videos to look up at once
+        library_index - LibraryIndex object or None - Index of videos downloaded by earlier runs
+        queued_videos - dict - Filename/tagged tuple for each queued video, keyed by video ID
+        deferred_links - list - Video ID/directory tuples for videos queued more than once
+        job_journal - Journal object or None - Records each queued video, and skips videos already in it
+
+    Returns:
+        video_queue - generator of tuples - A video url/title/filename/metadata tuple for each video
+    """
+
+    from lib import scheduler
+
+    # IDs of videos handed to the lookup workers but not yet queued, so repeats can be spotted before they are looked up
+    pending_video_ids = set()
+    selected_videos = select_videos(download_manager, video_urls, download_directory, tag_manifest, library_index, queued_videos, deferred_links, pending_video_ids, job_journal)
+
+    # Look up the videos concurrently, in order
+    resolve = lambda video: download_manager.resolve_video(video[0])
+    for video, resolved_video, err_msg in scheduler.imap(resolve, selected_videos, worker_count):
+        video_url, video_id, video_metadata = video
+        pending_video_ids.discard(video_id)
+
+        # Skip videos that could not be looked up
+        if resolved_video == None:
+            print("\t[E] Skipping {0}: {1}".format(video_url, err_msg))
+            continue
+
+        # Build the filename and queue video
+        video_filename = os.path.join(download_directory, "{0}.{1}".format(resolved_video.title, download_manager.output_format))
+        queued_videos[video_id] = (video_filename, video_metadata != None)
+
+        # Skip videos that a resumed run has already queued from its journal
+        if job_journal != None and job_journal.get_stage(video_filename) != None:
+            continue
+
+        # Skip videos that were downloaded by an earlier run that wasn't indexed
+        if os.path.exists(video_filename) == True:
+            print("\t[i] \"{0}\" has already been downloaded.".format(resolved_video.title))
+            continue
+
+        # Output message
+        print("\t[i] \"{0}\" added to queue.".format(resolved_video.title))
+
+        # Record the video in the journal, with everything needed to queue it again on resume
+        if job_journal != None:
+            job_journal.record(video_filename, "queued", url=video_url, video_id=video_id, title=resolved_video.title, metadata=video_metadata)
+
+        yield (video_url, resolved_video.title, video_filename, video_metadata)
+
+def select_videos(download_manager, video_urls, download_directory, tag_manifest, library_index, queued_videos, deferred_links, pending_video_ids, job_journal=None):
+    """ Pair each video URL with its ID and tag data, skipping videos that don't need downloading
+
+    Arguments:
+        download_manager - Manager object - Download management tool
+        video_urls - iterable of strings - URLs of the videos, which may be a generator
+        download_directory - string - Directory to download the videos to
+        tag_manifest - TagManifest object or None - Tag data for the videos, by video ID or queue position
+        library_index - LibraryIndex object or None - Index of videos downloaded by earlier runs
+        queued_videos - dict - Filename/tagged tuple for each queued video, keyed by video ID
+        deferred_links - list - Video ID/directory tuples for videos queued more than once
+        pending_video_ids - set - IDs of videos selected but not yet queued
+        job_journal - Journal object or None - Journal of a resumed run, whose videos are skipped without being looked up again
+
+    Returns:
+        selected_videos - generator of tuples - A URL/ID/metadata tuple for each video to look up
+    """
+
+    from lib import library
+
+    c = 0
+    for video_url in video_urls:
+        video_id = download_manager.get_video_id(video_url)
+
+        # If tag data was provided, look up this video's for adding to the videos tuple
+        if tag_manifest != None:
+            video_metadata = tag_manifest.get(video_id, c)
+        else:
+            # If not, create a variable to act as a placeholder
+            video_metadata = None
+
+        c += 1
+
+        # If the video was downloaded by an earlier run, link it into place
+        if library_index != None:
+            existing_file = library_index.lookup(video_id)
+            if existing_file != None:
+                target_file = os.path.join(download_directory, os.path.basename(existing_file))
+                if os.path.exists(target_file) == False:
+                    library.place_file(existing_file, target_file)
+                    print("\t[i] \"{}\" is already in the library, linked into place.".format(os.path.basename(existing_file)))
+                continue
+
+            # If the scan found a file for the video's known title on disk, index it under the video instead of looking the video up
+            video_title = download_manager.get_known_title(video_url) if library_index.has_untracked_files() == True else None
+            if video_title != None and library_index.adopt(video_id, os.path.join(download_directory, "{0}.{1}".format(video_title, download_manager.output_format))) == True:
+                print("\t[i] \"{}\" has already been downloaded.".format(video_title))
+                continue
+
+        # If a resumed run already queued the video here, it is either finished or resumed from the journal, so don't look it up again
+        if job_journal != None:
+            journaled_filename = job_journal.get_video_filename(video_id, download_directory)
+            if journaled_filename != None:
+                queued_videos[video_id] = (journaled_filename, video_metadata != None)
+                continue
+
+        # If the video is already queued by this run, link it once it has been downloaded
+        if video_id in pending_video_ids or video_id in queued_videos:
+            deferred_links.append((video_id, download_directory))
+            continue
+
+        pending_video_ids.add(video_id)
+        yield video_url, video_id, video_metadata
+
+def order_video_queue(download_manager, video_queue, order="queue", get_priority=None, window=0):
+    """ Reorder the download queue, by priority class and then, if ordering longest first, by the length of each video
+
+    Longest first keeps a long video from starting last and running on alone after every other worker has gone idle, which shortens the whole batch. Lengths come from the lookups made while the queue was built, and a video whose length isn't known, such as one resumed from a journal, is taken to be as long as the average so far. Stream sizes aren't known until a video is downloaded, but for a given bitrate they follow the length.
+
+    When the whole queue is reordered, each video's watch page and stream manifest are dropped once its length has been read, so memory doesn't grow with the size of the batch and signed stream URLs can't expire before the last videos are downloaded. Each manifest is then fetched again just before its download. A bounded window keeps the manifests of the videos in it instead.
+
+    Arguments:
+        download_manager - Manager object - Download management tool
+        video_queue - iterable of tuples - Video url/title/filename/metadata tuples, which may be a generator
+        order - string - "queue" to keep the queue order within each priority class, or "longest" to put the longest videos first
+        get_priority - callable or None - Gives the priority class of a video tuple, lowest first, or None for a single class
+        window - int - Number of videos to reorder at once, or 0 to look every video up before the first download starts
+
+    Returns:
+        video_queue - generator of tuples - The video tuples in their new order
+    """
+
+    from lib import scheduler
+
+    known_durations = []
+
+    def get_order_key(video):
+        # Every video is held until the whole queue is looked up, so only keep what ordering needs
+        if window == 0:
+            download_manager.drop_stream_manifest(video[0])
+
+        priority = get_priority(video) if get_priority != None else 0
+        if order != "longest":
+            return (priority,)
+
+        # Estimate unknown lengths from the known ones
+        duration = download_manager.get_known_duration(video[0])
+        if duration == None or duration <= 0:
+            duration = sum(known_durations) / len(known_durations) if len(known_durations) > 0 else 0
+        else:
+            known_durations.append(duration)
+
+        return (priority, -duration)
+
+    return scheduler.order_jobs(video_queue, get_order_key, window)
+
+def run_job(verbosity, use_threading, download_manager, video_urls, playlist_url, outdir, tag_manifest=None, use_library=True, worker_count=4, streaming=False, controller=None, use_async=False, job_timeout=None, convert_batch_size=1, resume=False, order="queue", priority_sources=None, order_window=0):
+    """ Download a set of videos and a playlist into an output directory, keeping its library index up to date
+
+    This is one run of the program, which a daemon repeats for each job it is sent. Each video's progress is recorded in a journal in the output directory, which is removed once every video has succeeded. If resuming, the videos an interrupted run queued but didn't finish are queued first, straight from its journal, each picking up from the last stage it completed, and the rest of the run's inputs are then queued as usual.
+
+    Arguments:
+        verbosity - bool - Verbose output
+        use_threading - bool - Use multithreading
+        download_manager - Manager object - Download management tool
+        video_urls - list of strings - URLs of individual videos to download
+        playlist_url - string or None - URL of a playlist to download
+        outdir - string - Directory to download to
+        tag_manifest - TagManifest object or None - Tag data for the videos, by video ID or queue position
+        use_library - bool - Skip or link videos already in the output directory's library index
+        worker_count - int - Number of worker threads to use with multithreading
+        streaming - bool - Pipe downloads straight into ffmpeg instead of using temporary files
+        controller - AdaptiveController object or None - Adjusts how many downloads run at once
+        use_async - bool - Use the asyncio engine
+        job_timeout - float or None - Seconds each download may take with the asyncio engine
+        convert_batch_size - int - Number of downloads to convert with each ffmpeg invocation
+        resume - bool - Resume the interrupted run recorded in the output directory's journal, using its video URLs and playlist URL if none are given
+        order - string - Order to download the videos in, "queue" or "longest" first
+        priority_sources - list of strings or None - Sources to download first, in order, out of "resumed", "videos" and "playlist"
+        order_window - int - Number of videos to reorder at once, or 0 to reorder the whole queue
+
+    Returns:
+        results - dict - Resulting MP3 filenames, keyed by queue position
+        errors - dict - Exceptions raised by failed downloads, keyed by queue position
+        queued_urls - list of strings - URL of each queued video, by queue position
+    """
+
+    import itertools
+    from lib import journal
+    from lib import library
+
+    # Open the journal, reading back the interrupted run if resuming. A daemon's jobs may name output directories that don't exist yet
+    os.makedirs(outdir, exist_ok=True)
+    job_journal = journal.Journal(os.path.join(outdir, journal.JOURNAL_FILE_NAME))
+    run_inputs = None
+    if resume == True:
+        run_inputs = job_journal.resume()
+        if run_inputs == None:
+            print("[I] Nothing to resume in {}".format(outdir))
+            return {}, {}, []
+
+        if len(video_urls) == 0 and playlist_url == None:
+            video_urls = run_inputs["video_urls"]
+            playlist_url = run_inputs["playlist_url"]
+    else:
+        job_journal.start({"video_urls": video_urls, "playlist_url": playlist_url})
+
+    # Open the library index and bring it up to date with the output directory
+    library_index = None
+    if use_library == True:
+        library_index = library.LibraryIndex(outdir)
+        library_index.scan()
+
+    # Build the queue lazily, so downloads start as soon as the first video is known
+    queued_videos = {}
+    deferred_links = []
+    video_queue = build_video_queue(download_manager, video_urls, playlist_url, outdir, tag_manifest, worker_count, library_index, queued_videos, deferred_links, job_journal)
+
+    # Queue the interrupted run's unfinished videos first, read from the journal as they are needed
+    resumed_urls = set()
+    if run_inputs != None:
+        def resume_unfinished_videos():
+            for video_url, video_id, video_title, video_filename, video_metadata in job_journal.iter_unfinished():
+                queued_videos[video_id] = (video_filename, video_metadata != None)
+                resumed_urls.add(video_url)
+                print("\t[i] \"{0}\" resumed from the journal.".format(video_title))
+                yield (video_url, video_title, video_filename, video_metadata)
+
+        video_queue = itertools.chain(resume_unfinished_videos(), video_queue)
+
+    # Reorder the queue, if enabled
+    if order != "queue" or priority_sources != None:
+        get_priority = None
+        if priority_sources != None:
+            individual_urls = set(video_urls)
+
+            # Videos from sources that weren't listed go last
+            def get_priority(video):
+                if video[0] in resumed_urls:
+                    source = "resumed"
+                elif video[0] in individual_urls:
+                    source = "videos"
+                else:
+                    source = "playlist"
+
+                if source in priority_sources:
+                    return priority_sources.index(source)
+                return len(priority_sources)
+
+        if order_window == 0:
+            print("[I] Looking up every video before downloading, to order the queue")
+        video_queue = order_video_queue(download_manager, video_queue, order, get_priority, order_window)
+
+    # Note the URL of each video as it is taken off the queue
+    queued_urls = []
+    def note_queued_videos():
+        for video in video_queue:
+            queued_urls.append(video[0])
+            yield video
+
+    print("#######################")
+    print("#  STARTING DOWNLOAD  #")
+    print("#######################")
+    print("##> Download Location: {}".format(outdir))
+    print("#######################")
+
+    # Download all videos in the queue
+    try:
+        results, errors = process_queued_videos(verbosity, use_threading, download_manager, note_queued_videos(), worker_count, streaming, controller, use_async, job_timeout, convert_batch_size, job_journal)
+    finally:
+        job_journal.close()
+
+    # Remove the journal once every video has succeeded, leaving it for a resume otherwise
+    if len(errors) == 0:
+        os.remove(job_journal.journal_file)
+
+    # Link videos that were queued more than once into their other locations
+    for video_id, download_directory in deferred_links:
+        # Skip videos whose first download failed
+        if video_id not in queued_videos or os.path.isfile(queued_videos[video_id][0]) == False:
+            continue
+
+        video_filename = queued_videos[video_id][0]
+        target_file = os.path.join(download_directory, os.path.basename(video_filename))
+        if os.path.exists(target_file) == False:
+            library.place_file(video_filename, target_file)
+
+    # Add the finished downloads to the library index
+    if library_index != None:
+        for video_id, (video_filename, tagged) in queued_videos.items():
+            if os.path.isfile(video_filename) == True:
+                library_index.record(video_id, video_filename, tagged)
+        library_index.save()
+
+    return results, errors, queued_urls
+
+def enqueue_videos(download_manager, video_job_queue, video_urls, playlist_url, outdir, tag_manifest, worker_count, library_index=None):
+    """ Look up a set of videos and a playlist and add them to a shared job queue for workers to download, instead of downloading them here
+
+    Videos the queue's workers have finished are added to the library index first, so they aren't queued again.
+
+    Arguments:
+        download_manager - Manager object - Download management tool
+        video_job_queue - JobQueue object - The shared queue
+        video_urls - list of strings - URLs of individual videos to download
+        playlist_url - string or None - URL of a playlist to download
+        outdir - string - Directory to download to
+        tag_manifest - TagManifest object or None - Tag data for the videos, by video ID or queue position
+        worker_count - int - Number of videos to look up at once
+        library_index - LibraryIndex object or None - Index of videos already downloaded
+
+    Returns:
+        added_count - int - Number of videos added to the queue
+    """
+
+    # Bring the library index up to date with what the workers have downloaded into this directory
+    if library_index != None:
+        for video_id, video_filename, tagged in video_job_queue.get_completed():
+            if video_filename.startswith(outdir + os.sep) == True and os.path.isfile(video_filename) == True:
+                library_index.record(video_id, video_filename, tagged)
+        library_index.save()
+
+    # Queue every video that isn't downloaded or queued yet
+    added_count = 0
+    for video_url, video_title, video_filename, video_metadata in build_video_queue(download_manager, video_urls, playlist_url, outdir, tag_manifest, worker_count, library_index):
+        if video_job_queue.add(download_manager.get_video_id(video_url), video_url, video_title, video_filename, video_metadata) == True:
+            added_count += 1
+
+    return added_count
+
+def process_job_queue(verbosity, download_manager, video_job_queue, worker_count=4, streaming=False, controller=None):
+    """ Download videos leased from a shared job queue until every video in it is done or failed
+
+    Arguments:
+        verbosity - bool - Verbose output
+        download_manager - Manager object - Download management tool
+        video_job_queue - JobQueue object - The shared queue
+        worker_count - int - Number of videos to download at once
+        streaming - bool - Pipe downloads straight into ffmpeg instead of using temporary files
+        controller - AdaptiveController object or None - Limits and retries downloads, if set
+
+    Returns:
+        worker_stats - dict - Number of videos this worker completed, failed, and downloaded after losing the lease
+    """
+
+    from lib import job_queue
+    from lib import manager
+    from lib import tag_editor
+
+    # Initialize the tag editor and the downloader
+    editor = tag_editor.Editor(verbosity, download_manager.artwork_cache, download_manager.recorder)
+    downloader = manager.Downloader(download_manager, editor, streaming, controller)
+
+    queue_worker = job_queue.QueueWorker(video_job_queue, downloader, worker_count)
+    print("[I] Working on the job queue as {0} with {1} download threads...".format(queue_worker.worker_id, worker_count))
+    worker_stats = queue_worker.run()
+
+    # Count the outcome of every video
+    download_manager.recorder.count("videos_succeeded", worker_stats["completed"])
+    download_manager.recorder.count("videos_failed", worker_stats["failed"])
+
+    queue_stats = video_job_queue.stats()
+    print("[I] Job queue finished. This worker completed {0}, failed {1} and put {2} back to retry; {3} done and {4} failed in all.".format(worker_stats["completed"], worker_stats["failed"], worker_stats["retried"], queue_stats["done"], queue_stats["failed"]))
+
+    return worker_stats
+
+def submit_to_daemon(socket_file, video_urls, playlist_url, tag_data_file, outdir, wait_for_job=True, job_options=None):
+    """ Hand a job to a running daemon and, if asked to, wait for it and report how it went
+
+    Arguments:
+        socket_file - filename - Path of the daemon's socket
+        video_urls - list of strings - URLs of individual videos to download
+        playlist_url - string or None - URL of a playlist to download
+        tag_data_file - filename or None - CSV file of tag data for the videos
+        outdir - string - Directory to download to
+        wait_for_job - bool - Wait for the job to finish
+        job_options - dict or None - Options given on the command line that override the daemon's own for this job, keyed by their names in JOB_OPTION_FLAGS
+
+    Returns:
+        submitted - bool - Whether a daemon took the job, which is False if none is running
+    """
+
+    from lib import daemon
+
+    daemon_client = daemon.DaemonClient(socket_file)
+    try:
+        job_id = daemon_client.submit(video_urls, playlist_url, tag_data_file, outdir, job_options)
+    except OSError:
+        return False
+    except daemon.DaemonError as err_msg:
+        print("[E] The daemon refused the job: {}".format(err_msg))
+        return True
+
+    print("[I] Submitted job {0} to the daemon on {1}".format(job_id, socket_file))
+    if wait_for_job == False:
+        return True
+
+    # Wait for the job and report its outcome as a local run would
+    try:
+        job = daemon_client.wait(job_id)
+    except (OSError, daemon.DaemonError) as err_msg:
+        print("[E] Lost track of job {0}: {1}".format(job_id, err_msg))
+        return True
+
+    if job["state"] == "failed":
+        print("[E] Job {0} failed: {1}".format(job_id, job["error"]))
+        return True
+
+    print("[I] Downloads complete. {0} of {1} videos succeeded, {2} failed.".format(job["succeeded"], job["queued"], len(job["failures"])))
+    for video_url, err_msg in job["failures"]:
+        print("\t[E] {0}: {1}".format(video_url, err_msg))
+
+    return True
+
 def main(argv):
     """ Process command line arguments and control
     program work flow
@@ -76,7 +694,7 @@ def main(argv):
     """
 
     try:
-        opts, args = getopt.getopt(argv, "hvVmo:s:p:t:", ["help", "version", "verbosity", "multithreading", "outdir=", "single=", "playlist=", "tags="])
+        opts, args = getopt.getopt(argv, "hvVqmj:So:s:p:t:", ["help", "version", "verbosity", "quiet", "multithreading", "jobs=", "stream", "outdir=", "single=", "playlist=", "tags=", "no-cache", "refresh", "cache-file=", "cache-ttl=", "no-library", "connections=", "segment-size=", "max-rate=", "host-connections=", "adaptive", "async", "job-timeout=", "convert-batch=", "encoder=", "cover-size=", "metrics-out=", "profile=", "daemon", "socket=", "no-daemon", "no-wait", "status", "stop-daemon", "queue-db=", "worker", "format=", "stream-policy=", "replaygain", "resume", "order=", "priority=", "order-window="])
 
     except getopt.GetoptError as err_msg:
         print(err_msg)
@@ -84,7 +702,41 @@ def main(argv):
 
     # Set variables with default values
     verbosity = False
+    quiet = False
     use_threading = False
+    worker_count = 4
+    streaming = False
+    use_cache = True
+    refresh_cache = False
+    cache_file = None
+    cache_ttl = None
+    use_library = True
+    connection_count = 1
+    segment_size = 1024 * 1024
+    max_rate = None
+    host_connection_count = 8
+    use_adaptive = False
+    use_async = False
+    job_timeout = None
+    convert_batch_size = 1
+    encoder = "ffmpeg"
+    output_format = "mp3"
+    stream_policy = "codec"
+    replaygain = False
+    cover_size = None
+    metrics_directory = None
+    profile_directory = None
+    run_as_daemon = False
+    use_daemon = True
+    wait_for_job = True
+    daemon_action = None
+    socket_file = None
+    queue_file = None
+    run_as_worker = False
+    resume = False
+    order = "queue"
+    priority_sources = None
+    order_window = 0
     outdir = os.getcwd()
     video_urls = []
     playlist_url = None
@@ -93,9 +745,11 @@ def main(argv):
     # Process options
     for opt, arg in opts:
         if opt in ("-h", "--help"):
-            # Display the help message and exit
+            # Display the help message and exit, loading only the default paths
+            from lib import constants
+
             print("USAGE:")
-            print("\t{} [-h] [-v] [-V] [-m] [-o OUTPUT_DIRECTORY] [-s VIDEO_URL] [-p PLAYLIST_URL] [-t TAG_INFO] VIDEO_URLS".format(sys.argv[0]))
+            print("\t{} [-h] [-v] [-V] [-q] [-m] [-j JOBS] [-S] [-o OUTPUT_DIRECTORY] [-s VIDEO_URL] [-p PLAYLIST_URL] [-t TAG_INFO] [--no-cache] [--refresh] [--cache-file CACHE_FILE] [--cache-ttl SECONDS] [--no-library] [--connections CONNECTIONS] [--segment-size BYTES] [--max-rate RATE] [--host-connections CONNECTIONS] [--adaptive] [--async] [--job-timeout SECONDS] [--convert-batch FILES] [--encoder ENCODER] [--format FORMAT] [--stream-policy POLICY] [--replaygain] [--cover-size PIXELS] [--metrics-out DIRECTORY] [--profile DIRECTORY] [--daemon] [--socket SOCKET_FILE] [--no-daemon] [--no-wait] [--status] [--stop-daemon] [--queue-db QUEUE_FILE] [--worker] [--resume] [--order ORDER] [--priority SOURCES] [--order-window VIDEOS] VIDEO_URLS".format(sys.argv[0]))
             print("")
             print("A tool for the bulk downloading of YouTube videos as MP3 files. It has the capability to download either individual videos or entire playlists. By default, all downloads are stored in the users home directory.")
             print("")
@@ -103,11 +757,46 @@ def main(argv):
             print("\t-h, --help/tDisplay the help message")
             print("\t-v, --version\tDisplay the version message")
             print("\t-V, --verbose\tEnable verbosity")
+            print("\t-q, --quiet\tDon't show download progress")
             print("\t-m, --multithreading\tEnable multithreading")
+            print("\t-j, --jobs JOBS\tNumber of download threads to use with multithreading (default: 4)")
+            print("\t-S, --stream\tPipe downloads straight into ffmpeg instead of writing temporary files")
             print("\t-o, --outdir OUTPUT_DIRECTORY\tDirectory to output MP3's to")
             print("\t-s, --single VIDEO_URL\tDownload from single video")
             print("\t-p, --playlist PLAYLIST_URL\tDownload from playlist")
-            print("\t-t, --tags TAG_INFO\tAdd tags to MP3's. Tag info is passed as a list of tuples, see README for more info.")
+            print("\t-t, --tags TAG_INFO\tAdd tags to MP3's. Tag info is a CSV file, either keyed by video ID or URL or in queue order, see README for more info.")
+            print("\t--no-cache\tDon't read or write the metadata cache")
+            print("\t--refresh\tFetch all metadata again, updating the metadata cache")
+            print("\t--cache-file CACHE_FILE\tLocation of the metadata cache (default: {})".format(constants.DEFAULT_CACHE_FILE))
+            print("\t--cache-ttl SECONDS\tHow long cached metadata stays fresh")
+            print("\t--no-library\tDon't skip or link videos already in the output directory's library index")
+            print("\t--connections CONNECTIONS\tDownload each video over this many connections, in resumable segments (default: 1)")
+            print("\t--segment-size BYTES\tSize of each segment when downloading over several connections (default: 1048576)")
+            print("\t--max-rate RATE\tLimit the total download rate, in bytes per second with an optional K or M suffix")
+            print("\t--host-connections CONNECTIONS\tMaximum number of connections to each host at once (default: 8)")
+            print("\t--adaptive\tAdjust the number of concurrent downloads to throughput and throttling, up to JOBS, and retry throttled downloads")
+            print("\t--async\tRun JOBS downloads at once on an asyncio event loop instead of threads, within --max-rate and --host-connections. Can't be used with --adaptive, --connections or the pyav encoder")
+            print("\t--job-timeout SECONDS\tCancel downloads that take longer than this with --async")
+            print("\t--convert-batch FILES\tConvert this many downloads with each ffmpeg invocation when multithreading (default: 1)")
+            print("\t--encoder ENCODER\tConvert with \"ffmpeg\" (default) or in process with \"pyav\", if PyAV is installed")
+            print("\t--format FORMAT\tSave tracks as \"mp3\" (default), \"m4a\" or \"opus\". M4A and Opus tracks are copied from YouTube's stream without re-encoding when its codec allows")
+            print("\t--stream-policy POLICY\tPick the audio stream to download: \"codec\" (default) prefers streams that can be saved without re-encoding, \"best\" takes the highest bitrate and \"smallest\" the lowest adequate bitrate")
+            print("\t--replaygain\tMeasure each MP3's loudness while converting it and add ReplayGain tags, if NumPy is installed")
+            print("\t--cover-size PIXELS\tScale cover images down to at most this many pixels on their longest side, if Pillow is installed")
+            print("\t--metrics-out DIRECTORY\tWrite a JSON-lines trace of each stage's timings and a Prometheus metrics file to this directory")
+            print("\t--profile DIRECTORY\tWrite cProfile stats for each thread to this directory")
+            print("\t--daemon\tRun as a daemon, downloading jobs submitted by other invocations with the options given here")
+            print("\t--socket SOCKET_FILE\tLocation of the daemon's socket (default: {})".format(constants.DEFAULT_SOCKET_FILE))
+            print("\t--no-daemon\tDownload in this process even if a daemon is running")
+            print("\t--no-wait\tReturn as soon as a daemon has taken the job")
+            print("\t--status\tShow the status of the daemon's jobs")
+            print("\t--stop-daemon\tShut the daemon down once its queued jobs have finished")
+            print("\t--queue-db QUEUE_FILE\tAdd the videos to a job queue shared by workers, which can be on shared storage, instead of downloading them")
+            print("\t--worker\tDownload videos from the --queue-db job queue until it is finished")
+            print("\t--resume\tResume the interrupted run in the output directory from its journal, skipping the stages each video had finished")
+            print("\t--order ORDER\tDownload in \"queue\" order (default) or \"longest\" videos first, so a long video doesn't hold the batch up at the end")
+            print("\t--priority SOURCES\tDownload videos from these sources first, in order, as a comma separated list of \"resumed\", \"videos\" and \"playlist\"")
+            print("\t--order-window VIDEOS\tReorder this many videos at a time, so downloads start before every video has been looked up and their stream manifests are reused. 0 (the default) orders the whole queue exactly, fetching each video's manifest again when it is downloaded so memory stays flat and stream URLs don't expire")
             exit(0)
 
         elif opt in ("-v", "--version"):
@@ -121,10 +810,30 @@ def main(argv):
             # Enable verbosity
             verbosity = True
 
+        elif opt in ("-q", "--quiet"):
+            # Hide download progress
+            quiet = True
+
         elif opt in ("-m", "--multithreading"):
             # Enable threading
             use_threading = True
 
+        elif opt in ("-j", "--jobs"):
+            # Set the number of download threads
+            try:
+                worker_count = int(arg)
+            except ValueError:
+                print("[E] Number of jobs must be an integer: {}".format(arg))
+                exit(0)
+
+            if worker_count < 1:
+                print("[E] Number of jobs must be at least 1")
+                exit(0)
+
+        elif opt in ("-S", "--stream"):
+            # Enable streaming conversion
+            streaming = True
+
         elif opt in ("-o", "--outdir"):
             # Specify output directory
             outdir = arg
@@ -141,16 +850,317 @@ def main(argv):
             # Add tags to MP3's
             tag_data_file = arg
 
+        elif opt == "--no-cache":
+            # Disable the metadata cache
+            use_cache = False
+
+        elif opt == "--refresh":
+            # Ignore cached metadata
+            refresh_cache = True
+
+        elif opt == "--cache-file":
+            # Specify the metadata cache location
+            cache_file = os.path.abspath(arg)
+
+        elif opt == "--cache-ttl":
+            # Set how long cached metadata stays fresh
+            try:
+                cache_ttl = int(arg)
+            except ValueError:
+                print("[E] Cache TTL must be an integer number of seconds: {}".format(arg))
+                exit(0)
+
+            if cache_ttl < 0:
+                print("[E] Cache TTL can't be negative")
+                exit(0)
+
+        elif opt == "--no-library":
+            # Disable the library index
+            use_library = False
+
+        elif opt in ("--connections", "--segment-size"):
+            # Set up segmented downloading
+            try:
+                value = int(arg)
+            except ValueError:
+                print("[E] {0} must be an integer: {1}".format(opt, arg))
+                exit(0)
+
+            if value < 1:
+                print("[E] {} must be at least 1".format(opt))
+                exit(0)
+
+            if opt == "--connections":
+                connection_count = value
+            else:
+                segment_size = value
+
+        elif opt == "--max-rate":
+            # Limit the download rate
+            multipliers = {"K": 1024, "M": 1024 * 1024}
+            try:
+                if arg[-1:].upper() in multipliers:
+                    max_rate = int(float(arg[:-1]) * multipliers[arg[-1:].upper()])
+                else:
+                    max_rate = int(arg)
+            except ValueError:
+                print("[E] Invalid download rate: {}".format(arg))
+                exit(0)
+
+            if max_rate < 1:
+                print("[E] Download rate must be at least 1 byte per second")
+                exit(0)
+
+        elif opt == "--host-connections":
+            # Cap the connections to each host
+            try:
+                host_connection_count = int(arg)
+            except ValueError:
+                print("[E] {0} must be an integer: {1}".format(opt, arg))
+                exit(0)
+
+            if host_connection_count < 1:
+                print("[E] {} must be at least 1".format(opt))
+                exit(0)
+
+        elif opt == "--adaptive":
+            # Enable adaptive concurrency
+            use_adaptive = True
+
+        elif opt == "--async":
+            # Use the asyncio engine
+            use_async = True
+
+        elif opt == "--job-timeout":
+            # Set the per-download timeout
+            try:
+                job_timeout = float(arg)
+            except ValueError:
+                print("[E] Job timeout must be a number of seconds: {}".format(arg))
+                exit(0)
+
+        elif opt == "--convert-batch":
+            # Set the conversion batch size
+            try:
+                convert_batch_size = int(arg)
+            except ValueError:
+                print("[E] {0} must be an integer: {1}".format(opt, arg))
+                exit(0)
+
+            if convert_batch_size < 1:
+                print("[E] {} must be at least 1".format(opt))
+                exit(0)
+
+        elif opt == "--encoder":
+            # Choose the encoder
+            if arg not in ("ffmpeg", "pyav"):
+                print("[E] Unknown encoder: {}".format(arg))
+                exit(0)
+
+            # PyAV is optional, so make sure it is installed
+            if arg == "pyav":
+                try:
+                    import av
+                except ImportError:
+                    print("[E] The pyav encoder needs PyAV, install it with: pip install av")
+                    exit(0)
+
+            encoder = arg
+
+        elif opt == "--format":
+            # Choose the output format
+            if arg not in JOB_OPTION_CHOICES["output_format"]:
+                print("[E] Unknown format: {}".format(arg))
+                exit(0)
+
+            output_format = arg
+
+        elif opt == "--stream-policy":
+            # Choose how the audio stream is picked
+            if arg not in JOB_OPTION_CHOICES["stream_policy"]:
+                print("[E] Unknown stream policy: {}".format(arg))
+                exit(0)
+
+            stream_policy = arg
+
+        elif opt == "--replaygain":
+            # NumPy is optional, so make sure it is installed
+            try:
+                import numpy
+            except ImportError:
+                print("[E] --replaygain needs NumPy, install it with: pip install numpy")
+                exit(0)
+
+            replaygain = True
+
+        elif opt == "--cover-size":
+            # Set the largest cover image size
+            try:
+                cover_size = int(arg)
+            except ValueError:
+                print("[E] {0} must be an integer: {1}".format(opt, arg))
+                exit(0)
+
+            if cover_size < 1:
+                print("[E] {} must be at least 1".format(opt))
+                exit(0)
+
+            # Pillow is optional, so warn that covers will be embedded as they are without it
+            try:
+                import PIL
+            except ImportError:
+                print("[I] Scaling cover images needs Pillow, covers will be embedded as they are. Install it with: pip install Pillow")
+
+        elif opt == "--metrics-out":
+            # Record timings and counters
+            metrics_directory = arg
+
+        elif opt == "--profile":
+            # Profile every thread
+            profile_directory = arg
+
+        elif opt == "--daemon":
+            # Run as a daemon
+            run_as_daemon = True
+
+        elif opt == "--socket":
+            # Specify the daemon's socket location
+            socket_file = os.path.abspath(arg)
+
+        elif opt == "--no-daemon":
+            # Don't hand the job to a daemon
+            use_daemon = False
+
+        elif opt == "--no-wait":
+            # Don't wait for the daemon to finish the job
+            wait_for_job = False
+
+        elif opt == "--queue-db":
+            # Use a shared job queue
+            queue_file = os.path.abspath(arg)
+
+        elif opt == "--worker":
+            # Work on the shared job queue
+            run_as_worker = True
+
+        elif opt == "--resume":
+            # Resume an interrupted run
+            resume = True
+
+        elif opt == "--order":
+            # Choose the download order
+            if arg not in JOB_OPTION_CHOICES["order"]:
+                print("[E] Unknown order: {}".format(arg))
+                exit(0)
+
+            order = arg
+
+        elif opt == "--priority":
+            # Set the priority classes
+            priority_sources = arg.split(",")
+            for source in priority_sources:
+                if source not in PRIORITY_SOURCES:
+                    print("[E] Unknown source: {}".format(source))
+                    exit(0)
+
+        elif opt == "--order-window":
+            # Set how many videos are reordered at once
+            try:
+                order_window = int(arg)
+            except ValueError:
+                print("[E] {0} must be an integer: {1}".format(opt, arg))
+                exit(0)
+
+            if order_window < 0:
+                print("[E] {} can't be negative".format(opt))
+                exit(0)
+
+        elif opt in ("--status", "--stop-daemon"):
+            # Talk to the daemon instead of downloading
+            daemon_action = opt
+
         else:
             # Display error message and exit
             print("[E] No such argument: {}".format(opt))
             exit(0)
 
+    # Only ffmpeg can write formats other than MP3
+    if output_format != "mp3" and encoder != "ffmpeg":
+        print("[E] The {} format needs the ffmpeg encoder".format(output_format))
+        exit(0)
+
+    # ReplayGain is measured from ffmpeg's output and written by the MP3 tag editor
+    if replaygain == True and (output_format != "mp3" or encoder != "ffmpeg"):
+        print("[E] --replaygain needs the mp3 format and the ffmpeg encoder")
+        exit(0)
+
+    # The asyncio engine pipes one plain GET per video into ffmpeg, so it can't adapt its concurrency, split streams into segments or convert with PyAV
+    if use_async == True and (use_adaptive == True or connection_count > 1 or encoder != "ffmpeg"):
+        print("[E] --async can't be used with --adaptive, --connections or the pyav encoder")
+        exit(0)
+
     # Process arguments
     if len(args) > 0:
         for arg in args:
             video_urls.append(arg)
 
+    # Downloads are placed by absolute path, so they don't depend on the working directory
+    outdir = os.path.abspath(outdir)
+
+    from lib import daemon
+    if socket_file == None:
+        socket_file = daemon.DEFAULT_SOCKET_FILE
+
+    if run_as_worker == True and queue_file == None:
+        print("[E] --worker needs a job queue, given with --queue-db")
+        exit(0)
+
+    # Ask the daemon about its jobs, or to shut down
+    if daemon_action != None:
+        daemon_client = daemon.DaemonClient(socket_file)
+        try:
+            if daemon_action == "--status":
+                for job in daemon_client.get_status():
+                    job_request = job["request"]
+                    job_target = job_request["playlist_url"] if job_request["playlist_url"] != None else ", ".join(job_request["video_urls"])
+                    print("[I] Job {0}: {1} - {2} -> {3}".format(job["job"], job["state"], job_target, job_request["outdir"]))
+            else:
+                daemon_client.shutdown()
+                print("[I] Daemon shutting down once its queued jobs have finished")
+        except (OSError, daemon.DaemonError) as err_msg:
+            print("[E] Can't reach the daemon on {0}: {1}".format(socket_file, err_msg))
+        exit(0)
+
+    # Hand the job to a running daemon, if there is one, instead of starting everything up here
+    if run_as_daemon == False and queue_file == None and resume == False and use_daemon == True and os.path.exists(socket_file) == True:
+        # Only send the options that were given, so the rest stay as the daemon was started with
+        job_values = {"use_threading": use_threading, "worker_count": worker_count, "streaming": streaming, "use_library": use_library, "use_async": use_async, "job_timeout": job_timeout, "convert_batch_size": convert_batch_size, "output_format": output_format, "stream_policy": stream_policy, "replaygain": replaygain, "order": order, "priority_sources": priority_sources, "order_window": order_window}
+        job_options = {JOB_OPTION_FLAGS[opt]: job_values[JOB_OPTION_FLAGS[opt]] for opt, arg in opts if opt in JOB_OPTION_FLAGS}
+
+        # A daemon can't honour options that set up the process, so download here rather than quietly ignore them
+        process_options = sorted(set(opt for opt, arg in opts if opt in PROCESS_OPTION_FLAGS))
+        if len(process_options) > 0:
+            print("[I] A daemon is running, but it can't change {} for one job, so downloading in this process".format(", ".join(process_options)))
+        elif submit_to_daemon(socket_file, video_urls, playlist_url, tag_data_file, outdir, wait_for_job, job_options) == True:
+            exit(0)
+
+    # Load the download machinery, which is only needed from here on
+    import sqlite3
+    from lib import adaptive
+    from lib import artwork
+    from lib import cache
+    from lib import journal
+    from lib import library
+    from lib import manager
+    from lib import manifest
+    from lib import metrics
+    from lib import progress
+    from lib import segmented
+    from lib import transport
+
+    if cache_file == None:
+        cache_file = cache.DEFAULT_CACHE_FILE
+
     # Display banner message
     print("")
     print("################################")
@@ -158,124 +1168,192 @@ def main(argv):
     print("# Version 1.5 (Sleep Deprived) #")
     print("################################")
     print("[I] Initializing program...")
+
+    # Start profiling before anything else, if enabled
+    profiler = None
+    if profile_directory != None:
+        profiler = metrics.Profiler(os.path.abspath(profile_directory))
+        profiler.start()
+
+    # Record timings and counters, if enabled, otherwise record nothing at next to no cost
+    recorder = metrics.Recorder(os.path.abspath(metrics_directory) if metrics_directory != None else None, metrics_directory != None)
     
+    # Open the metadata cache, if enabled
+    metadata_cache = None
+    if use_cache == True:
+        cache_ttls = None
+        if cache_ttl != None:
+            cache_ttls = dict.fromkeys(cache.DEFAULT_TTLS, cache_ttl)
+        metadata_cache = cache.MetadataCache(cache_file, cache_ttls, refresh=refresh_cache)
+
+    # Send all requests through one shared transport, so connections are reused and the bandwidth limit applies to every thread
+    http_transport = transport.Transport(host_connection_count, max_rate)
+    http_transport.install()
+
+    # Download over several connections, if enabled
+    segmented_downloader = None
+    if connection_count > 1:
+        segmented_downloader = segmented.SegmentedDownloader(segment_size, connection_count, transport=http_transport)
+
+    # Show the progress of every download on one line, unless told to be quiet
+    progress_aggregator = progress.ProgressAggregator(quiet == False)
+
+    # Share cover images between all tracks, so each is read and scaled down only once
+    artwork_cache = artwork.ArtworkCache(cover_size)
+
     # Initialize a new download manager
-    download_manager = manager.DownloadManager(verbosity)
+    download_manager = manager.DownloadManager(verbosity, metadata_cache, segmented_downloader, encoder, artwork_cache, recorder, progress_aggregator, output_format, stream_policy, replaygain, http_transport)
 
-    # Move script execution to the designated output directory, if applicable
-    if outdir != os.getcwd():
-        os.chdir(outdir)
+    # Let the number of concurrent downloads adapt, if enabled
+    controller = None
+    if use_adaptive == True:
+        controller = adaptive.AdaptiveController(worker_count)
 
-    # If a tag data file is present, parse it for inclusion in the video queue
-    if tag_data_file != None:
-        parsed_tag_data = download_manager.parse_tag_data_file(tag_data_file)
+    # Run as a daemon, taking jobs from clients until shut down
+    if run_as_daemon == True:
+        # The daemon's own options, which each job can override
+        daemon_options = {"use_threading": use_threading, "worker_count": worker_count, "streaming": streaming, "use_library": use_library, "use_async": use_async, "job_timeout": job_timeout, "convert_batch_size": convert_batch_size, "output_format": output_format, "stream_policy": stream_policy, "replaygain": replaygain, "order": order, "priority_sources": priority_sources, "order_window": order_window}
 
-    """
-    All videos to be downloaded must be added to the queue, which is a list of tuples containing the video's URL, its title, the desired filename for the end download, and a variable containing either Nonetype or tag data, if it was provided. If the video is to be downloaded into a subdirectory inside of the main output directory, say in the case of an album playlist, said subdirectory must be appended to the beginning of the filename. 
-    """
-    
-    # Initialize queue
-    video_queue = []
+        # Check a job's options when it is submitted, and get them merged with the daemon's own when it is run
+        def get_daemon_job_options(job_request):
+            check_job_options(job_request["options"])
+            options = dict(daemon_options)
+            options.update(job_request["options"])
 
-    """
-    Logic for handling and queueing individual videos, specified with either the -s/--single option, or passed as a program argument. This essentially fetches the title associated with each YouTube video URL, builds a filename based off of it and the output directory, and adds all of this data to the download queue
-    """
-    
-    # Handle individual videos
-    if len(video_urls) > 0:
-        # Output message
-        print("[I] Adding video(s) to queue...")
+            if options["replaygain"] == True and (options["output_format"] != "mp3" or encoder != "ffmpeg"):
+                raise ValueError("replaygain needs the mp3 format and the ffmpeg encoder")
+            if options["output_format"] != "mp3" and encoder != "ffmpeg":
+                raise ValueError("The {} format needs the ffmpeg encoder".format(options["output_format"]))
+            if options["use_async"] == True and (controller != None or segmented_downloader != None or encoder != "ffmpeg"):
+                raise ValueError("use_async can't be used with the daemon's adaptive concurrency, segmented downloads or pyav encoder")
 
-        c = 0
-        for video_url in video_urls:
-            # If tag data was provided, prepare it for adding to the videos tuple
-            if tag_data_file != None:
-                video_metadata = parsed_tag_data[c]
-            else:
-                # If not, create a variable to act as a placeholder
-                video_metadata = None
-                
-            # Get the video title
-            video_title = download_manager.get_video_title(video_url)
+            return options
 
-            # Build the filename and queue video
-            video_filename = os.path.join(outdir, "{}.mp3".format(video_title))
-            current_vid = (video_url, video_title, video_filename, video_metadata)
-            video_queue.append(current_vid)
+        # Run each job with this process's warm caches and connections
+        def run_daemon_job(job_request):
+            options = get_daemon_job_options(job_request)
 
-            # Output m uessage
-            print("\t[i] \"{0}\" added to queue.".format(video_title))
+            job_tag_manifest = None
+            if job_request["tag_data_file"] != None:
+                job_tag_manifest = manifest.TagManifest(job_request["tag_data_file"])
 
-            c += 1
+            # Jobs run one at a time, so the download manager's settings can be switched for each one
+            download_manager.output_format = options["output_format"]
+            download_manager.stream_policy = options["stream_policy"]
+            download_manager.replaygain = options["replaygain"]
 
-    """
-    Logic for building the queue from playlists specified with -p/--playlist. It retrieves the playlists title and creates a subdirectory with it, parses the playlist to retrieve the URL and title of all its videos, then gives each video a filename derived from the subdirectory name and the video's title before adding to the queue
-    """
-    # Parse playlists and add their videos to the queue
-    if playlist_url != None:
-        # Get the playlist title
-        playlist_title = download_manager.get_playlist_title(playlist_url)
+            try:
+                results, errors, queued_urls = run_job(verbosity, options["use_threading"], download_manager, job_request["video_urls"], job_request["playlist_url"], job_request["outdir"], job_tag_manifest, options["use_library"], options["worker_count"], options["streaming"], controller, options["use_async"], options["job_timeout"], options["convert_batch_size"], False, options["order"], options["priority_sources"], options["order_window"])
+            finally:
+                if job_tag_manifest != None:
+                    job_tag_manifest.close()
+                download_manager.forget_resolved_videos()
+                download_manager.output_format = output_format
+                download_manager.stream_policy = stream_policy
+                download_manager.replaygain = replaygain
 
-        # Create the directory to download to and append it to the filepath of the videos
-        playlist_download_directory = os.path.join(outdir, "{}".format(playlist_title))
-        os.mkdir(playlist_download_directory)
+            return {"queued": len(queued_urls), "succeeded": len(results), "failures": [[queued_urls[video_position], str(err_msg)] for video_position, err_msg in sorted(errors.items())]}
 
-        # Display the name of the playlist
-        print("[I] Name of playlist: {}".format(playlist_title))
-        
-        # Parse the playlist and add the videos to the queue
-        parsed_video_list = download_manager.parse_playlist(playlist_url)
+        daemon_server = daemon.DaemonServer(socket_file, run_daemon_job, get_daemon_job_options)
+        try:
+            daemon_server.start()
+        except (OSError, daemon.DaemonError) as err_msg:
+            print("[E] Can't start daemon: {}".format(err_msg))
+            exit(0)
 
-        # Tell the user how many videos are in the playlist and where the outdir is
-        print("[I] Number of videos in playlist: {}".format(len(parsed_video_list)))
-        print("[I] Download location for playlist videos: {}".format(playlist_download_directory))
-        print("[I] Adding video(s) to queue...")
+        print("[I] Daemon listening on {}".format(socket_file))
+        progress_aggregator.start()
+        try:
+            daemon_server.serve_forever()
+        except KeyboardInterrupt:
+            print("[I] Daemon interrupted, shutting down...")
+        finally:
+            progress_aggregator.stop()
 
-        # Add a filename for each video from the playlist
-        c = 0
-        for video in parsed_video_list:
-            # If tag data was provided, prepare it for adding to the videos tuple
-            if tag_data_file != None:
-                video_metadata = parsed_tag_data[c]
-            else:
-                # If not, create a variable to act as a placeholder
-                video_metadata = None
-                
-            # Combine the download subdirectory and title to create the filename
-            video_filename = os.path.join(playlist_download_directory, "{}.mp3".format(video[1]))
-
-            # Build the tuple and add to queue
-            current_video = (video[0], video[1], video_filename, video_metadata)
-            video_queue.append(current_video)
- 
-            # Output message
-            print("\t[i] \"{}\" added to queue.".format(video[1]))
+    else:
+        # Move script execution to the designated output directory, if applicable
+        if outdir != os.getcwd():
+            os.chdir(outdir)
 
-            c += 1
+        # If a tag data file is present, open it for looking up each video's tags as it is queued
+        if tag_data_file != None:
+            try:
+                tag_manifest = manifest.TagManifest(tag_data_file)
+            except (OSError, ValueError, sqlite3.Error) as err_msg:
+                print("[E] Can't read tag data file: {}".format(err_msg))
+                exit(0)
+        else:
+            tag_manifest = None
 
-    # Output message
-    print("[I] {} videos have been added to the queue.".format(len(video_queue)))
-        
-    print("#######################")
-    print("#  STARTING DOWNLOAD  #")
-    print("#######################")
-    print("##> Download Location: {}".format(outdir))
-    print("##> Video Count: {}".format(len(video_queue)))
-    
-    # Verbose output
-    if verbosity == True:
-        print("####>>")
-        print("[DEBUG] Videos in queue:")
-        
-        for video in video_queue:
-            print("\t[d] {0} ({1})".format(video[0], video[1]))
-        print("####>>")
-        
-    print("#######################")
+        # Add the videos to the shared job queue and work on it, if enabled
+        if queue_file != None:
+            from lib import job_queue
+            video_job_queue = job_queue.JobQueue(queue_file)
 
+            if len(video_urls) > 0 or playlist_url != None:
+                library_index = None
+                if use_library == True:
+                    library_index = library.LibraryIndex(outdir)
+                    library_index.scan()
 
-    # Download all videos in the queue
-    process_queued_videos(verbosity, use_threading, download_manager, video_queue)
+                added_count = enqueue_videos(download_manager, video_job_queue, video_urls, playlist_url, outdir, tag_manifest, worker_count, library_index)
+                print("[I] Added {0} videos to the job queue at {1}".format(added_count, queue_file))
+
+            if run_as_worker == True:
+                progress_aggregator.start()
+                try:
+                    process_job_queue(verbosity, download_manager, video_job_queue, worker_count, streaming, controller)
+                finally:
+                    progress_aggregator.stop()
+
+            video_job_queue.close()
+
+        # Download all videos in the queue
+        else:
+            progress_aggregator.start()
+            try:
+                run_job(verbosity, use_threading, download_manager, video_urls, playlist_url, outdir, tag_manifest, use_library, worker_count, streaming, controller, use_async, job_timeout, convert_batch_size, resume, order, priority_sources, order_window)
+            except journal.JournalError as err_msg:
+                print("[E] {}".format(err_msg))
+            finally:
+                progress_aggregator.stop()
+
+        if tag_manifest != None:
+            tag_manifest.close()
+
+    # Report where the adaptive limit settled
+    if controller != None:
+        controller_stats = controller.stats()
+        print("[I] Adaptive concurrency: limit {0} (peak {1}), {2} throttled, {3} retries".format(controller_stats["limit"], controller_stats["peak_limit"], controller_stats["throttles"], controller_stats["retries"]))
+        recorder.count("retries", controller_stats["retries"])
+        recorder.count("throttles", controller_stats["throttles"])
+
+    # Report how well connections were reused
+    transport_stats = http_transport.stats()
+    print("[I] HTTP: {0} requests over {1} connections, {2:.0%} reused".format(transport_stats["requests"], transport_stats["connections_opened"], transport_stats["reuse_ratio"]))
+
+    # Report how much metadata came from the cache
+    if metadata_cache != None:
+        cache_stats = metadata_cache.stats()
+        print("[I] Metadata cache: {0} hits, {1} misses, {2} evictions".format(cache_stats["hits"], cache_stats["misses"], cache_stats["evictions"]))
+        metadata_cache.close()
+
+    # Report how often cover images were shared, and remove the scaled down copies
+    artwork_stats = artwork_cache.stats()
+    if artwork_stats["hits"] + artwork_stats["misses"] > 0:
+        print("[I] Cover images: {0} read, {1} reused, {2} bytes saved".format(artwork_stats["misses"], artwork_stats["hits"], artwork_stats["bytes_saved"]))
+    artwork_cache.close()
+
+    # Write out the metrics and profiles
+    if metrics_directory != None:
+        recorder.count("http_requests", transport_stats["requests"])
+        recorder.count("http_connections_opened", transport_stats["connections_opened"])
+        recorder.close()
+        print("[I] Metrics written to {}".format(os.path.abspath(metrics_directory)))
+
+    if profiler != None:
+        profile_files = profiler.stop()
+        print("[I] Profiles of {0} threads written to {1}".format(len(profile_files), os.path.abspath(profile_directory)))
 
 # Begin execution
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+# lib/adaptive.py
+# Adjust the number of concurrent downloads to what the server will put up with
+
+import os
+import time
+import random
+import threading
+from lib import errors
+
+class AdaptiveController(object):
+    """ Limit the number of downloads running at once, growing and shrinking the limit with additive increase/multiplicative decrease
+
+    The limit grows by about one download for every round of downloads that finish without being throttled, as long as the overall throughput keeps improving and latency stays close to the best seen. It is cut by a constant factor whenever the server throttles a download. Throttled and failed downloads are retried after an exponential backoff with jitter.
+
+    Methods:
+        __init__() - Initialize the object
+        run() - Run a download within the limit, retrying if it is throttled or fails
+        acquire() - Wait for a download slot
+        release() - Give back a download slot
+        record_success() - Grow the limit after a successful download
+        record_throttle() - Shrink the limit after a throttled download
+        get_backoff_delay() - Get how long to wait before a retry
+        stats() - Get the controller's counters
+    """
+
+    def __init__(self, max_workers, min_workers=1, initial_workers=2, decrease_factor=0.5, max_retries=5, base_delay=1.0, max_delay=60.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            max_workers - int - Upper bound on the limit
+            min_workers - int - Lower bound on the limit
+            initial_workers - int - Starting limit
+            decrease_factor - float - Factor the limit is multiplied by when throttled
+            max_retries - int - Number of times to retry a download before giving up
+            base_delay - float - Backoff delay of the first retry, in seconds
+            max_delay - float - Longest backoff delay, in seconds
+        """
+
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = float(max(min_workers, min(initial_workers, max_workers)))
+        self.active = 0
+        self.condition = threading.Condition()
+
+        # Throughput and latency tracking
+        self.best_latency = None
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_jobs = 0
+        self.last_throughput = 0.0
+        self.last_decrease = 0.0
+
+        # Counters
+        self.successes = 0
+        self.throttles = 0
+        self.retries = 0
+        self.peak_limit = self.limit
+
+    def run(self, function, *args):
+        """ Run a download within the limit, retrying it with backoff if it is throttled or fails transiently
+
+        Arguments:
+            self - self - This object
+            function - callable - The download function, which should return the name of the downloaded file
+            args - any - Arguments passed to the function
+
+        Returns:
+            result - any - The function's return value
+        """
+
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = function(*args)
+
+            except Exception as err_msg:
+                download_error = errors.classify_error(err_msg)
+
+                # Throttling means too many downloads at once, so cut the limit before retrying
+                if isinstance(download_error, errors.ThrottledError) == True:
+                    self.record_throttle()
+                elif isinstance(download_error, errors.TransientError) == False:
+                    raise download_error
+
+                if attempt >= self.max_retries:
+                    raise download_error
+
+            else:
+                self.record_success(result, time.monotonic() - start)
+                return result
+
+            finally:
+                self.release()
+
+            # Wait before retrying, without holding a slot
+            time.sleep(self.get_backoff_delay(attempt))
+            attempt += 1
+            with self.condition:
+                self.retries += 1
+
+    def acquire(self):
+        """ Wait until fewer downloads are running than the limit allows, then take a slot
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        """ Give back a download slot
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def record_success(self, result, elapsed):
+        """ Grow the limit after a successful download, if throughput and latency allow it
+
+        Arguments:
+            self - self - This object
+            result - any - The download's return value, used to find how many bytes were downloaded if it is a filename
+            elapsed - float - How long the download took, in seconds
+        """
+
+        byte_count = 0
+        if isinstance(result, str) == True:
+            try:
+                byte_count = os.path.getsize(result)
+            except OSError:
+                pass
+
+        with self.condition:
+            self.successes += 1
+            self.window_bytes += byte_count
+            self.window_jobs += 1
+
+            # Track the best latency seen, as a baseline for spotting queueing on the server
+            if self.best_latency == None or elapsed < self.best_latency:
+                self.best_latency = elapsed
+
+            # Only reconsider the limit once a full round of downloads has finished
+            if self.window_jobs < int(self.limit):
+                return
+
+            now = time.monotonic()
+            throughput = self.window_bytes / max(now - self.window_start, 0.001)
+            latency_ok = elapsed < self.best_latency * 4
+
+            # Add a download while throughput is still rising and latency hasn't blown up
+            if throughput >= self.last_throughput * 0.95 and latency_ok == True:
+                self.limit = min(self.max_workers, self.limit + 1)
+                self.peak_limit = max(self.peak_limit, self.limit)
+                self.condition.notify_all()
+
+            self.last_throughput = throughput
+            self.window_start = now
+            self.window_bytes = 0
+            self.window_jobs = 0
+
+    def record_throttle(self):
+        """ Shrink the limit after a download was throttled
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.condition:
+            self.throttles += 1
+
+            # Several downloads running at once are often throttled together, so only cut the limit once per backoff period
+            now = time.monotonic()
+            if now - self.last_decrease < self.base_delay:
+                return
+
+            self.limit = max(self.min_workers, self.limit * self.decrease_factor)
+            self.last_decrease = now
+
+            # Start measuring throughput afresh at the new limit
+            self.last_throughput = 0.0
+            self.window_start = now
+            self.window_bytes = 0
+            self.window_jobs = 0
+
+    def get_backoff_delay(self, attempt):
+        """ Get how long to wait before a retry, using exponential backoff with full jitter
+
+        Arguments:
+            self - self - This object
+            attempt - int - Number of retries made so far
+
+        Returns:
+            delay - float - Delay in seconds
+        """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def stats(self):
+        """ Get the controller's counters
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - The current and peak limit, and the number of successes, throttles and retries
+        """
+
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "peak_limit": int(self.peak_limit),
+                "successes": self.successes,
+                "throttles": self.throttles,
+                "retries": self.retries
+            }
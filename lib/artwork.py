@@ -0,0 +1,214 @@
+# lib/artwork.py
+# Shared cache of cover images, read and processed once per run
+
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+import threading
+import collections
+
+class ArtworkCache(object):
+    """ Read each cover image once and share it between every track and thread that uses it
+
+    Images are looked up by path, and the processed bytes are stored by a hash of the original content, so the same cover under different paths is only processed and held once. If a maximum dimension is set and Pillow is installed, larger images are scaled down and recompressed as JPEG. The cache holds at most max_bytes of images and evicts the least recently used.
+
+    Methods:
+        __init__() - Initialize the object
+        get() - Get the processed bytes and MIME type of a cover image
+        get_file() - Get a file containing the processed cover image
+        process() - Scale down and recompress an image
+        stats() - Get the hit/miss counts
+        close() - Remove the processed image files
+    """
+
+    def __init__(self, max_dimension=None, quality=85, max_bytes=64 * 1024 * 1024):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            max_dimension - int or None - Longest side in pixels to scale images down to, or None to embed images as they are
+            quality - int - JPEG quality of scaled down images
+            max_bytes - int - Number of bytes of images to hold before evicting the least recently used
+        """
+
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+        # Content hash of each path, keyed by path/size/modification time so edited files are read again
+        self.path_hashes = {}
+
+        # Processed images and their MIME types, keyed by content hash, least recently used first
+        self.images = collections.OrderedDict()
+        self.cached_bytes = 0
+
+        # Files of processed images handed to ffmpeg, keyed by content hash
+        self.image_files = {}
+        self.image_directory = None
+
+        self.lock = threading.Lock()
+
+        # Hit/miss counts
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get(self, image_file):
+        """ Get the processed bytes and MIME type of a cover image, reading and processing it only if it isn't cached
+
+        Arguments:
+            self - self - This object
+            image_file - filename - Path of the cover image
+
+        Returns:
+            image_data - bytes - The processed image
+            mime_type - string - MIME type of the processed image
+            content_hash - string - SHA-256 hash of the original image
+        """
+
+        file_stat = os.stat(image_file)
+        path_key = (os.path.abspath(image_file), file_stat.st_size, file_stat.st_mtime)
+
+        with self.lock:
+            content_hash = self.path_hashes.get(path_key)
+            if content_hash != None and content_hash in self.images:
+                self.images.move_to_end(content_hash)
+                self.hits += 1
+                image_data, mime_type = self.images[content_hash]
+                return image_data, mime_type, content_hash
+
+            self.misses += 1
+
+        # Read and process the image outside the lock, so other threads aren't held up
+        with open(image_file, "rb") as open_image_file:
+            raw_image = open_image_file.read()
+        content_hash = hashlib.sha256(raw_image).hexdigest()
+
+        with self.lock:
+            self.path_hashes[path_key] = content_hash
+
+            # Another path with the same content may already have been processed
+            if content_hash in self.images:
+                self.images.move_to_end(content_hash)
+                image_data, mime_type = self.images[content_hash]
+                return image_data, mime_type, content_hash
+
+        image_data, mime_type = self.process(raw_image)
+
+        with self.lock:
+            self.bytes_saved += len(raw_image) - len(image_data)
+            if content_hash not in self.images:
+                self.images[content_hash] = (image_data, mime_type)
+                self.cached_bytes += len(image_data)
+
+            # Evict the least recently used images once over budget, always keeping the newest
+            while self.cached_bytes > self.max_bytes and len(self.images) > 1:
+                evicted_hash, (evicted_data, evicted_mime_type) = self.images.popitem(last=False)
+                self.cached_bytes -= len(evicted_data)
+
+        return image_data, mime_type, content_hash
+
+    def get_file(self, image_file):
+        """ Get a file containing the processed cover image, for tools like ffmpeg that read images from disk
+
+        Arguments:
+            self - self - This object
+            image_file - filename - Path of the cover image
+
+        Returns:
+            processed_file - filename - Path of the processed image, which is the original path if the image is embedded as it is
+        """
+
+        # Unprocessed images can be read from where they are
+        if self.max_dimension == None:
+            return image_file
+
+        image_data, mime_type, content_hash = self.get(image_file)
+
+        with self.lock:
+            if content_hash in self.image_files:
+                return self.image_files[content_hash]
+
+            if self.image_directory == None:
+                self.image_directory = tempfile.mkdtemp(prefix="bulk-yt-mp3-artwork-")
+
+            extension = ".png" if mime_type == "image/png" else ".jpg"
+            processed_file = os.path.join(self.image_directory, content_hash + extension)
+            with open(processed_file, "wb") as open_processed_file:
+                open_processed_file.write(image_data)
+
+            self.image_files[content_hash] = processed_file
+            return processed_file
+
+    def process(self, raw_image):
+        """ Scale down and recompress an image if it is larger than the maximum dimension
+
+        Arguments:
+            self - self - This object
+            raw_image - bytes - The original image
+
+        Returns:
+            image_data - bytes - The processed image, or the original if it needed no processing
+            mime_type - string - MIME type of the returned image
+        """
+
+        mime_type = "image/png" if raw_image.startswith(b"\x89PNG") == True else "image/jpeg"
+        if self.max_dimension == None:
+            return raw_image, mime_type
+
+        # Pillow is optional, so embed images as they are without it
+        try:
+            from PIL import Image
+        except ImportError:
+            return raw_image, mime_type
+
+        try:
+            image = Image.open(io.BytesIO(raw_image))
+            if max(image.size) <= self.max_dimension:
+                return raw_image, mime_type
+
+            image.thumbnail((self.max_dimension, self.max_dimension))
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            processed_image = io.BytesIO()
+            image.save(processed_image, "JPEG", quality=self.quality, optimize=True)
+
+        # Leave images Pillow can't read as they are
+        except Exception:
+            return raw_image, mime_type
+
+        return processed_image.getvalue(), "image/jpeg"
+
+    def stats(self):
+        """ Get the hit/miss counts
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - Number of hits and misses, images held, and bytes saved by scaling images down
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "images": len(self.images),
+                "bytes_saved": self.bytes_saved
+            }
+
+    def close(self):
+        """ Remove the processed image files
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.lock:
+            if self.image_directory != None:
+                shutil.rmtree(self.image_directory, ignore_errors=True)
+                self.image_directory = None
+                self.image_files = {}
@@ -0,0 +1,453 @@
+# lib/async_manager.py
+# Download and convert videos on an asyncio event loop instead of threads
+
+import os
+import ssl
+import asyncio
+import subprocess
+import concurrent.futures
+import urllib.error
+import urllib.parse
+import http.client
+from lib import errors
+from lib import journal
+from lib import manager
+
+class AsyncDownloader(object):
+    """ The asyncio counterpart of Downloader, running every download as a coroutine on one event loop
+
+    Audio streams are fetched with asyncio's own sockets and piped straight into an ffmpeg process started with asyncio.create_subprocess_exec, so a waiting download costs a coroutine rather than an OS thread. The bytes read are limited by the shared transport's token bucket and the connections open to each host by its per-host limit, kept here with a semaphore per host. Tags are written by ffmpeg as it encodes, into a partial file, with any ReplayGain values added by the tag editor once the loudness measured alongside is known, or by ffmpeg if an earlier run measured the stream, that is renamed to its final filename once finished. If ffmpeg can't write the tags, the stream is fetched again and converted without them, and the tag editor writes them instead. Videos that an earlier run left downloaded or converted are finished by a threaded Downloader on a worker thread, so their completed stages aren't redone. Metadata lookups go through pytube, which is blocking, so they are handed to a pool of lookup threads of their own, which only limits how many lookups run at once, not how many downloads do.
+
+    Methods:
+        __init__() - Initialize the object
+        run() - Download and convert every video in a queue
+        worker() - Take jobs off the job queue until told to stop
+        run_job() - Run one job within its timeout
+        download_and_convert() - Download a video straight into ffmpeg and tag it
+        stream_into_ffmpeg() - Pipe a stream into ffmpeg, writing a partial file
+        measure() - Measure the loudness of the samples ffmpeg decodes
+        get_host_slot() - Get the semaphore limiting connections to a host
+        fetch() - Fetch a URL, yielding the body a chunk at a time
+    """
+
+    def __init__(self, download_manager, editor, concurrency=100, job_timeout=None, chunk_size=64 * 1024, job_journal=None, lookup_workers=8):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            download_manager - DownloadManager object - The manager object used to look up videos, whose transport, if set, limits the bandwidth and connections used
+            editor - Editor object - Tag editor for inserting MP3 metadata
+            concurrency - int - Number of jobs in flight at once
+            job_timeout - float or None - Seconds a job may take before it is cancelled, or None for no limit
+            chunk_size - int - Number of bytes read from the network at a time
+            job_journal - Journal object or None - Records the stage each video reaches, if set
+            lookup_workers - int - Number of threads looking up videos' streams at once
+        """
+
+        self.download_manager = download_manager
+        self.editor = editor
+        self.concurrency = concurrency
+        self.job_timeout = job_timeout
+        self.chunk_size = chunk_size
+        self.job_journal = job_journal
+        self.lookup_workers = lookup_workers
+
+        # Semaphores limiting the connections open to each host, keyed by scheme/host/port, created on the event loop
+        self.host_slots = {}
+
+        # Threads looking up streams, while run() is running
+        self.lookup_executor = None
+
+        # Finishes videos an earlier run got part of the way through
+        self.downloader = manager.Downloader(download_manager, editor, job_journal=job_journal)
+
+    async def run(self, video_queue):
+        """ Download and convert every video in a queue
+
+        Arguments:
+            self - self - This object
+            video_queue - iterable of tuples - Video url/title/filename/metadata tuples, which may be a blocking generator
+
+        Returns:
+            results - dict - Resulting MP3 filenames, keyed by queue position
+            errors - dict - Exceptions raised by failed jobs, keyed by queue position
+        """
+
+        results = {}
+        job_errors = {}
+
+        # Stream lookups get threads of their own, so they neither wait behind nor hold up the other work handed to threads
+        self.lookup_executor = concurrent.futures.ThreadPoolExecutor(self.lookup_workers, thread_name_prefix="lookup")
+
+        try:
+            # Jobs wait in a bounded queue, so a long video queue isn't read into memory all at once
+            job_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+            workers = [asyncio.create_task(self.worker(job_queue, results, job_errors)) for c in range(self.concurrency)]
+
+            # The video queue may block while it looks videos up, so read it from a thread
+            video_iterator = iter(video_queue)
+            c = 0
+            while True:
+                video = await asyncio.to_thread(next, video_iterator, None)
+                if video == None:
+                    break
+
+                await job_queue.put((c, video))
+                c += 1
+
+            # Tell each worker to exit once the queue has been drained
+            for worker in workers:
+                await job_queue.put(None)
+            await asyncio.gather(*workers)
+
+        finally:
+            self.lookup_executor.shutdown(wait=False)
+
+        return results, job_errors
+
+    async def worker(self, job_queue, results, job_errors):
+        """ Take jobs off the job queue until told to stop
+
+        Arguments:
+            self - self - This object
+            job_queue - Queue object - Position/video tuples to process
+            results - dict - Resulting MP3 filenames, keyed by queue position
+            job_errors - dict - Exceptions raised by failed jobs, keyed by queue position
+        """
+
+        while True:
+            job = await job_queue.get()
+            if job == None:
+                break
+
+            video_position, video = job
+            try:
+                results[video_position] = await self.run_job(*video)
+            except Exception as err_msg:
+                job_errors[video_position] = err_msg
+
+    async def run_job(self, video_url, video_title, video_filename, video_metadata):
+        """ Run one job, cancelling it if it takes longer than the job timeout
+
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video to download
+            video_title - string - Title of the video
+            video_filename - filename - The desired filename for the converted file
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            mp3_file - filename - The resultant MP3 format file
+        """
+
+        job = self.download_and_convert(video_url, video_title, video_filename, video_metadata)
+
+        try:
+            return await asyncio.wait_for(job, self.job_timeout)
+        except asyncio.TimeoutError:
+            raise errors.TransientError("Timed out after {} seconds".format(self.job_timeout))
+
+    async def download_and_convert(self, video_url, video_title, video_filename, video_metadata):
+        """ Download a video's audio stream straight into ffmpeg, which writes the metadata if present
+
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video to download
+            video_title - string - Title of the video
+            video_filename - filename - The desired filename for the converted file
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            mp3_file - filename - The resultant MP3 format file
+        """
+
+        # Pick up where an earlier run that used a temporary file left off
+        if self.downloader.get_stage(video_filename) in ("downloaded", "converted"):
+            return await asyncio.to_thread(self.downloader.download_and_convert, video_url, video_title, video_filename, video_metadata)
+
+        # Time the download and conversion together, as the threaded engine's streaming mode does
+        span = self.download_manager.recorder.span("stream_and_convert", video_url=video_url)
+
+        try:
+            # Pick the audio stream, reusing the lookup made while the queue was built
+            stream = await asyncio.get_running_loop().run_in_executor(self.lookup_executor, self.download_manager.get_audio_stream, video_url)
+            loudness_key = self.download_manager.get_loudness_key(video_url, stream)
+
+            # Write the tags while encoding into a partial file
+            partial_filename = journal.get_partial_filename(video_filename)
+            try:
+                replaygain = await self.stream_into_ffmpeg(stream, video_filename, partial_filename, video_metadata, loudness_key)
+                video_metadata = None
+
+            # If ffmpeg couldn't write the tags, fetch the stream again and convert it without them, leaving them to the tag editor, which only handles MP3
+            except subprocess.CalledProcessError:
+                if video_metadata == None or self.download_manager.output_format != "mp3":
+                    raise
+                replaygain = await self.stream_into_ffmpeg(stream, video_filename, partial_filename, None, loudness_key)
+
+        except BaseException as err_msg:
+            span.finish(err_msg)
+            raise
+
+        span.finish()
+
+        # Add the tags ffmpeg couldn't write and the ReplayGain values, which are only known once ffmpeg has finished
+        if video_metadata != None or replaygain != None:
+            await asyncio.to_thread(self.editor.insert_metadata, partial_filename, video_metadata, replaygain)
+
+        # Rename the finished file in one step, so the final filename never holds a partial file
+        os.replace(partial_filename, video_filename)
+        self.downloader.record_stage(video_filename, "tagged")
+
+        mp3_file = video_filename
+        return mp3_file
+
+    async def stream_into_ffmpeg(self, stream, video_filename, partial_filename, video_metadata, loudness_key=None):
+        """ Pipe an audio stream into ffmpeg as it downloads, writing the partial file and measuring its loudness if enabled, unless an earlier run already measured the stream, in which case ffmpeg writes its ReplayGain values
+
+        Arguments:
+            self - self - This object
+            stream - Stream object - The audio stream to download
+            video_filename - filename - The desired filename for the converted file, which progress is reported under
+            partial_filename - filename - The file for ffmpeg to write
+            video_metadata - dict or None - Tag data for ffmpeg to write while encoding, or None for no tags
+            loudness_key - string or None - Key the stream's loudness is cached under
+
+        Returns:
+            replaygain - dict or None - Track gain in dB and peak still to be written to the tags, or None if the loudness wasn't measured or ffmpeg wrote it
+
+        Raises:
+            CalledProcessError - ffmpeg failed, and the partial file has been removed
+        """
+
+        recorder = self.download_manager.recorder
+        known_replaygain = self.download_manager.get_known_replaygain(loudness_key)
+        measure = self.download_manager.replaygain == True and known_replaygain == None
+
+        # Start ffmpeg reading from its standard input, writing the tags, and any ReplayGain values already known, as it encodes
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0"]
+        command += self.download_manager.build_cover_inputs(video_metadata)
+        command += self.download_manager.build_tag_arguments(video_metadata, 0, 1, known_replaygain) + self.download_manager.build_codec_arguments(stream.audio_codec) + [partial_filename]
+        if measure == True:
+            command += self.download_manager.build_pcm_arguments(0)
+        ffmpeg_process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE if measure == True else None)
+
+        # Measure the loudness of what ffmpeg decodes alongside, if enabled
+        measure_task = None
+        if measure == True:
+            measure_task = asyncio.create_task(self.measure(ffmpeg_process.stdout))
+
+        try:
+            # Feed the downloaded chunks to ffmpeg as they arrive, closing the fetch whatever happens so its connection is freed
+            chunks = self.fetch(stream.url)
+            try:
+                bytes_done = 0
+                async for chunk in chunks:
+                    ffmpeg_process.stdin.write(chunk)
+                    await ffmpeg_process.stdin.drain()
+                    recorder.count("bytes_downloaded", len(chunk))
+
+                    bytes_done += len(chunk)
+                    self.download_manager.progress_aggregator.update(video_filename, stream.filesize, bytes_done)
+
+            # If ffmpeg exited early, its return code says why
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+            finally:
+                await chunks.aclose()
+
+            ffmpeg_process.stdin.close()
+            return_code = await ffmpeg_process.wait()
+
+        # If the download failed or the job was cancelled, stop ffmpeg and remove the partial file
+        except BaseException as err_msg:
+            recorder.count("download_failures")
+            if ffmpeg_process.returncode == None:
+                ffmpeg_process.kill()
+                await ffmpeg_process.wait()
+            if measure_task != None:
+                measure_task.cancel()
+            if os.path.isfile(partial_filename) == True:
+                os.remove(partial_filename)
+
+            if isinstance(err_msg, Exception) == False:
+                raise
+            download_error = errors.classify_error(err_msg)
+            if download_error is err_msg:
+                raise
+            raise download_error from err_msg
+
+        # If ffmpeg failed, remove what it wrote, as a failed download does
+        if return_code != 0:
+            if measure_task != None:
+                measure_task.cancel()
+            if os.path.isfile(partial_filename) == True:
+                os.remove(partial_filename)
+            raise subprocess.CalledProcessError(return_code, command)
+
+        replaygain = None
+        if measure_task != None:
+            replaygain = await measure_task
+            self.download_manager.remember_replaygain(loudness_key, replaygain)
+
+        return replaygain
+
+    async def measure(self, pcm_stream, chunk_size=256 * 1024):
+        """ Measure the loudness of the raw samples ffmpeg writes to its standard output, filtering them on worker threads
+
+        Arguments:
+            self - self - This object
+            pcm_stream - StreamReader object - ffmpeg's standard output
+            chunk_size - int - Number of bytes to read at a time
+
+        Returns:
+            replaygain - dict or None - Track gain in dB and peak, or None if the track has no measurable loudness
+        """
+
+        from lib import loudness
+        meter = loudness.LoudnessMeter()
+
+        while True:
+            pcm_data = await pcm_stream.read(chunk_size)
+            if pcm_data == b"":
+                break
+            await asyncio.to_thread(meter.add, pcm_data)
+
+        return await asyncio.to_thread(meter.get_replaygain)
+
+    def get_host_slot(self, pool_key):
+        """ Get the semaphore limiting the connections open to a host, which allows as many as the shared transport does
+
+        Arguments:
+            self - self - This object
+            pool_key - tuple - Scheme/host/port tuple of the host
+
+        Returns:
+            host_slot - Semaphore object - The host's semaphore
+        """
+
+        if pool_key not in self.host_slots:
+            max_connections = self.concurrency
+            if self.download_manager.transport != None:
+                max_connections = self.download_manager.transport.max_connections_per_host
+            self.host_slots[pool_key] = asyncio.Semaphore(max_connections)
+
+        return self.host_slots[pool_key]
+
+    async def fetch(self, url, redirect_limit=5):
+        """ Fetch a URL over asyncio sockets, yielding the body a chunk at a time, within the shared transport's bandwidth and per-host connection limits
+
+        The body is fetched with one plain GET, without the ranged requests the threaded engine makes, so an interrupted fetch starts again from the beginning and a throttled stream isn't split into chunks.
+
+        Arguments:
+            self - self - This object
+            url - string - The URL to fetch
+            redirect_limit - int - Maximum number of redirects to follow
+
+        Returns:
+            chunks - async generator of bytes - The body of the response
+        """
+
+        for c in range(redirect_limit + 1):
+            parsed_url = urllib.parse.urlsplit(url)
+            if parsed_url.scheme not in ("http", "https"):
+                raise ValueError("Invalid URL: {}".format(url))
+
+            use_ssl = parsed_url.scheme == "https"
+            port = parsed_url.port or (443 if use_ssl == True else 80)
+            path = parsed_url.path or "/"
+            if parsed_url.query != "":
+                path += "?" + parsed_url.query
+
+            # Wait for one of the host's connections to come free, then take the bytes read out of the shared bandwidth limit
+            host_slot = self.get_host_slot((parsed_url.scheme, parsed_url.hostname, port))
+            await host_slot.acquire()
+            token_bucket = None
+            if self.download_manager.transport != None:
+                token_bucket = self.download_manager.transport.token_bucket
+
+            try:
+                reader, writer = await asyncio.open_connection(parsed_url.hostname, port, ssl=ssl.create_default_context() if use_ssl == True else None)
+            except BaseException:
+                host_slot.release()
+                raise
+
+            try:
+                # Send the request
+                request_lines = [
+                    "GET {} HTTP/1.1".format(path),
+                    "Host: {}".format(parsed_url.netloc),
+                    "User-Agent: Mozilla/5.0",
+                    "Accept-Language: en-US,en",
+                    "Connection: close",
+                    "",
+                    ""
+                ]
+                writer.write("\r\n".join(request_lines).encode("latin-1"))
+                await writer.drain()
+
+                # Read the status line and headers
+                status_line = (await reader.readline()).decode("latin-1").strip()
+                status_parts = status_line.split(" ", 2)
+                if len(status_parts) < 2 or status_parts[1].isdigit() == False:
+                    raise http.client.BadStatusLine(status_line)
+                status = int(status_parts[1])
+                reason = status_parts[2] if len(status_parts) > 2 else ""
+
+                headers = http.client.HTTPMessage()
+                while True:
+                    header_line = (await reader.readline()).decode("latin-1")
+                    if header_line in ("\r\n", "\n", ""):
+                        break
+                    name, _, value = header_line.partition(":")
+                    headers[name.strip()] = value.strip()
+
+                # Follow redirects
+                if status in (301, 302, 303, 307, 308) and headers.get("Location") != None:
+                    url = urllib.parse.urljoin(url, headers["Location"])
+                    continue
+
+                # Raise errors the same way urllib does, so they are classified the same way
+                if status >= 400:
+                    raise urllib.error.HTTPError(url, status, reason, headers, None)
+
+                # Read the body, either in chunked encoding or up to its length
+                if headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    while True:
+                        chunk_length = int((await reader.readline()).split(b";")[0].strip(), 16)
+                        if chunk_length == 0:
+                            break
+                        chunk = await reader.readexactly(chunk_length)
+                        if token_bucket != None:
+                            await asyncio.sleep(token_bucket.reserve(len(chunk)))
+                        yield chunk
+                        await reader.readline()
+
+                elif headers.get("Content-Length") != None:
+                    bytes_remaining = int(headers["Content-Length"])
+                    while bytes_remaining > 0:
+                        chunk = await reader.read(min(self.chunk_size, bytes_remaining))
+                        if len(chunk) == 0:
+                            raise http.client.IncompleteRead(b"", bytes_remaining)
+                        bytes_remaining -= len(chunk)
+                        if token_bucket != None:
+                            await asyncio.sleep(token_bucket.reserve(len(chunk)))
+                        yield chunk
+
+                else:
+                    while True:
+                        chunk = await reader.read(self.chunk_size)
+                        if len(chunk) == 0:
+                            break
+                        if token_bucket != None:
+                            await asyncio.sleep(token_bucket.reserve(len(chunk)))
+                        yield chunk
+
+                return
+
+            finally:
+                writer.close()
+                host_slot.release()
+
+        raise urllib.error.HTTPError(url, status, "Too many redirects", headers, None)
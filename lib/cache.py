@@ -0,0 +1,179 @@
+# lib/cache.py
+# Persistent on-disk cache of video and playlist metadata
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from lib import constants
+
+# Default location of the cache database
+DEFAULT_CACHE_FILE = constants.DEFAULT_CACHE_FILE
+
+# Default time to live of each kind of entry, in seconds
+DEFAULT_TTLS = {
+    "video": 7 * 24 * 60 * 60,
+    "playlist_title": 24 * 60 * 60,
+    "playlist": 60 * 60,
+    "loudness": 30 * 24 * 60 * 60
+}
+
+class MetadataCache(object):
+    """ Cache video and playlist metadata in an SQLite database between runs
+
+    Entries are keyed by kind and YouTube ID, expire after a per-kind time to live, and once the cache holds more than max_entries the least recently used entries are evicted.
+
+    Methods:
+        __init__() - Initialize the object
+        get() - Look up an entry
+        put() - Store an entry
+        evict() - Remove expired and least recently used entries
+        stats() - Get the hit/miss counts
+        close() - Close the database
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ttls=None, max_entries=100000, refresh=False):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            cache_file - filename - Path of the SQLite database
+            ttls - dict or None - Time to live in seconds of each kind of entry, overriding the defaults
+            max_entries - int - Number of entries to keep before evicting the least recently used
+            refresh - bool - Ignore stored entries, but still store fresh ones
+        """
+
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls != None:
+            self.ttls.update(ttls)
+
+        self.max_entries = max_entries
+        self.refresh = refresh
+
+        # Hit/miss counts
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.puts_since_eviction = 0
+
+        # Create the directory for the database if it doesn't exist yet
+        cache_directory = os.path.dirname(cache_file)
+        if cache_directory != "":
+            os.makedirs(cache_directory, exist_ok=True)
+
+        # The connection is shared by all threads, so access to it is serialized with a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT, value TEXT, stored_at REAL, accessed_at REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self.connection.commit()
+
+        # Clear out anything that expired since the last run
+        self.evict()
+
+    def get(self, kind, entry_id):
+        """ Look up an entry
+
+        Arguments:
+            self - self - This object
+            kind - string - The kind of entry, such as "video" or "playlist"
+            entry_id - string - The YouTube ID of the video or playlist
+
+        Returns:
+            value - any or None - The stored value, or None if there is no fresh entry
+        """
+
+        if self.refresh == True:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        key = "{0}:{1}".format(kind, entry_id)
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+
+            # Missing or expired entries are misses
+            if row == None or now - row[1] > self.ttls[kind]:
+                self.misses += 1
+                return None
+
+            # Mark the entry as recently used
+            self.connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, kind, entry_id, value):
+        """ Store an entry, replacing any existing one
+
+        Arguments:
+            self - self - This object
+            kind - string - The kind of entry, such as "video" or "playlist"
+            entry_id - string - The YouTube ID of the video or playlist
+            value - any - JSON serializable value to store
+        """
+
+        key = "{0}:{1}".format(kind, entry_id)
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO entries (key, kind, value, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)", (key, kind, json.dumps(value), now, now))
+            self.connection.commit()
+            self.puts_since_eviction += 1
+            evict_now = self.puts_since_eviction >= 1000
+
+        # Evicting is a table scan, so only do it every so often
+        if evict_now == True:
+            self.evict()
+
+    def evict(self):
+        """ Remove expired entries, then the least recently used entries beyond max_entries
+
+        Arguments:
+            self - self - This object
+        """
+
+        now = time.time()
+
+        with self.lock:
+            evicted = 0
+            for kind, ttl in self.ttls.items():
+                evicted += self.connection.execute("DELETE FROM entries WHERE kind = ? AND stored_at < ?", (kind, now - ttl)).rowcount
+
+            evicted += self.connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            self.connection.commit()
+
+            self.evictions += evicted
+            self.puts_since_eviction = 0
+
+    def stats(self):
+        """ Get the hit/miss counts of the cache
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - Number of hits, misses and evictions
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def close(self):
+        """ Close the database
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.lock:
+            self.connection.close()
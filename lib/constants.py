@@ -0,0 +1,13 @@
+# lib/constants.py
+# Default paths, kept apart from the modules that use them so help and argument parsing can show them without loading SQLite or sockets
+
+import os
+
+# Directory holding the metadata cache and the daemon's socket
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "bulk-yt-mp3")
+
+# Default location of the metadata cache database
+DEFAULT_CACHE_FILE = os.path.join(DEFAULT_CACHE_DIRECTORY, "metadata.sqlite")
+
+# Default location of the daemon's socket, next to the metadata cache
+DEFAULT_SOCKET_FILE = os.path.join(DEFAULT_CACHE_DIRECTORY, "daemon.sock")
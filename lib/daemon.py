@@ -0,0 +1,384 @@
+# lib/daemon.py
+# Keep the program running as a daemon, taking download jobs over a Unix socket
+
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import socketserver
+from lib import constants
+
+# Default location of the daemon's socket, next to the metadata cache
+DEFAULT_SOCKET_FILE = constants.DEFAULT_SOCKET_FILE
+
+class DaemonError(Exception):
+    """ The daemon refused or failed a request """
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ Answer each JSON request line on a connection with a JSON response line
+
+    Methods:
+        handle() - Answer requests until the client disconnects
+    """
+
+    def handle(self):
+        """ Answer requests until the client disconnects
+
+        Arguments:
+            self - self - This object
+        """
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                response = self.server.daemon.handle_request(request)
+            except (ValueError, KeyError, TypeError) as err_msg:
+                response = {"ok": False, "error": "Bad request: {}".format(err_msg)}
+
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class DaemonServer(object):
+    """ Accept download jobs over a Unix socket and run them one after another with warm caches and connections
+
+    The protocol is one JSON object per line each way. Requests have an "action" of "submit", with the job's "video_urls", "playlist_url", "tag_data_file", "outdir" and optional "options" overriding the daemon's own, "status", with an optional "job" ID, or "shutdown". A submitted job is checked before it is queued, so a bad one is refused to the client rather than failing later. Jobs are run in the order they were submitted by a single job thread. Each job builds worker pools of its own, sized by its options, while the metadata cache, connection pool, artwork cache and adaptive controller are kept from job to job.
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Listen on the socket and start the job thread
+        serve_forever() - Answer clients until shut down, then finish the queued jobs
+        handle_request() - Answer one request
+        submit() - Queue a job
+        get_status() - Get the status of one or every job
+        run_jobs() - Run queued jobs until shut down
+        shutdown() - Stop answering clients
+    """
+
+    def __init__(self, socket_file, run_job, check_job=None, max_finished_jobs=1000):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            socket_file - filename - Path of the Unix socket to listen on
+            run_job - callable - Runs a job, taking its request dict and returning a dict of its results
+            check_job - callable or None - Checks a job when it is submitted, taking its request dict and raising ValueError if it can't be run
+            max_finished_jobs - int - Number of finished jobs to keep the status of
+        """
+
+        self.socket_file = socket_file
+        self.run_job = run_job
+        self.check_job = check_job
+        self.max_finished_jobs = max_finished_jobs
+
+        # Status of each job, keyed by job ID, in the order they were submitted
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.next_job_id = 1
+        self.job_queue = queue.Queue()
+
+        self.server = None
+        self.job_thread = None
+
+    def start(self):
+        """ Listen on the socket and start the job thread, replacing the socket file of a daemon that has exited
+
+        Arguments:
+            self - self - This object
+        """
+
+        # Refuse to start if another daemon is answering on the socket
+        if os.path.exists(self.socket_file) == True:
+            try:
+                DaemonClient(self.socket_file).request({"action": "status", "job": 0})
+            except (OSError, DaemonError):
+                os.remove(self.socket_file)
+            else:
+                raise DaemonError("A daemon is already running on {}".format(self.socket_file))
+
+        # Create the directory for the socket if it doesn't exist yet
+        socket_directory = os.path.dirname(self.socket_file)
+        if socket_directory != "":
+            os.makedirs(socket_directory, exist_ok=True)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_file, RequestHandler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+
+        # Only the user running the daemon may submit jobs
+        os.chmod(self.socket_file, 0o600)
+
+        self.job_thread = threading.Thread(target=self.run_jobs, name="daemon-jobs", daemon=True)
+        self.job_thread.start()
+
+    def serve_forever(self):
+        """ Answer clients until shut down, then wait for the queued jobs to finish and remove the socket
+
+        Arguments:
+            self - self - This object
+        """
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.job_queue.put(None)
+            self.job_thread.join()
+            if os.path.exists(self.socket_file) == True:
+                os.remove(self.socket_file)
+
+    def handle_request(self, request):
+        """ Answer one request
+
+        Arguments:
+            self - self - This object
+            request - dict - The request
+
+        Returns:
+            response - dict - The response, with "ok" set to whether the request succeeded
+        """
+
+        action = request["action"]
+
+        if action == "submit":
+            job_id = self.submit(request)
+            return {"ok": True, "job": job_id}
+
+        elif action == "status":
+            return {"ok": True, "jobs": self.get_status(request.get("job"))}
+
+        elif action == "shutdown":
+            # Shut down from another thread, since this one is serving the request
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+
+        return {"ok": False, "error": "Unknown action: {}".format(action)}
+
+    def submit(self, request):
+        """ Queue a job
+
+        Arguments:
+            self - self - This object
+            request - dict - The submit request, holding the job's video_urls, playlist_url, tag_data_file and outdir, and any options overriding the daemon's own
+
+        Returns:
+            job_id - int - ID of the new job
+
+        Raises:
+            ValueError - The job can't be run
+        """
+
+        job_request = {
+            "video_urls": list(request.get("video_urls") or []),
+            "playlist_url": request.get("playlist_url"),
+            "tag_data_file": request.get("tag_data_file"),
+            "outdir": request["outdir"],
+            "options": dict(request.get("options") or {})
+        }
+
+        # Paths are resolved by the client, since the daemon's working directory is its own
+        if os.path.isabs(job_request["outdir"]) == False:
+            raise ValueError("outdir must be an absolute path")
+
+        # Refuse a job that would fail once run, while the client is still waiting for an answer
+        if self.check_job != None:
+            self.check_job(job_request)
+
+        with self.jobs_lock:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            self.jobs[job_id] = {"job": job_id, "state": "queued", "submitted": time.time(), "request": job_request}
+
+            # Forget the oldest finished jobs
+            finished_job_ids = [finished_job_id for finished_job_id, job in self.jobs.items() if job["state"] in ("done", "failed")]
+            for finished_job_id in finished_job_ids[:max(0, len(finished_job_ids) - self.max_finished_jobs)]:
+                del self.jobs[finished_job_id]
+
+        self.job_queue.put(job_id)
+        return job_id
+
+    def get_status(self, job_id=None):
+        """ Get the status of one or every job
+
+        Arguments:
+            self - self - This object
+            job_id - int or None - ID of the job, or None for every job
+
+        Returns:
+            jobs - list of dicts - Status of the job, or of every job in the order they were submitted, which is empty if there is no such job
+        """
+
+        with self.jobs_lock:
+            if job_id == None:
+                return [dict(job) for job in self.jobs.values()]
+            if job_id in self.jobs:
+                return [dict(self.jobs[job_id])]
+            return []
+
+    def run_jobs(self):
+        """ Run queued jobs in order until shut down
+
+        Arguments:
+            self - self - This object
+        """
+
+        while True:
+            job_id = self.job_queue.get()
+            if job_id == None:
+                return
+
+            with self.jobs_lock:
+                job = self.jobs[job_id]
+                job["state"] = "running"
+                job["started"] = time.time()
+
+            print("[I] Starting job {}".format(job_id))
+
+            # Record how the job went, keeping the daemon running whatever happens
+            try:
+                job_results = self.run_job(job["request"])
+                job_state = "done"
+            except Exception as err_msg:
+                job_results = {"error": str(err_msg)}
+                job_state = "failed"
+
+            with self.jobs_lock:
+                job.update(job_results)
+                job["state"] = job_state
+                job["finished"] = time.time()
+
+            print("[I] Job {0} {1}".format(job_id, job_state))
+
+    def shutdown(self):
+        """ Stop answering clients, letting the queued jobs finish
+
+        Arguments:
+            self - self - This object
+        """
+
+        self.server.shutdown()
+
+class DaemonClient(object):
+    """ Submit jobs to a running daemon and ask about them
+
+    Methods:
+        __init__() - Initialize the object
+        request() - Send a request and read the response
+        submit() - Submit a job
+        get_status() - Get the status of one or every job
+        wait() - Wait for a job to finish
+        shutdown() - Ask the daemon to shut down
+    """
+
+    def __init__(self, socket_file=DEFAULT_SOCKET_FILE, timeout=10.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            socket_file - filename - Path of the daemon's Unix socket
+            timeout - float - Seconds to wait for the daemon to answer
+        """
+
+        self.socket_file = socket_file
+        self.timeout = timeout
+
+    def request(self, request):
+        """ Send a request and read the response, on a connection of its own
+
+        Arguments:
+            self - self - This object
+            request - dict - The request
+
+        Returns:
+            response - dict - The response
+
+        Raises:
+            OSError - The daemon isn't running
+            DaemonError - The daemon refused the request
+        """
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            client_socket.settimeout(self.timeout)
+            client_socket.connect(self.socket_file)
+            client_socket.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+            with client_socket.makefile("rb") as response_file:
+                line = response_file.readline()
+
+        if line == b"":
+            raise DaemonError("The daemon closed the connection")
+
+        response = json.loads(line.decode("utf-8"))
+        if response.get("ok") != True:
+            raise DaemonError(response.get("error", "Request failed"))
+
+        return response
+
+    def submit(self, video_urls, playlist_url, tag_data_file, outdir, options=None):
+        """ Submit a job
+
+        Arguments:
+            self - self - This object
+            video_urls - list of strings - URLs of individual videos to download
+            playlist_url - string or None - URL of a playlist to download
+            tag_data_file - filename or None - CSV file of tag data
+            outdir - string - Directory to download to
+            options - dict or None - Options overriding the daemon's own for this job
+
+        Returns:
+            job_id - int - ID of the new job
+
+        Raises:
+            ValueError - The job can't be run
+        """
+
+        # Resolve paths here, since the daemon has a working directory of its own
+        if tag_data_file != None:
+            tag_data_file = os.path.abspath(tag_data_file)
+
+        response = self.request({"action": "submit", "video_urls": video_urls, "playlist_url": playlist_url, "tag_data_file": tag_data_file, "outdir": os.path.abspath(outdir), "options": options or {}})
+        return response["job"]
+
+    def get_status(self, job_id=None):
+        """ Get the status of one or every job
+
+        Arguments:
+            self - self - This object
+            job_id - int or None - ID of the job, or None for every job
+
+        Returns:
+            jobs - list of dicts - Status of each job
+        """
+
+        return self.request({"action": "status", "job": job_id})["jobs"]
+
+    def wait(self, job_id, poll_interval=1.0):
+        """ Wait for a job to finish
+
+        Arguments:
+            self - self - This object
+            job_id - int - ID of the job
+            poll_interval - float - Seconds between status requests
+
+        Returns:
+            job - dict - Final status of the job
+        """
+
+        while True:
+            jobs = self.get_status(job_id)
+            if len(jobs) == 0:
+                raise DaemonError("The daemon has no job {}".format(job_id))
+            if jobs[0]["state"] in ("done", "failed"):
+                return jobs[0]
+
+            time.sleep(poll_interval)
+
+    def shutdown(self):
+        """ Ask the daemon to shut down once its queued jobs have finished
+
+        Arguments:
+            self - self - This object
+        """
+
+        self.request({"action": "shutdown"})
@@ -0,0 +1,64 @@
+# lib/errors.py
+# Exceptions raised while downloading, grouped by how the caller should react
+
+import socket
+import urllib.error
+import http.client
+
+# Words in a response's reason phrase that show the server is limiting how much it is asked for
+THROTTLING_WORDS = ("too many", "rate limit", "rate-limit", "ratelimit", "quota", "throttl", "slow down")
+
+class DownloadError(Exception):
+    """ Base class for errors raised while looking up or downloading a video """
+
+class VideoUnavailableError(DownloadError):
+    """ The video can't be downloaded at all, so retrying is pointless """
+
+class ThrottledError(DownloadError):
+    """ YouTube refused the request because too many were made, so back off and download less at once """
+
+class TransientError(DownloadError):
+    """ The connection failed in a way that may not happen again, so retry after a pause """
+
+def classify_error(err_msg):
+    """ Turn an exception raised while downloading into a DownloadError subclass
+
+    Arguments:
+        err_msg - Exception - The exception that was raised
+
+    Returns:
+        download_error - Exception - A ThrottledError or TransientError if the exception is one of those, otherwise the original exception
+    """
+
+    if isinstance(err_msg, DownloadError) == True:
+        return err_msg
+
+    # Too Many Requests and Service Unavailable, and a Forbidden only if it says it is throttling, since most are expired or refused stream URLs that backing off won't fix
+    if isinstance(err_msg, urllib.error.HTTPError) == True:
+        if err_msg.code in (429, 503) or (err_msg.code == 403 and is_throttling_signal(err_msg) == True):
+            return ThrottledError("Throttled by server (HTTP {})".format(err_msg.code))
+        if err_msg.code >= 500:
+            return TransientError("Server error (HTTP {})".format(err_msg.code))
+        return err_msg
+
+    # Dropped connections and timeouts
+    if isinstance(err_msg, (urllib.error.URLError, socket.timeout, ConnectionError, http.client.IncompleteRead, http.client.RemoteDisconnected)) == True:
+        return TransientError("Connection failed: {}".format(err_msg))
+
+    return err_msg
+
+def is_throttling_signal(err_msg):
+    """ Check whether an HTTP error says the server is throttling the client, with a Retry-After header or a reason phrase about rate limits
+
+    Arguments:
+        err_msg - urllib.error.HTTPError - The HTTP error
+
+    Returns:
+        throttling - bool - Whether the error carries a throttling signal
+    """
+
+    if err_msg.headers != None and err_msg.headers.get("Retry-After") != None:
+        return True
+
+    reason = str(err_msg.reason).lower()
+    return any(word in reason for word in THROTTLING_WORDS)
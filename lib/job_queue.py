@@ -0,0 +1,448 @@
+# lib/job_queue.py
+# A queue of videos shared by worker processes on any number of machines, which lease one video at a time
+
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import threading
+from lib import errors
+from lib import journal
+from lib import scheduler
+
+class JobQueue(object):
+    """ A queue of videos to download, kept in an SQLite database that any number of worker processes can lease videos from
+
+    A worker leases a video for lease_duration seconds and must heartbeat to keep it. A lease that expires, because its worker crashed or lost the shared storage, is handed to the next worker that asks, until the video has been attempted max_attempts times. A video that failed is put back in the queue with exponential backoff, and can't be leased again until its delay has passed; the delay is kept in lease_expires, which a pending video otherwise has no use for. A video is only recorded as done by the worker that holds its lease, and its output is renamed into place in the same transaction, so each output is recorded exactly once and never overwritten by a worker that lost its lease. The database uses SQLite's default rollback journal rather than WAL, since WAL doesn't work over network file systems, and every change is its own immediate transaction.
+
+    Methods:
+        __init__() - Initialize the object
+        add() - Add a video to the queue
+        lease() - Lease the next video to download
+        heartbeat() - Extend the leases held by a worker
+        complete() - Record a leased video as downloaded and rename its output into place
+        fail() - Record a leased video as failed or put it back in the queue
+        get_retry_delay() - Get how long a failed video waits before it can be leased again
+        get_completed() - Get the videos that have been downloaded
+        is_finished() - Check whether every video is done or failed
+        stats() - Count the videos in each state
+        close() - Close the database
+    """
+
+    def __init__(self, queue_file, lease_duration=300.0, max_attempts=3, retry_delay=30.0, max_retry_delay=600.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            queue_file - filename - Path of the SQLite database, which can be on shared storage
+            lease_duration - float - Seconds a lease lasts without a heartbeat
+            max_attempts - int - Number of times a video is leased before it is given up on
+            retry_delay - float - Base delay in seconds before a failed video can be leased again, doubled with each attempt
+            max_retry_delay - float - Longest delay in seconds before a failed video can be leased again
+        """
+
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Create the directory for the database if it doesn't exist yet
+        queue_directory = os.path.dirname(queue_file)
+        if queue_directory != "":
+            os.makedirs(queue_directory, exist_ok=True)
+
+        # The connection is shared by all threads, so access to it is serialized with a lock. Other processes are waited on for up to a minute
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(queue_file, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, video_id TEXT, video_url TEXT, title TEXT, filename TEXT, metadata TEXT, state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, finished REAL, UNIQUE (video_id, filename))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)")
+
+    def add(self, video_id, video_url, title, filename, metadata):
+        """ Add a video to the queue, unless it is already queued to the same file
+
+        Arguments:
+            self - self - This object
+            video_id - string - YouTube ID of the video
+            video_url - string - URL of the video
+            title - string - Title of the video
+            filename - filename - Absolute path to download the video to
+            metadata - dict or None - Tag data for the video
+
+        Returns:
+            added - bool - Whether the video was added
+        """
+
+        with self.lock:
+            cursor = self.connection.execute("INSERT OR IGNORE INTO jobs (video_id, video_url, title, filename, metadata) VALUES (?, ?, ?, ?, ?)", (video_id, video_url, title, filename, json.dumps(metadata)))
+
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id):
+        """ Lease the next pending video whose retry delay has passed, or one whose lease has expired
+
+        Arguments:
+            self - self - This object
+            worker_id - string - ID of the worker taking the lease
+
+        Returns:
+            job - tuple or None - A job ID/URL/title/filename/metadata tuple, or None if there is nothing to lease right now
+        """
+
+        now = time.time()
+
+        with self.lock:
+            # Take the database's write lock first, so no other worker can lease the same video
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Give up on videos whose leases keep expiring
+                self.connection.execute("UPDATE jobs SET state = 'failed', error = 'Lease expired too many times', finished = ? WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, self.max_attempts))
+
+                row = self.connection.execute("SELECT id, video_url, title, filename, metadata FROM jobs WHERE (state = 'pending' AND (lease_expires IS NULL OR lease_expires <= ?)) OR (state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1", (now, now)).fetchone()
+                if row != None:
+                    self.connection.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?", (worker_id, now + self.lease_duration, row[0]))
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        if row == None:
+            return None
+
+        job_id, video_url, title, filename, metadata = row
+        return job_id, video_url, title, filename, json.loads(metadata)
+
+    def heartbeat(self, worker_id):
+        """ Extend every lease held by a worker
+
+        Arguments:
+            self - self - This object
+            worker_id - string - ID of the worker
+
+        Returns:
+            lease_count - int - Number of leases extended
+        """
+
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET lease_expires = ? WHERE state = 'leased' AND worker = ?", (time.time() + self.lease_duration, worker_id))
+
+        return cursor.rowcount
+
+    def complete(self, job_id, worker_id, output_file, finished_file=None):
+        """ Record a leased video as downloaded, if the worker still holds its lease, renaming its finished file into place first
+
+        The lease is checked and the file renamed while the database's write lock is held, so no other worker can take the lease over in between.
+
+        Arguments:
+            self - self - This object
+            job_id - int - ID of the job
+            worker_id - string - ID of the worker
+            output_file - filename - The downloaded MP3 file's final name
+            finished_file - filename or None - The file the worker downloaded to, renamed to output_file only if the lease is still held
+
+        Returns:
+            recorded - bool - Whether the video was recorded, which is False if the lease was lost to another worker and nothing was renamed
+        """
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT id FROM jobs WHERE id = ? AND worker = ? AND state = 'leased'", (job_id, worker_id)).fetchone()
+                if row != None:
+                    if finished_file != None:
+                        os.replace(finished_file, output_file)
+                    self.connection.execute("UPDATE jobs SET state = 'done', filename = ?, error = NULL, finished = ? WHERE id = ?", (output_file, time.time(), job_id))
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return row != None
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        """ Record a leased video as failed, putting it back in the queue if it can be retried
+
+        Arguments:
+            self - self - This object
+            job_id - int - ID of the job
+            worker_id - string - ID of the worker
+            error - string - Why it failed
+            retry - bool - Whether the failure might not happen again
+
+        Returns:
+            state - string or None - "pending" if the video was put back in the queue, "failed" if it was given up on, or None if the worker no longer held the lease
+        """
+
+        with self.lock:
+            # Take the write lock first, so the state returned is the one written
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'leased'", (job_id, worker_id)).fetchone()
+                state = None
+                if row != None:
+                    now = time.time()
+                    if retry == True and row[0] < self.max_attempts:
+                        # Hold the video back for a while, so a failure that passes isn't retried straight into again
+                        state = "pending"
+                        self.connection.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = ?, error = ?, finished = NULL WHERE id = ?", (state, now + self.get_retry_delay(row[0]), error, job_id))
+                    else:
+                        state = "failed"
+                        self.connection.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ?, finished = ? WHERE id = ?", (state, error, now, job_id))
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return state
+
+    def get_retry_delay(self, attempts):
+        """ Get how long a failed video waits before it can be leased again, using exponential backoff with full jitter
+
+        Arguments:
+            self - self - This object
+            attempts - int - Number of times the video has been leased
+
+        Returns:
+            delay - float - Delay in seconds
+        """
+
+        return random.uniform(0, min(self.max_retry_delay, self.retry_delay * (2 ** (attempts - 1))))
+
+    def get_completed(self):
+        """ Get the videos that have been downloaded
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            completed - list of tuples - A video ID/filename/tagged tuple for each downloaded video
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT video_id, filename, metadata FROM jobs WHERE state = 'done'").fetchall()
+
+        return [(video_id, filename, json.loads(metadata) != None) for video_id, filename, metadata in rows]
+
+    def is_finished(self):
+        """ Check whether every video is done or failed, so there is nothing left to wait for
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            finished - bool - Whether no videos are pending or leased
+        """
+
+        with self.lock:
+            row = self.connection.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'leased')").fetchone()
+
+        return row[0] == 0
+
+    def stats(self):
+        """ Count the videos in each state
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - Number of pending, leased, done and failed videos
+        """
+
+        stats = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        with self.lock:
+            for state, count in self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+                stats[state] = count
+
+        return stats
+
+    def close(self):
+        """ Close the database
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.lock:
+            self.connection.close()
+
+class QueueWorker(object):
+    """ Lease videos from a JobQueue and download them on a pool of threads until the queue is finished
+
+    Each thread leases one video at a time, while a heartbeat thread keeps every lease held by this worker alive. When nothing can be leased but other workers still hold leases or failed videos are waiting to be retried, the threads wait and try again, so videos whose leases expire are picked up. Each lease is downloaded under a filename of its own and only renamed into place by JobQueue.complete() once the lease is confirmed, so a worker that has lost its lease without knowing it can never write into the files of the worker that took the video over, and its output is thrown away. Errors from the database, such as it being locked by other workers for too long, are reported and the thread tries again after the poll interval.
+
+    Methods:
+        __init__() - Initialize the object
+        run() - Download videos until the queue is finished
+        work() - Worker thread loop
+        heartbeat() - Heartbeat thread loop
+    """
+
+    def __init__(self, job_queue, downloader, worker_count=4, worker_id=None, poll_interval=5.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            job_queue - JobQueue object - The shared queue
+            downloader - Downloader object - Downloads, converts and tags each video
+            worker_count - int - Number of videos to download at once
+            worker_id - string or None - ID of this worker, defaulting to the host name and process ID
+            poll_interval - float - Seconds to wait before asking again when nothing can be leased
+        """
+
+        if worker_id == None:
+            worker_id = "{0}-{1}".format(socket.gethostname(), os.getpid())
+
+        self.job_queue = job_queue
+        self.downloader = downloader
+        self.worker_count = worker_count
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+
+        self.stop_event = threading.Event()
+
+        # Outcome counts
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost = 0
+        self.lock = threading.Lock()
+
+    def run(self):
+        """ Download videos until the queue is finished
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - Number of videos this worker completed, gave up on, put back in the queue to retry, and downloaded after losing the lease
+        """
+
+        heartbeat_thread = threading.Thread(target=self.heartbeat, name="heartbeat", daemon=True)
+        heartbeat_thread.start()
+
+        worker_pool = scheduler.WorkerPool(self.worker_count, name="queue-worker")
+        worker_pool.start()
+        for c in range(self.worker_count):
+            worker_pool.submit(c, self.work)
+
+        try:
+            worker_pool.join()
+        finally:
+            self.stop_event.set()
+            heartbeat_thread.join()
+
+        return {"completed": self.completed, "failed": self.failed, "retried": self.retried, "lost": self.lost}
+
+    def work(self):
+        """ Lease and download videos until the queue is finished
+
+        Arguments:
+            self - self - This object
+        """
+
+        while self.stop_event.is_set() == False:
+            # Nothing to lease, so stop if every video is accounted for, otherwise wait for leases to expire or retries to come due
+            try:
+                job = self.job_queue.lease(self.worker_id)
+                if job == None and self.job_queue.is_finished() == True:
+                    return
+
+            # The database may be locked by other workers or briefly out of reach on shared storage
+            except sqlite3.OperationalError as err_msg:
+                print("\t[E] Can't lease from the job queue, trying again: {}".format(err_msg))
+                job = None
+
+            if job == None:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            job_id, video_url, video_title, video_filename, video_metadata = job
+            print("\t[i] Downloading {0} ({1})".format(video_title, video_url))
+
+            # Download under a name no other lease uses
+            lease_filename = get_lease_filename(video_filename)
+
+            try:
+                os.makedirs(os.path.dirname(video_filename), exist_ok=True)
+                mp3_file = self.downloader.download_and_convert(video_url, video_title, lease_filename, video_metadata)
+
+            # Unavailable videos won't become available by trying again
+            except Exception as err_msg:
+                print("\t[E] {0}: {1}".format(video_url, err_msg))
+                remove_lease_files(lease_filename)
+
+                # Only count the video as failed once it has been given up on. If the failure can't be recorded, the lease expires and the video is tried again
+                try:
+                    job_state = self.job_queue.fail(job_id, self.worker_id, str(err_msg), isinstance(err_msg, errors.VideoUnavailableError) == False)
+                except sqlite3.OperationalError as db_err_msg:
+                    print("\t[E] Can't record the failure of {0} in the job queue: {1}".format(video_url, db_err_msg))
+                    job_state = None
+
+                with self.lock:
+                    if job_state == "failed":
+                        self.failed += 1
+                    elif job_state == "pending":
+                        self.retried += 1
+                continue
+
+            # Only the holder of the lease renames its file into place and records the video, so it is recorded once and never overwritten by a worker that lost the lease
+            try:
+                recorded = self.job_queue.complete(job_id, self.worker_id, video_filename, mp3_file)
+                if recorded == False:
+                    print("\t[i] Lease on {} was lost, another worker will record it".format(video_url))
+            except sqlite3.OperationalError as err_msg:
+                print("\t[E] Can't record {0} in the job queue, its lease will expire and it will be downloaded again: {1}".format(video_url, err_msg))
+                recorded = False
+
+            if recorded == True:
+                with self.lock:
+                    self.completed += 1
+            else:
+                remove_lease_files(mp3_file)
+                with self.lock:
+                    self.lost += 1
+
+    def heartbeat(self):
+        """ Extend this worker's leases a few times per lease duration until stopped
+
+        Arguments:
+            self - self - This object
+        """
+
+        while self.stop_event.wait(self.job_queue.lease_duration / 3) == False:
+            try:
+                self.job_queue.heartbeat(self.worker_id)
+            except sqlite3.OperationalError as err_msg:
+                print("\t[E] Can't extend leases in the job queue, trying again: {}".format(err_msg))
+
+def get_lease_filename(video_filename):
+    """ Get a filename for one lease to download a video to, which no other lease of the same video uses
+
+    Arguments:
+        video_filename - filename - The video's final output filename
+
+    Returns:
+        lease_filename - filename - The name to download to, with the same extension so ffmpeg can tell the format
+    """
+
+    root, extension = os.path.splitext(video_filename)
+    return "{0}.lease-{1}{2}".format(root, uuid.uuid4().hex[:12], extension)
+
+def remove_lease_files(lease_filename):
+    """ Remove whatever a failed lease left behind, since no later lease uses the same names to pick it up
+
+    Arguments:
+        lease_filename - filename - The name the lease downloaded to
+    """
+
+    for file_name in (lease_filename, journal.get_partial_filename(lease_filename), lease_filename + ".temp", lease_filename + ".temp.segments"):
+        if os.path.isfile(file_name) == True:
+            os.remove(file_name)
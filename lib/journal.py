@@ -0,0 +1,292 @@
+# lib/journal.py
+# Record how far each video of a run has got, so an interrupted run can be resumed
+
+import os
+import json
+import threading
+
+# Name of the journal file kept in the output directory
+JOURNAL_FILE_NAME = ".bulk-yt-mp3-journal.jsonl"
+
+# Stages a video passes through, in order
+STAGES = ("queued", "downloaded", "converted", "tagged")
+
+# Stages whose extra fields are needed to pick the video up again, and so are kept in memory until the video moves on
+RESUMABLE_STAGES = ("downloaded", "converted")
+
+class JournalError(Exception):
+    """ The journal can't be started or resumed """
+
+class Journal(object):
+    """ An append-only journal of the stage each video of a run has reached
+
+    Each line is a JSON record of a video reaching a stage, keyed by the video's output filename. The first line records the run's inputs. Records are only ever appended, and flushed as they are written, so a crash loses at most the record being written, and a torn last line is skipped when the journal is read back. Only unfinished videos are kept in memory, each with its last stage and, once downloaded or converted, the extra fields needed to pick it up again, and a video is forgotten once it is tagged, so memory follows the videos in flight rather than the size of the run. The queued videos themselves, with their tag data, are streamed back from the file when a run is resumed. A new journal is never started over the journal of an interrupted run, so its progress can't be lost by leaving out --resume.
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Start a new journal for a run
+        resume() - Reopen the journal of an interrupted run
+        read_records() - Read every intact record
+        write() - Append a record
+        record() - Record a video reaching a stage
+        remember() - Keep a video's new stage in memory
+        get_stage() - Get the last stage an unfinished video reached
+        get_record() - Get the last record of a video
+        get_video_filename() - Get the output filename an interrupted run queued a video to
+        iter_unfinished() - Get the queued videos that haven't been tagged
+        close() - Close the journal
+    """
+
+    def __init__(self, journal_file):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            journal_file - filename - Path of the journal
+        """
+
+        self.journal_file = journal_file
+        self.open_journal_file = None
+        self.lock = threading.Lock()
+
+        # Last stage of each unfinished video, keyed by output filename
+        self.stages = {}
+
+        # Extra fields of the videos whose last stage is in RESUMABLE_STAGES, keyed by output filename
+        self.stage_fields = {}
+
+        # Output filename of each unfinished video the interrupted run queued, keyed by video ID and directory, and the other way round
+        self.video_filenames = {}
+        self.video_keys = {}
+
+    def start(self, run_inputs):
+        """ Start a new journal for a run
+
+        Arguments:
+            self - self - This object
+            run_inputs - dict - The run's video URLs and playlist URL, for resuming it without them
+
+        Raises:
+            JournalError - An interrupted run's journal is in the way
+        """
+
+        self.stages = {}
+        self.stage_fields = {}
+        self.video_filenames = {}
+        self.video_keys = {}
+
+        # Only create the journal if there isn't one, so an interrupted run's progress is never overwritten
+        try:
+            self.open_journal_file = open(self.journal_file, "x")
+        except FileExistsError:
+            raise JournalError("{} holds the journal of an interrupted run. Finish it with --resume, or remove the journal to start over".format(os.path.dirname(os.path.abspath(self.journal_file))))
+
+        self.write({"run": run_inputs})
+
+    def resume(self):
+        """ Reopen the journal of an interrupted run, reading back the stage each video reached
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            run_inputs - dict or None - The interrupted run's inputs, or None if there is no journal to resume
+        """
+
+        if os.path.isfile(self.journal_file) == False:
+            return None
+
+        run_inputs = None
+        for journal_record in self.read_records():
+            if "run" in journal_record:
+                run_inputs = journal_record["run"]
+                continue
+
+            video_filename = journal_record["file"]
+            if journal_record["stage"] == "queued":
+                self.video_keys[video_filename] = (journal_record["video_id"], os.path.dirname(video_filename))
+            self.remember(journal_record)
+
+        self.video_filenames = {video_key: video_filename for video_filename, video_key in self.video_keys.items()}
+
+        self.open_journal_file = open(self.journal_file, "a")
+
+        # Start on a fresh line, in case the last one was torn
+        self.open_journal_file.write("\n")
+        self.open_journal_file.flush()
+
+        return run_inputs
+
+    def read_records(self):
+        """ Read every intact record in the journal, one at a time
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            journal_records - generator of dicts - Each record, in the order they were written
+        """
+
+        with open(self.journal_file) as open_journal_file:
+            for line in open_journal_file:
+                if line.strip() == "":
+                    continue
+
+                # Skip a line torn by a crash
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def write(self, journal_record):
+        """ Append a record to the journal and flush it to the operating system
+
+        Arguments:
+            self - self - This object
+            journal_record - dict - The record
+        """
+
+        self.open_journal_file.write(json.dumps(journal_record) + "\n")
+        self.open_journal_file.flush()
+
+    def record(self, video_filename, stage, **fields):
+        """ Record a video reaching a stage
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - Output filename of the video
+            stage - string - The stage reached, one of STAGES
+            fields - any - Extra fields to record, such as the video's URL when it is queued
+        """
+
+        journal_record = {"file": video_filename, "stage": stage}
+        journal_record.update(fields)
+
+        with self.lock:
+            self.write(journal_record)
+            self.remember(journal_record)
+
+    def remember(self, journal_record):
+        """ Keep a video's new stage in memory, with its extra fields only if they are needed to resume it, forgetting the video once it is tagged
+
+        Arguments:
+            self - self - This object
+            journal_record - dict - The record of the video reaching the stage
+        """
+
+        video_filename = journal_record["file"]
+
+        # A tagged video is finished, and nothing more is needed to resume it
+        if journal_record["stage"] == "tagged":
+            self.stages.pop(video_filename, None)
+            self.stage_fields.pop(video_filename, None)
+            video_key = self.video_keys.pop(video_filename, None)
+            if video_key != None and self.video_filenames.get(video_key) == video_filename:
+                del self.video_filenames[video_key]
+            return
+
+        self.stages[video_filename] = journal_record["stage"]
+
+        if journal_record["stage"] in RESUMABLE_STAGES:
+            self.stage_fields[video_filename] = {name: value for name, value in journal_record.items() if name not in ("file", "stage")}
+        else:
+            self.stage_fields.pop(video_filename, None)
+
+    def get_stage(self, video_filename):
+        """ Get the last stage an unfinished video reached
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - Output filename of the video
+
+        Returns:
+            stage - string or None - The stage, or None if the video isn't in the journal or has been tagged
+        """
+
+        return self.stages.get(video_filename)
+
+    def get_record(self, video_filename):
+        """ Get the last record of a video, holding any fields recorded with its stage if it is downloaded or converted
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - Output filename of the video
+
+        Returns:
+            journal_record - dict or None - The record, or None if the video isn't in the journal or has been tagged
+        """
+
+        stage = self.stages.get(video_filename)
+        if stage == None:
+            return None
+
+        journal_record = {"file": video_filename, "stage": stage}
+        journal_record.update(self.stage_fields.get(video_filename, {}))
+        return journal_record
+
+    def get_video_filename(self, video_id, directory):
+        """ Get the output filename the interrupted run queued an unfinished video to, so it can be skipped without looking it up again. Finished videos are found by the library index instead
+
+        Arguments:
+            self - self - This object
+            video_id - string - YouTube ID of the video
+            directory - string - Directory the video is being downloaded to
+
+        Returns:
+            video_filename - filename or None - The output filename, or None if the interrupted run didn't queue the video to that directory or finished it
+        """
+
+        return self.video_filenames.get((video_id, os.path.abspath(directory)))
+
+    def iter_unfinished(self):
+        """ Get the videos that were queued but haven't been tagged, streamed from the journal
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            unfinished_videos - generator of tuples - A video URL/ID/title/filename/metadata tuple for each unfinished video
+        """
+
+        for journal_record in self.read_records():
+            if journal_record.get("stage") == "queued" and self.get_stage(journal_record["file"]) != None:
+                yield journal_record["url"], journal_record["video_id"], journal_record["title"], journal_record["file"], journal_record["metadata"]
+
+    def close(self):
+        """ Close the journal
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.open_journal_file != None:
+            self.open_journal_file.close()
+            self.open_journal_file = None
+
+def get_partial_filename(video_filename):
+    """ Get the name a video's output is written to before it is complete, which keeps its extension so ffmpeg can tell the format
+
+    Arguments:
+        video_filename - filename - The video's final output filename
+
+    Returns:
+        partial_filename - filename - The name to write the output to
+    """
+
+    root, extension = os.path.splitext(video_filename)
+    return "{0}.partial{1}".format(root, extension)
+
+def get_final_filename(partial_filename):
+    """ Get the final output filename of a partial output
+
+    Arguments:
+        partial_filename - filename - The name the output was written to
+
+    Returns:
+        video_filename - filename - The video's final output filename
+    """
+
+    root, extension = os.path.splitext(partial_filename)
+    if root.endswith(".partial") == True:
+        root = root[:-len(".partial")]
+    return root + extension
@@ -0,0 +1,264 @@
+# lib/library.py
+# Keep track of which videos have already been downloaded
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+# Name of the index file kept in the output directory
+INDEX_FILE_NAME = ".bulk-yt-mp3-library.json"
+
+# Extensions of the audio files the program writes, which a scan picks up even if they aren't indexed yet
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".opus")
+
+# Files found on disk whose video isn't known yet are indexed under their path with this prefix, until a video is matched to them
+UNTRACKED_PREFIX = "file:"
+
+class LibraryIndex(object):
+    """ An index of downloaded videos, mapping each video ID to its output file, size, content hash and tag state
+
+    The index is stored as JSON in the output directory. Scanning it only re-hashes files whose size or modification time changed since the last scan, so keeping it up to date is cheap even for large libraries. Audio files already in the directory that aren't in the index, such as those downloaded before it existed, are added by the scan under their path with the title taken from the filename, and are matched to their videos by title the first time those videos are queued.
+
+    Methods:
+        __init__() - Initialize the object
+        scan() - Bring the index up to date with the files on disk
+        find_untracked_files() - Find audio files that aren't in the index
+        lookup() - Find the output file of a video
+        has_untracked_files() - Check whether any indexed files haven't been matched to a video
+        adopt() - Match a video to an indexed file found on disk
+        record() - Add a downloaded video to the index
+        save() - Write the index to disk
+    """
+
+    def __init__(self, library_directory):
+        """ Initialize the object, loading the existing index if there is one
+
+        Arguments:
+            self - self - This object
+            library_directory - string - The output directory the index covers
+        """
+
+        self.library_directory = os.path.abspath(library_directory)
+        self.index_file = os.path.join(self.library_directory, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+
+        # Entries keyed by video ID
+        self.entries = {}
+        if os.path.isfile(self.index_file) == True:
+            with open(self.index_file) as open_index_file:
+                self.entries = json.load(open_index_file)
+
+        # Paths of the files indexed without a video
+        self.untracked_paths = set(entry["path"] for key, entry in self.entries.items() if key.startswith(UNTRACKED_PREFIX) == True)
+
+    def scan(self):
+        """ Bring the index up to date with the files on disk, dropping deleted files, re-hashing changed ones and adding audio files that aren't indexed yet
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            changed - int - Number of entries that were dropped, re-hashed or added
+        """
+
+        changed = 0
+
+        # Index the audio files found on disk that no entry covers, under their path until their video is known
+        for relative_path in self.find_untracked_files():
+            file_name = os.path.join(self.library_directory, relative_path)
+            file_stat = os.stat(file_name)
+            with self.lock:
+                self.entries[UNTRACKED_PREFIX + relative_path] = {
+                    "path": relative_path,
+                    "size": file_stat.st_size,
+                    "mtime": file_stat.st_mtime,
+                    "sha1": hash_file(file_name),
+                    "tagged": None,
+                    "title": os.path.splitext(os.path.basename(relative_path))[0]
+                }
+                self.untracked_paths.add(relative_path)
+            changed += 1
+
+        with self.lock:
+            for video_id in list(self.entries):
+                entry = self.entries[video_id]
+
+                try:
+                    file_stat = os.stat(os.path.join(self.library_directory, entry["path"]))
+
+                # The file was deleted, so forget it and let it be downloaded again
+                except FileNotFoundError:
+                    del self.entries[video_id]
+                    self.untracked_paths.discard(entry["path"])
+                    changed += 1
+                    continue
+
+                # Only re-hash files that look different from last time
+                if file_stat.st_size != entry["size"] or file_stat.st_mtime != entry["mtime"]:
+                    entry["size"] = file_stat.st_size
+                    entry["mtime"] = file_stat.st_mtime
+                    entry["sha1"] = hash_file(os.path.join(self.library_directory, entry["path"]))
+                    changed += 1
+
+        return changed
+
+    def find_untracked_files(self):
+        """ Find the audio files in the directory and its subdirectories that no index entry covers, leaving out partial outputs
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            relative_paths - list of strings - Path of each file, relative to the directory
+        """
+
+        with self.lock:
+            indexed_paths = set(entry["path"] for entry in self.entries.values())
+
+        relative_paths = []
+        for directory, subdirectories, file_names in os.walk(self.library_directory):
+            for file_name in file_names:
+                root, extension = os.path.splitext(file_name)
+                if extension not in AUDIO_EXTENSIONS or file_name.startswith(".") == True or root.endswith(".partial") == True:
+                    continue
+
+                relative_path = os.path.relpath(os.path.join(directory, file_name), self.library_directory)
+                if relative_path not in indexed_paths:
+                    relative_paths.append(relative_path)
+
+        return relative_paths
+
+    def lookup(self, video_id):
+        """ Find the output file of a video
+
+        Arguments:
+            self - self - This object
+            video_id - string - YouTube ID of the video
+
+        Returns:
+            output_file - filename or None - Absolute path of the video's output file, or None if it hasn't been downloaded
+        """
+
+        with self.lock:
+            entry = self.entries.get(video_id)
+
+        if entry == None:
+            return None
+
+        return os.path.join(self.library_directory, entry["path"])
+
+    def has_untracked_files(self):
+        """ Check whether any files the scan found on disk are still waiting to be matched to a video
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            untracked - bool - Whether there are any such files
+        """
+
+        with self.lock:
+            return len(self.untracked_paths) > 0
+
+    def adopt(self, video_id, output_file):
+        """ Match a video to a file the scan found on disk without knowing its video, so the video is known to be downloaded without looking it up next time
+
+        Arguments:
+            self - self - This object
+            video_id - string - YouTube ID of the video
+            output_file - filename - The file the video would be downloaded to
+
+        Returns:
+            adopted - bool - Whether an untracked file was indexed at that path and is now indexed under the video
+        """
+
+        relative_path = os.path.relpath(os.path.abspath(output_file), self.library_directory)
+
+        with self.lock:
+            entry = self.entries.pop(UNTRACKED_PREFIX + relative_path, None)
+            if entry == None:
+                return False
+            self.untracked_paths.discard(relative_path)
+
+            self.entries[video_id] = entry
+
+        return True
+
+    def record(self, video_id, output_file, tagged):
+        """ Add a downloaded video to the index
+
+        Arguments:
+            self - self - This object
+            video_id - string - YouTube ID of the video
+            output_file - filename - The video's output file
+            tagged - bool - Whether tags were written to the file
+        """
+
+        file_stat = os.stat(output_file)
+        entry = {
+            "path": os.path.relpath(os.path.abspath(output_file), self.library_directory),
+            "size": file_stat.st_size,
+            "mtime": file_stat.st_mtime,
+            "sha1": hash_file(output_file),
+            "tagged": tagged
+        }
+
+        with self.lock:
+            self.entries.pop(UNTRACKED_PREFIX + entry["path"], None)
+            self.untracked_paths.discard(entry["path"])
+            self.entries[video_id] = entry
+
+    def save(self):
+        """ Write the index to disk, replacing the old one atomically
+
+        Arguments:
+            self - self - This object
+        """
+
+        temp_index_file = self.index_file + ".temp"
+
+        with self.lock:
+            with open(temp_index_file, "w") as open_index_file:
+                json.dump(self.entries, open_index_file)
+
+        os.replace(temp_index_file, self.index_file)
+
+def hash_file(file_name):
+    """ Get the SHA-1 hash of a file's contents
+
+    Arguments:
+        file_name - filename - The file to hash
+
+    Returns:
+        file_hash - string - Hex digest of the file's contents
+    """
+
+    file_hash = hashlib.sha1()
+    with open(file_name, "rb") as open_file:
+        for chunk in iter(lambda: open_file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def place_file(source_file, target_file):
+    """ Put a copy of an already downloaded file somewhere else, hard linking it if possible
+
+    Arguments:
+        source_file - filename - The existing file
+        target_file - filename - Where the copy should go
+
+    Returns:
+        linked - bool - True if the file was hard linked, False if it had to be copied
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(target_file)), exist_ok=True)
+
+    # Hard links can't cross filesystems and aren't supported everywhere, so fall back to copying
+    try:
+        os.link(source_file, target_file)
+        return True
+    except OSError:
+        shutil.copy2(source_file, target_file)
+        return False
@@ -0,0 +1,237 @@
+# lib/loudness.py
+# Measure the loudness of a track as ffmpeg decodes it, for ReplayGain tags
+
+import numpy
+
+# ffmpeg decodes to this for measuring, since the K-weighting filter below is defined at 48 kHz
+SAMPLE_RATE = 48000
+CHANNEL_COUNT = 2
+
+# ReplayGain 2.0 brings every track to this loudness, in LUFS
+REFERENCE_LOUDNESS = -18.0
+
+# Coefficients of the two stages of the ITU-R BS.1770 K-weighting filter at 48 kHz, a high shelf followed by a high pass
+SHELF_FILTER = ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585])
+HIGH_PASS_FILTER = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+
+# Number of taps the filter's impulse response is cut to, by which point it has decayed far below the precision of the samples
+FILTER_LENGTH = 8192
+
+# Gating blocks are 400 ms long and start every 100 ms
+SUB_BLOCK_FRAMES = SAMPLE_RATE // 10
+SUB_BLOCKS_PER_BLOCK = 4
+
+# Samples are filtered a second at a time
+CHUNK_SUB_BLOCKS = 10
+
+# Block loudness is kept as a histogram from the absolute gate upwards, so memory doesn't grow with the length of the track
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+HISTOGRAM_STEP = 0.01
+HISTOGRAM_TOP = 10.0
+
+def build_pcm_arguments(input_number):
+    """ Build the ffmpeg arguments that add a second output, decoding an input's audio to raw samples on standard output for measuring
+
+    Arguments:
+        input_number - int - Number of the input whose audio is measured
+
+    Returns:
+        arguments - list of strings - The arguments, to go after the file's own output
+    """
+
+    return ["-map", "{}:a".format(input_number), "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(CHANNEL_COUNT), "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+def get_impulse_response():
+    """ Get the impulse response of the K-weighting filter, cut to FILTER_LENGTH taps
+
+    Returns:
+        impulse_response - ndarray - The response to a unit impulse
+    """
+
+    impulse_response = numpy.zeros(FILTER_LENGTH)
+    impulse_response[0] = 1.0
+
+    # Run the impulse through each biquad in turn. This is the only per-sample loop, and runs once
+    for b, a in (SHELF_FILTER, HIGH_PASS_FILTER):
+        filtered = numpy.zeros(FILTER_LENGTH)
+        for n in range(FILTER_LENGTH):
+            filtered[n] = b[0] * impulse_response[n]
+            if n >= 1:
+                filtered[n] += b[1] * impulse_response[n - 1] - a[1] * filtered[n - 1]
+            if n >= 2:
+                filtered[n] += b[2] * impulse_response[n - 2] - a[2] * filtered[n - 2]
+        impulse_response = filtered
+
+    return impulse_response
+
+class LoudnessMeter(object):
+    """ Measure the integrated loudness (EBU R128 / ITU-R BS.1770) and sample peak of a track from raw samples fed to it in chunks of any size
+
+    Samples are K-weighted a second at a time by FFT convolution with the filter's impulse response, carrying the tail of each second into the next. The mean square of each 100 ms sub-block is taken in one vectorized step, and each 400 ms gating block is the mean of four sub-blocks. Block energies are added to a fixed histogram rather than kept, so memory stays constant however long the track is, and the gates are applied to the histogram at the end, to within HISTOGRAM_STEP LU.
+
+    Methods:
+        __init__() - Initialize the object
+        add() - Measure a chunk of raw samples
+        read_from() - Measure raw samples read from a file object until it ends
+        process_chunk() - Filter a second of samples and add its blocks to the histogram
+        get_loudness() - Get the integrated loudness
+        get_replaygain() - Get the ReplayGain track gain and peak
+    """
+
+    # The filter's frequency response is the same for every meter, so it is only worked out once
+    filter_spectrum = None
+
+    def __init__(self):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+        """
+
+        chunk_frames = SUB_BLOCK_FRAMES * CHUNK_SUB_BLOCKS
+        self.fft_size = 1 << (chunk_frames + FILTER_LENGTH - 1 - 1).bit_length()
+        if LoudnessMeter.filter_spectrum == None or LoudnessMeter.filter_spectrum[0] != self.fft_size:
+            LoudnessMeter.filter_spectrum = (self.fft_size, numpy.fft.rfft(get_impulse_response(), self.fft_size))
+
+        # Samples waiting for a whole second to build up, and bytes of a sample cut off at the end of the last chunk
+        self.pending = numpy.empty((chunk_frames, CHANNEL_COUNT), dtype=numpy.float64)
+        self.pending_frames = 0
+        self.leftover = b""
+
+        # Filter output that spills over into the next second
+        self.tail = numpy.zeros((FILTER_LENGTH - 1, CHANNEL_COUNT))
+
+        # Energies of the last sub-blocks, which start the next second's gating blocks
+        self.recent_energies = numpy.zeros(0)
+
+        # Number and total energy of the gating blocks in each loudness bin
+        bin_count = int(round((HISTOGRAM_TOP - ABSOLUTE_GATE) / HISTOGRAM_STEP)) + 1
+        self.block_counts = numpy.zeros(bin_count)
+        self.block_energies = numpy.zeros(bin_count)
+
+        self.peak = 0.0
+
+    def add(self, pcm_data):
+        """ Measure a chunk of raw samples
+
+        Arguments:
+            self - self - This object
+            pcm_data - bytes - Interleaved 32-bit float samples, which may end partway through a sample
+        """
+
+        pcm_data = self.leftover + pcm_data
+        frame_bytes = 4 * CHANNEL_COUNT
+        whole_length = len(pcm_data) - len(pcm_data) % frame_bytes
+        self.leftover = pcm_data[whole_length:]
+
+        samples = numpy.frombuffer(pcm_data, dtype="<f4", count=whole_length // 4).reshape(-1, CHANNEL_COUNT)
+        if len(samples) == 0:
+            return
+
+        self.peak = max(self.peak, float(numpy.max(numpy.abs(samples))))
+
+        # Fill the pending second, processing it each time it is full
+        position = 0
+        while position < len(samples):
+            frame_count = min(len(samples) - position, len(self.pending) - self.pending_frames)
+            self.pending[self.pending_frames:self.pending_frames + frame_count] = samples[position:position + frame_count]
+            self.pending_frames += frame_count
+            position += frame_count
+
+            if self.pending_frames == len(self.pending):
+                self.process_chunk(self.pending)
+                self.pending_frames = 0
+
+    def read_from(self, pcm_file, chunk_size=256 * 1024):
+        """ Measure raw samples read from a file object, such as ffmpeg's standard output, until it ends
+
+        Arguments:
+            self - self - This object
+            pcm_file - file object - Binary file to read from
+            chunk_size - int - Number of bytes to read at a time
+        """
+
+        while True:
+            pcm_data = pcm_file.read(chunk_size)
+            if len(pcm_data) == 0:
+                break
+            self.add(pcm_data)
+
+    def process_chunk(self, samples):
+        """ K-weight a run of samples and add the gating blocks they complete to the histogram
+
+        Arguments:
+            self - self - This object
+            samples - ndarray - Frames of samples, a whole number of sub-blocks long
+        """
+
+        # Filter both channels at once, adding the previous tail and keeping the new one
+        frame_count = len(samples)
+        filtered = numpy.fft.irfft(numpy.fft.rfft(samples, self.fft_size, axis=0) * LoudnessMeter.filter_spectrum[1][:, None], self.fft_size, axis=0)
+        filtered[:FILTER_LENGTH - 1] += self.tail
+        self.tail = filtered[frame_count:frame_count + FILTER_LENGTH - 1].copy()
+        filtered = filtered[:frame_count]
+
+        # Mean square of each sub-block, summed over the channels, which are both weighted 1.0
+        sub_block_energies = numpy.mean(filtered.reshape(-1, SUB_BLOCK_FRAMES, CHANNEL_COUNT) ** 2, axis=1).sum(axis=1)
+
+        # Each gating block is the mean of four consecutive sub-blocks, carrying the last three over
+        energies = numpy.concatenate((self.recent_energies, sub_block_energies))
+        self.recent_energies = energies[-(SUB_BLOCKS_PER_BLOCK - 1):]
+        if len(energies) < SUB_BLOCKS_PER_BLOCK:
+            return
+        block_energies = numpy.lib.stride_tricks.sliding_window_view(energies, SUB_BLOCKS_PER_BLOCK).mean(axis=1)
+
+        # Add the blocks above the absolute gate to the histogram
+        with numpy.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10 * numpy.log10(block_energies)
+        above_gate = block_loudness >= ABSOLUTE_GATE
+        bins = numpy.minimum(((block_loudness[above_gate] - ABSOLUTE_GATE) / HISTOGRAM_STEP).astype(numpy.int64), len(self.block_counts) - 1)
+        self.block_counts += numpy.bincount(bins, minlength=len(self.block_counts))
+        self.block_energies += numpy.bincount(bins, weights=block_energies[above_gate], minlength=len(self.block_energies))
+
+    def get_loudness(self):
+        """ Get the integrated loudness of everything measured so far, dropping a final sub-block that isn't whole
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            loudness - float or None - Integrated loudness in LUFS, or None if the track is silent or shorter than one gating block
+        """
+
+        # Process the whole sub-blocks of a last, partial second
+        whole_frames = self.pending_frames - self.pending_frames % SUB_BLOCK_FRAMES
+        if whole_frames > 0:
+            self.process_chunk(self.pending[:whole_frames])
+            self.pending_frames = 0
+
+        if self.block_counts.sum() == 0:
+            return None
+
+        # The relative gate sits 10 LU below the loudness of every block over the absolute gate
+        absolute_loudness = -0.691 + 10 * numpy.log10(self.block_energies.sum() / self.block_counts.sum())
+        gate_bin = max(0, int((absolute_loudness + RELATIVE_GATE - ABSOLUTE_GATE) / HISTOGRAM_STEP))
+
+        block_count = self.block_counts[gate_bin:].sum()
+        if block_count == 0:
+            return None
+
+        return float(-0.691 + 10 * numpy.log10(self.block_energies[gate_bin:].sum() / block_count))
+
+    def get_replaygain(self):
+        """ Get the ReplayGain 2.0 track gain and peak, as they are written to tags
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            replaygain - dict or None - Track gain in dB and sample peak, or None if the track has no measurable loudness
+        """
+
+        loudness = self.get_loudness()
+        if loudness == None:
+            return None
+
+        return {"track_gain": REFERENCE_LOUDNESS - loudness, "track_peak": self.peak}
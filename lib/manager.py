@@ -4,34 +4,355 @@
 import os
 import subprocess
 import csv
+import threading
 from pytube import YouTube
 from pytube import Playlist
-from pytube.cli import on_progress
+from pytube import request
+from pytube import extract
+from pytube.exceptions import AgeRestrictedError
+from pytube.exceptions import LiveStreamError
+from pytube.exceptions import VideoPrivate
 from pytube.exceptions import VideoRegionBlocked
+from pytube.exceptions import VideoUnavailable
+from lib import errors
+from lib import journal
+from lib import metrics
+from lib import progress
+from lib import scheduler
+
+# Output formats, with the stream codecs each can hold as they are, whether it can hold a cover image, and the ffmpeg arguments used to encode to it otherwise
+OUTPUT_FORMATS = {
+    "mp3": {"codecs": (), "cover": True, "encoder_arguments": []},
+    "m4a": {"codecs": ("mp4a",), "cover": True, "encoder_arguments": ["-c:a", "aac", "-b:a", "192k"]},
+    "opus": {"codecs": ("opus",), "cover": False, "encoder_arguments": ["-c:a", "libopus", "-b:a", "128k"]}
+}
+
+# Ways of picking the audio stream to download
+STREAM_POLICIES = ("codec", "best", "smallest")
+
+# Lowest bitrate, in bits per second, the smallest policy considers adequate
+ADEQUATE_BITRATE = 96000
+
+class ResolvedVideo(object):
+    """ A video whose metadata has been fetched, carried from queue building through to download so that each video is only looked up once
+
+    Attributes:
+        url - string - URL of the video
+        video_id - string - YouTube ID of the video
+        title - string - Title of the video
+        duration - int - Length of the video in seconds
+        youtube - YouTube object or None - The pytube object holding the fetched watch page and stream manifest, until the video has been downloaded
+    """
+
+    def __init__(self, url, video_id, title, duration, youtube):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            url - string - URL of the video
+            video_id - string - YouTube ID of the video
+            title - string - Title of the video
+            duration - int - Length of the video in seconds
+            youtube - YouTube object - The pytube object for the video
+        """
+
+        self.url = url
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.youtube = youtube
 
 class DownloadManager(object):
     """ Handle all tasks related to downloading and building the video queue
 
     Methods:
         __init__() - Initialize the object
+        resolve_video() - Fetch the metadata of a video once
+        fetch_video() - Fetch the metadata of a video from YouTube
+        iter_resolved_videos() - Fetch the metadata of several videos concurrently, as a generator
+        resolve_videos() - Fetch the metadata of several videos concurrently
+        forget_resolved_videos() - Drop the metadata of every video resolved so far
+        get_known_duration() - Get the length of a video if it has already been resolved
+        get_known_title() - Get the title of a video if it has been resolved or cached
+        drop_stream_manifest() - Free the watch page and stream manifest of a resolved video
+        get_video_id() - Get the ID of a video from its URL
         get_video_title() - Get the title of a video
         get_playlist_title() - Get the title of a playlist
         parse_tag_data_file() - Parse a CSV file of MP3 metadata
+        iter_playlist_urls() - Get the video URLs of a playlist
+        iter_playlist() - Resolve the videos of a playlist as a generator
         parse_playlist() - Parse a playlist to download from
+        get_audio_stream() - Pick the audio stream to download for a video
+        select_audio_stream() - Pick an audio stream by the stream policy
+        can_copy() - Check whether a codec can go into the output format as it is
         download() - Download a YouTube video as audioless MP4
         convert() - Convert a downloaded video to MP3 format
+        convert_batch() - Convert several downloaded videos with one ffmpeg invocation
+        tags_while_encoding() - Check whether the encoder writes tags itself
+        build_cover_inputs() - Build the ffmpeg arguments for a cover image
+        build_tag_arguments() - Build the ffmpeg arguments for a track's tags
+        build_codec_arguments() - Build the ffmpeg arguments that copy or encode a track's audio
+        convert_in_process() - Convert a downloaded video with PyAV
+        stream_and_convert() - Download a video straight into ffmpeg
+        build_pcm_arguments() - Build the ffmpeg arguments that decode a track for measuring its loudness
+        get_loudness_key() - Get the key a stream's loudness is cached under
+        get_known_replaygain() - Get the ReplayGain values of a stream measured in an earlier run
+        remember_replaygain() - Cache the ReplayGain values of a stream
+        start_measuring() - Start measuring the loudness of a track as ffmpeg decodes it
+        finish_measuring() - Wait for a loudness measurement and keep its ReplayGain values
     """
 
-    def __init__(self, verbosity):
+    def __init__(self, verbosity, metadata_cache=None, segmented_downloader=None, encoder="ffmpeg", artwork_cache=None, recorder=None, progress_aggregator=None, output_format="mp3", stream_policy="codec", replaygain=False, transport=None):
         """ Initialize the object
 
         Arguments:
             self - self - This object
             verbosity - bool - Enable verbose output
-            data_validator - Validator object - Data validation tool
+            metadata_cache - MetadataCache object or None - Persistent cache of video and playlist metadata
+            segmented_downloader - SegmentedDownloader object or None - Downloads audio streams over several connections, if set
+            encoder - string - "ffmpeg" to convert with the ffmpeg utility, or "pyav" to convert in process with PyAV
+            artwork_cache - ArtworkCache object or None - Shared cache of processed cover images
+            recorder - Recorder object or None - Records timing spans and counters, if set
+            progress_aggregator - ProgressAggregator object or None - Collects the progress of every download, if set
+            output_format - string - Format to save tracks in, one of OUTPUT_FORMATS
+            stream_policy - string - How to pick the audio stream to download, one of STREAM_POLICIES
+            replaygain - bool - Measure each track's loudness while converting it, for ReplayGain tags, which needs NumPy
+            transport - Transport object or None - The shared transport pytube's requests go through, whose bandwidth and connection limits the asyncio engine keeps to as well
         """
 
+        if recorder == None:
+            recorder = metrics.Recorder(enabled=False)
+        if progress_aggregator == None:
+            progress_aggregator = progress.ProgressAggregator(enabled=False)
+
         self.verbosity = verbosity
+        self.metadata_cache = metadata_cache
+        self.segmented_downloader = segmented_downloader
+        self.encoder = encoder
+        self.artwork_cache = artwork_cache
+        self.recorder = recorder
+        self.progress_aggregator = progress_aggregator
+        self.output_format = output_format
+        self.stream_policy = stream_policy
+        self.replaygain = replaygain
+        self.transport = transport
+
+        # Codec of each downloaded file, keyed by filename, until the file is removed
+        self.stream_codecs = {}
+
+        # ReplayGain values of each measured file, keyed by filename, until they are written to its tags
+        self.loudness_results = {}
+
+        # Key that the loudness of each downloaded file's stream is cached under, keyed by filename, until the file is removed
+        self.loudness_keys = {}
+
+        # Videos resolved so far, keyed by URL
+        self.resolved_videos = {}
+        self.resolved_videos_lock = threading.Lock()
+
+    def resolve_video(self, video_url, youtube=None):
+        """ Fetch the title, ID, length and stream manifest of a video, reusing the result of any earlier lookup of the same URL
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+            youtube - YouTube object or None - An existing pytube object for the video, if one has already been made
+
+        Returns:
+            resolved_video - ResolvedVideo object - The resolved video
+        """
+
+        # Reuse the earlier lookup, if there was one
+        with self.resolved_videos_lock:
+            if video_url in self.resolved_videos:
+                return self.resolved_videos[video_url]
+
+        # Reuse a lookup from an earlier run, if it is in the cache. The stream manifest isn't cached since its URLs expire, so it is fetched when the video is downloaded
+        if self.metadata_cache != None and youtube == None:
+            video_id = extract.video_id(video_url)
+            cached_video = self.metadata_cache.get("video", video_id)
+            if cached_video != None:
+                resolved_video = ResolvedVideo(video_url, video_id, cached_video["title"], cached_video["duration"], None)
+                with self.resolved_videos_lock:
+                    self.resolved_videos[video_url] = resolved_video
+                return resolved_video
+
+        # Look the video up, timing only lookups that go to YouTube
+        with self.recorder.span("resolve_video", video_url=video_url):
+            resolved_video = self.fetch_video(video_url, youtube)
+
+        # Verbose output
+        if self.verbosity == True:
+            print("[DEBUGGING] Title of {0} is {1}".format(video_url, resolved_video.title))
+
+        with self.resolved_videos_lock:
+            self.resolved_videos[video_url] = resolved_video
+
+        # Store the lookup for later runs
+        if self.metadata_cache != None:
+            self.metadata_cache.put("video", resolved_video.video_id, {"title": resolved_video.title, "duration": resolved_video.duration})
+
+        return resolved_video
+
+    def fetch_video(self, video_url, youtube=None):
+        """ Fetch the title, ID, length and stream manifest of a video from YouTube
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+            youtube - YouTube object or None - An existing pytube object for the video, if one has already been made
+
+        Returns:
+            resolved_video - ResolvedVideo object - The resolved video
+        """
+
+        if youtube == None:
+            youtube = YouTube(video_url, on_progress_callback=self.progress_aggregator.on_progress)
+
+        # Check that the video can be downloaded, taking into account and handling any YouTube related reasons that the video might be unavailable
+        try:
+            youtube.check_availability()
+
+        # If video is age restricted
+        except AgeRestrictedError as err_msg:
+            raise errors.VideoUnavailableError("Video is age restricted and cannot be accessed")
+
+        # If video is region blocked
+        except VideoRegionBlocked as err_msg:
+            raise errors.VideoUnavailableError("Video is blocked in your region")
+
+        # If video is a livestream
+        except LiveStreamError as err_msg:
+            raise errors.VideoUnavailableError("Cannot download video because it is a livestream")
+
+        # If video is private
+        except VideoPrivate as err_msg:
+            raise errors.VideoUnavailableError("This video is private")
+
+        # If video is unavailable for any other reason
+        except VideoUnavailable as err_msg:
+            raise errors.VideoUnavailableError(err_msg)
+
+        resolved_video = ResolvedVideo(video_url, youtube.video_id, youtube.title, youtube.length, youtube)
+
+        return resolved_video
+
+    def iter_resolved_videos(self, video_urls, worker_count):
+        """ Resolve videos concurrently, yielding each one in order as soon as it is resolved
+
+        Arguments:
+            self - self - This object
+            video_urls - iterable of strings - The URLs of the videos, which may be a generator
+            worker_count - int - Number of videos to resolve at once
+
+        Returns:
+            resolved_videos - generator of tuples - A URL/ResolvedVideo/error tuple for each video, where the ResolvedVideo is None if the video could not be resolved
+        """
+
+        return scheduler.imap(self.resolve_video, video_urls, worker_count)
+
+    def resolve_videos(self, video_urls, worker_count):
+        """ Resolve several videos concurrently
+
+        Arguments:
+            self - self - This object
+            video_urls - list of strings - The URLs of the videos
+            worker_count - int - Number of videos to resolve at once
+
+        Returns:
+            resolved_videos - list - A ResolvedVideo object for each URL, in order, or None where it could not be resolved
+            errors - dict - Exceptions raised while resolving, keyed by position in video_urls
+        """
+
+        resolved_videos = []
+        errors = {}
+
+        c = 0
+        for video_url, resolved_video, err_msg in self.iter_resolved_videos(video_urls, worker_count):
+            resolved_videos.append(resolved_video)
+            if err_msg != None:
+                errors[c] = err_msg
+            c += 1
+
+        return resolved_videos, errors
+
+    def forget_resolved_videos(self):
+        """ Drop the metadata of every video resolved so far, so a long running process doesn't keep it forever
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.resolved_videos_lock:
+            self.resolved_videos.clear()
+
+    def get_known_duration(self, video_url):
+        """ Get the length of a video if it has already been resolved, without fetching anything
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+
+        Returns:
+            duration - int or None - Length of the video in seconds, or None if it hasn't been resolved or has no length
+        """
+
+        with self.resolved_videos_lock:
+            resolved_video = self.resolved_videos.get(video_url)
+
+        if resolved_video == None:
+            return None
+        return resolved_video.duration
+
+    def get_known_title(self, video_url):
+        """ Get the title of a video if it has already been resolved or is in the metadata cache, without fetching anything
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+
+        Returns:
+            video_title - string or None - Title of the video, or None if it isn't known yet
+        """
+
+        with self.resolved_videos_lock:
+            resolved_video = self.resolved_videos.get(video_url)
+        if resolved_video != None:
+            return resolved_video.title
+
+        if self.metadata_cache == None:
+            return None
+
+        cached_video = self.metadata_cache.get("video", extract.video_id(video_url))
+        if cached_video == None:
+            return None
+        return cached_video["title"]
+
+    def drop_stream_manifest(self, video_url):
+        """ Free the watch page and stream manifest of a resolved video, keeping its title and length, for videos that won't be downloaded for a while. The manifest is fetched again when the video is downloaded
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+        """
+
+        with self.resolved_videos_lock:
+            resolved_video = self.resolved_videos.get(video_url)
+            if resolved_video != None:
+                resolved_video.youtube = None
+
+    def get_video_id(self, video_url):
+        """ Get the ID of a video from its URL, without fetching anything
+
+        Arguments:
+            self - self - This object
+            video_url - string - The URL of the video
+
+        Returns:
+            video_id - string - The YouTube ID of the video
+        """
+
+        return extract.video_id(video_url)
 
     def get_video_title(self, video_url):
         """ Get the title of a video
@@ -44,12 +365,8 @@ class DownloadManager(object):
             video_title - string - The title of the video
         """
 
-        video = YouTube(video_url, on_progress_callback=on_progress)
-        video_title = video.title
-
-        # Verbose output
-        if self.verbosity == True:
-            print("[DEBUGGING] Title of {0} is {1}".format(video_url, video_title))
+        with self.recorder.span("get_video_title", video_url=video_url):
+            video_title = self.resolve_video(video_url).title
             
         return video_title
 
@@ -64,8 +381,19 @@ class DownloadManager(object):
             playlist_title - string - The title of the playlist
         """
 
-        playlist = Playlist(playlist_url)
-        playlist_title = playlist.title
+        # Use the cached title, if there is one
+        playlist_id = extract.playlist_id(playlist_url)
+        playlist_title = None
+        if self.metadata_cache != None:
+            playlist_title = self.metadata_cache.get("playlist_title", playlist_id)
+
+        if playlist_title == None:
+            with self.recorder.span("get_playlist_title", playlist_url=playlist_url):
+                playlist = Playlist(playlist_url)
+                playlist_title = playlist.title
+
+            if self.metadata_cache != None:
+                self.metadata_cache.put("playlist_title", playlist_id, playlist_title)
 
         # Verbose output
         if self.verbosity == True:
@@ -115,35 +443,153 @@ class DownloadManager(object):
             # Return the list of tag data dictionaries
             return parsed_tag_data
 
-    def parse_playlist(self, playlist_url):
+    def iter_playlist_urls(self, playlist_url):
+        """ Get the video URLs of a playlist, a page at a time
+
+        Arguments:
+            self - self - This object
+            playlist_url - string - URL of the YouTube playlist
+
+        Returns:
+            video_urls - generator of strings - The URL of each video in the playlist
+        """
+
+        # Use the cached list of video urls, if there is one
+        playlist_id = extract.playlist_id(playlist_url)
+        if self.metadata_cache != None:
+            cached_video_urls = self.metadata_cache.get("playlist", playlist_id)
+            if cached_video_urls != None:
+                yield from cached_video_urls
+                return
+
+        # Create a new playlist object and hand out its video urls as each page is fetched, timing the whole listing
+        span = self.recorder.span("iter_playlist_urls", playlist_url=playlist_url)
+        playlist = Playlist(playlist_url)
+        video_urls = []
+        for video_url in playlist.url_generator():
+            video_urls.append(video_url)
+            yield video_url
+        span.finish()
+
+        # Only cache the list once the whole playlist has been read
+        if self.metadata_cache != None:
+            self.metadata_cache.put("playlist", playlist_id, video_urls)
+
+    def iter_playlist(self, playlist_url, worker_count=4):
+        """ Resolve the videos of a playlist concurrently, yielding each one in playlist order as soon as it is known
+
+        Arguments:
+            self - self - This object
+            playlist_url - string - URL of the YouTube playlist
+            worker_count - int - Number of videos to resolve at once
+
+        Returns:
+            resolved_videos - generator of tuples - A URL/ResolvedVideo/error tuple for each video, where the ResolvedVideo is None if the video could not be resolved
+        """
+
+        return self.iter_resolved_videos(self.iter_playlist_urls(playlist_url), worker_count)
+
+    def parse_playlist(self, playlist_url, worker_count=4):
         """ Parse a playlist and retrieve from it a list of video URLs and titles
 
         Arguments:
             self - self - This object
             playlist_url - string - URL of the YouTube playlist
+            worker_count - int - Number of videos to resolve at once
 
         Returns:
             video_list - list of tuples - A list of video URL/title tuples
         """
 
-        # Initialize the video list
-        video_list = []
+        # Time the whole playlist, including the video lookups
+        with self.recorder.span("parse_playlist", playlist_url=playlist_url):
+            # Initialize the video list
+            video_list = []
 
-        # Create a new playlist object
-        playlist = Playlist(playlist_url)
+            # Resolve all the videos, adding their URL and title to the list
+            for video_url, resolved_video, err_msg in self.iter_playlist(playlist_url, worker_count):
+                # Skip videos that could not be resolved
+                if resolved_video == None:
+                    print("\t[E] Skipping {0}: {1}".format(video_url, err_msg))
+                else:
+                    current_video = (resolved_video.url, resolved_video.title)
+                    video_list.append(current_video)
 
-        # Get the video urls
-        video_urls = playlist.video_urls
+            # Return the list of videos
+            return video_list
 
-        # Loop through all the videos, adding their URL and title to the list
-        c = 0
-        for video in playlist.videos:
-            current_video = (video_urls[c], video.title)
-            video_list.append(current_video)
+    def get_audio_stream(self, video_url):
+        """ Pick the audio stream to download for a video, reusing the stream manifest fetched while the queue was built
 
-        # Return the list of videos
-        return video_list
-        
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video
+
+        Returns:
+            stream - Stream object - The audio only stream to download
+        """
+
+        resolved_video = self.resolve_video(video_url)
+
+        # The manifest is released after each download, so fetch it again if the same video is downloaded twice
+        youtube = resolved_video.youtube
+        if youtube == None:
+            youtube = YouTube(video_url, on_progress_callback=self.progress_aggregator.on_progress)
+
+        stream = self.select_audio_stream(youtube.streams.filter(only_audio=True))
+
+        # The watch page and manifest are no longer needed, so let them be freed
+        resolved_video.youtube = None
+
+        return stream
+
+    def select_audio_stream(self, streams):
+        """ Pick an audio stream by the stream policy
+
+        The codec policy takes the best stream that can be saved in the output format without re-encoding, falling back to the best stream. The best policy takes the highest bitrate, and the smallest policy the lowest bitrate that is still adequate. Ties go to streams that can be copied.
+
+        Arguments:
+            self - self - This object
+            streams - iterable of Stream objects - The audio only streams of a video
+
+        Returns:
+            stream - Stream object - The stream to download
+        """
+
+        streams = list(streams)
+        if len(streams) == 0:
+            raise errors.VideoUnavailableError("Video has no audio streams")
+
+        # Rank by bitrate, then by whether the stream can be copied
+        rank = lambda stream: (stream.bitrate or 0, self.can_copy(stream.audio_codec))
+
+        if self.stream_policy == "smallest":
+            adequate_streams = [stream for stream in streams if (stream.bitrate or 0) >= ADEQUATE_BITRATE]
+            if len(adequate_streams) > 0:
+                return min(adequate_streams, key=lambda stream: (stream.bitrate or 0, self.can_copy(stream.audio_codec) == False))
+
+        elif self.stream_policy == "codec":
+            copyable_streams = [stream for stream in streams if self.can_copy(stream.audio_codec) == True]
+            if len(copyable_streams) > 0:
+                return max(copyable_streams, key=rank)
+
+        return max(streams, key=rank)
+
+    def can_copy(self, audio_codec):
+        """ Check whether a stream's codec can be saved in the output format without re-encoding
+
+        Arguments:
+            self - self - This object
+            audio_codec - string or None - Codec of the stream, such as "opus" or "mp4a.40.2"
+
+        Returns:
+            can_copy - bool - True if the audio can be copied as it is
+        """
+
+        if audio_codec == None:
+            return False
+
+        return audio_codec.split(".")[0] in OUTPUT_FORMATS[self.output_format]["codecs"]
 
     def download(self, video_url, new_file_name):
         """ Download a YouTube video as audioless MP4 to the filepath specified
@@ -157,42 +603,249 @@ class DownloadManager(object):
             downloaded_file - filename - The name of the newly downloaded file
         """
 
-        # Attempt to create a YouTube object for the video, taking into account and handling any YouTube related reasons that the video might be unavailable for download
+        # Find an audio only stream for the video and download it, in segments if enabled
         try:
-            video = YouTube(video_url, on_progress_callback=on_progress)
+            with self.recorder.span("download", video_url=video_url):
+                stream = self.get_audio_stream(video_url)
+                if self.segmented_downloader != None:
+                    self.segmented_downloader.download(stream.url, new_file_name, stream.filesize, self.progress_aggregator.update)
+                else:
+                    stream.download(filename=new_file_name)
 
-        # If video is age restricted
-        except AgeRestrictedError as err_msg:
-            raise Exception("Video is age restricted and cannot be accessed")
+        # Raise throttling and connection failures as their own error classes, so the caller can retry them
+        except Exception as err_msg:
+            self.recorder.count("download_failures")
+            download_error = errors.classify_error(err_msg)
+            if download_error is err_msg:
+                raise
+            raise download_error from err_msg
 
-        # If video is region blocked
-        except VideoRegionBlocked as err_msg:
-            raise Exception("Video is blocked in your region")
+        # Verify that the file did indeed download and return the new files name, noting its codec for conversion
+        if os.path.isfile(new_file_name) == True:
+            self.stream_codecs[new_file_name] = stream.audio_codec
+            self.loudness_keys[new_file_name] = self.get_loudness_key(video_url, stream)
+            self.recorder.count("bytes_downloaded", os.path.getsize(new_file_name))
+            downloaded_file = new_file_name
+            return downloaded_file
 
-        # If video is a livestream
-        except LiveStreamError as err_msg:
-            raise Exception("Cannot download video because it is a livestream")
+    def convert(self, old_file_name, new_file_name, metadata=None):
+        """ Convert an audioless MP4 file to the MP3 format, writing tags while encoding if metadata is given
+        
+        Arguments:
+            self - self - This object
+            old_file_name - filename - The name of the file to convert
+            new_file_name - filename - The name for the newly converted file
+            metadata - dict or None - Tag data to write, which only ffmpeg can do while encoding
 
-        # If video is private
-        except VideoPrivate as err_msg:
-            raise Exception("This video is private")
+        Returns:
+            converted_file - filename - The name of the newly converted file
+        """
 
-        # If video is unavailable for any other reason
-        except VideoUnavailable as err_msg:
-            raise Exception(err_msg)
+        # Time the conversion
+        with self.recorder.span("convert", file=new_file_name):
+            audio_codec = self.stream_codecs.get(old_file_name)
 
-        # Find an audio only stream for the video and download it
-        stream = video.streams.filter(only_audio=True).first()
-        stream.download(filename=new_file_name)
+            # Convert in process if PyAV was chosen
+            if self.encoder == "pyav":
+                return self.convert_in_process(old_file_name, new_file_name)
 
-        # Verify that the file did indeed download and return the new files name
-        if os.path.isfile(new_file_name) == True:
-            downloaded_file = new_file_name
-            return downloaded_file
+            # ReplayGain values already measured for the stream are written by ffmpeg, so the track isn't measured or tagged again
+            loudness_key = self.loudness_keys.get(old_file_name)
+            known_replaygain = self.get_known_replaygain(loudness_key)
+
+            # Build a command that uses the ffmpeg utility to facilitate conversion, also decoding the audio for measuring if enabled
+            command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", old_file_name]
+            command += self.build_cover_inputs(metadata)
+            command += self.build_tag_arguments(metadata, 0, 1, known_replaygain) + self.build_codec_arguments(audio_codec) + [new_file_name]
+            if known_replaygain == None:
+                command += self.build_pcm_arguments(0)
+
+            # Run the command, removing any partial file if it fails
+            try:
+                if self.replaygain == True and known_replaygain == None:
+                    ffmpeg_process = subprocess.Popen(command, stdout=subprocess.PIPE)
+                    measurement = self.start_measuring(ffmpeg_process)
+                    return_code = ffmpeg_process.wait()
+                    self.finish_measuring(measurement, new_file_name, return_code == 0, loudness_key)
+                    if return_code != 0:
+                        raise subprocess.CalledProcessError(return_code, command)
+                else:
+                    subprocess.check_output(command)
+            except subprocess.CalledProcessError:
+                if os.path.isfile(new_file_name) == True:
+                    os.remove(new_file_name)
+                raise
+
+            # Verify that the converted file was created and return
+            if os.path.isfile(new_file_name) == True:
+                converted_file = new_file_name
+                return converted_file
+
+    def convert_batch(self, file_names):
+        """ Convert a group of files to the MP3 format with a single ffmpeg invocation, so the cost of starting ffmpeg is shared between them
+
+        Arguments:
+            self - self - This object
+            file_names - list of tuples - Old filename/new filename/metadata tuples of the files to convert, where metadata is tag data or None
+
+        Returns:
+            converted_files - list - The name of each newly converted file, in order, or the exception raised while converting it
+        """
+
+        # Time the whole batch
+        with self.recorder.span("convert_batch", files=len(file_names)):
+            # There is nothing to share with PyAV or a single file, and ffmpeg can only hand back one track's samples for measuring
+            if self.encoder == "pyav" or len(file_names) == 1 or self.replaygain == True:
+                converted_files = []
+                for old_file_name, new_file_name, metadata in file_names:
+                    try:
+                        converted_files.append(self.convert(old_file_name, new_file_name, metadata))
+                    except Exception as err_msg:
+                        converted_files.append(err_msg)
+                return converted_files
+
+            # Give ffmpeg every input, followed by any cover images
+            command = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+            for old_file_name, new_file_name, metadata in file_names:
+                command += ["-i", old_file_name]
+
+            cover_input_numbers = []
+            cover_input_number = len(file_names)
+            for old_file_name, new_file_name, metadata in file_names:
+                cover_inputs = self.build_cover_inputs(metadata)
+                command += cover_inputs
+                cover_input_numbers.append(cover_input_number)
+                if len(cover_inputs) > 0:
+                    cover_input_number += 1
+
+            # Then map each input's audio and cover to its own output, with its own tags, copying the audio where it can
+            c = 0
+            for old_file_name, new_file_name, metadata in file_names:
+                command += self.build_tag_arguments(metadata, c, cover_input_numbers[c]) + self.build_codec_arguments(self.stream_codecs.get(old_file_name)) + [new_file_name]
+                c += 1
+
+            try:
+                subprocess.check_output(command)
+
+            # One bad input fails the whole batch, so convert the files one by one to find out which
+            except subprocess.CalledProcessError:
+                for old_file_name, new_file_name, metadata in file_names:
+                    if os.path.isfile(new_file_name) == True:
+                        os.remove(new_file_name)
+
+                converted_files = []
+                for old_file_name, new_file_name, metadata in file_names:
+                    try:
+                        converted_files.append(self.convert(old_file_name, new_file_name, metadata))
+                    except Exception as err_msg:
+                        converted_files.append(err_msg)
+                return converted_files
+
+            # Verify that each converted file was created
+            converted_files = []
+            for old_file_name, new_file_name, metadata in file_names:
+                if os.path.isfile(new_file_name) == True:
+                    converted_files.append(new_file_name)
+                else:
+                    converted_files.append(Exception("ffmpeg did not create {}".format(new_file_name)))
+
+            return converted_files
+
+    def build_codec_arguments(self, audio_codec):
+        """ Build the ffmpeg output arguments that copy a track's audio into the output format as it is, or encode it if the format can't hold its codec
+
+        Arguments:
+            self - self - This object
+            audio_codec - string or None - Codec of the downloaded stream, or None if it isn't known
+
+        Returns:
+            arguments - list of strings - The output arguments, placed before the output filename
+        """
+
+        if self.can_copy(audio_codec) == True:
+            self.recorder.count("tracks_copied")
+            return ["-c:a", "copy"]
+
+        return list(OUTPUT_FORMATS[self.output_format]["encoder_arguments"])
+
+    def tags_while_encoding(self):
+        """ Check whether the encoder writes tags itself, leaving nothing for the tag editor to do
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            tags_while_encoding - bool - True if tags are written during conversion
+        """
+
+        return self.encoder == "ffmpeg"
+
+    def build_cover_inputs(self, metadata):
+        """ Build the ffmpeg input arguments for a track's cover image
+
+        Arguments:
+            self - self - This object
+            metadata - dict or None - Tag data of the track
+
+        Returns:
+            arguments - list of strings - The input arguments, empty if there is no cover image
+        """
+
+        if metadata == None or metadata["thumbnail"] == None or OUTPUT_FORMATS[self.output_format]["cover"] == False:
+            return []
+
+        # Use the cached, possibly scaled down, copy of the cover image if there is one
+        if self.artwork_cache != None:
+            return ["-i", self.artwork_cache.get_file(metadata["thumbnail"])]
+
+        return ["-i", metadata["thumbnail"]]
+
+    def build_tag_arguments(self, metadata, input_number, cover_input_number, replaygain=None):
+        """ Build the ffmpeg output arguments that map a track's audio and cover image and set its ID3v2.3 tags
+
+        Arguments:
+            self - self - This object
+            metadata - dict or None - Tag data of the track
+            input_number - int - Position of the track's audio among ffmpeg's inputs
+            cover_input_number - int - Position of the track's cover image among ffmpeg's inputs
+            replaygain - dict or None - Track gain in dB and peak, if they are known before encoding
+
+        Returns:
+            arguments - list of strings - The output arguments, placed before the output filename
+        """
+
+        arguments = ["-map", "{}:a".format(input_number)]
+
+        # ffmpeg writes tags it has no frame for as TXXX frames named after them, which are the frames the tag editor writes
+        if replaygain != None:
+            arguments += ["-id3v2_version", "3", "-metadata", "REPLAYGAIN_TRACK_GAIN={:.2f} dB".format(replaygain["track_gain"]), "-metadata", "REPLAYGAIN_TRACK_PEAK={:.6f}".format(replaygain["track_peak"])]
+
+        if metadata == None:
+            return arguments
+
+        # Embed the cover image as is, as the front cover, if the format can hold one
+        if metadata["thumbnail"] != None and OUTPUT_FORMATS[self.output_format]["cover"] == True:
+            arguments += ["-map", "{}:v".format(cover_input_number), "-c:v", "copy", "-disposition:v", "attached_pic", "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"]
+
+        # Write the same tags, and for MP3 the same tag version, as the tag editor
+        if self.output_format == "mp3" and replaygain == None:
+            arguments += ["-id3v2_version", "3"]
+        if metadata["title"] != None:
+            arguments += ["-metadata", "title={}".format(metadata["title"])]
+        if metadata["artist"] != None:
+            arguments += ["-metadata", "artist={}".format(metadata["artist"])]
+        if metadata["album"] != None:
+            arguments += ["-metadata", "album={}".format(metadata["album"])]
+        if metadata["track_num"] != None:
+            arguments += ["-metadata", "track={}".format(int(metadata["track_num"]))]
+        if metadata["recording_date"] != None:
+            arguments += ["-metadata", "date={}".format(int(metadata["recording_date"]))]
+
+        return arguments
+
+    def convert_in_process(self, old_file_name, new_file_name):
+        """ Convert a file to the MP3 format in process with PyAV, avoiding the cost of starting ffmpeg
 
-    def convert(self, old_file_name, new_file_name):
-        """ Convert an audioless MP4 file to the MP3 format
-        
         Arguments:
             self - self - This object
             old_file_name - filename - The name of the file to convert
@@ -202,40 +855,311 @@ class DownloadManager(object):
             converted_file - filename - The name of the newly converted file
         """
 
-        # Build a command that uses the ffmpeg utility to facilitate conversion
-        command = """ffmpeg -hide_banner -loglevel error -i "{0}" "{1}" """.format(old_file_name, new_file_name)
+        import av
+
+        with av.open(old_file_name) as input_container:
+            input_stream = input_container.streams.audio[0]
+            sample_rate = input_stream.rate or 44100
+
+            with av.open(new_file_name, "w", format="mp3") as output_container:
+                output_stream = output_container.add_stream("mp3", rate=sample_rate)
 
-        # Run the command
-        subprocess.check_output(command, shell=True)
+                # Resample the decoded audio into the encoder's sample format
+                resampler = av.AudioResampler(format="s16p", layout="stereo", rate=sample_rate)
+
+                for frame in input_container.decode(input_stream):
+                    frame.pts = None
+                    for resampled_frame in resampler.resample(frame):
+                        for packet in output_stream.encode(resampled_frame):
+                            output_container.mux(packet)
+
+                # Flush the encoder
+                for packet in output_stream.encode(None):
+                    output_container.mux(packet)
 
         # Verify that the converted file was created and return
         if os.path.isfile(new_file_name) == True:
             converted_file = new_file_name
             return converted_file
 
+    def stream_and_convert(self, video_url, new_file_name, metadata=None):
+        """ Download a video's audio stream and pipe it straight into ffmpeg, so conversion runs alongside the download and nothing is written to disk but the MP3
+
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video to download
+            new_file_name - filename - The name for the newly converted file
+            metadata - dict or None - Tag data to write while encoding
+
+        Returns:
+            converted_file - filename - The name of the newly converted file
+        """
+
+        # Time the download and conversion together, since they overlap
+        with self.recorder.span("stream_and_convert", video_url=video_url):
+            # Find an audio only stream for the video, and any ReplayGain values measured for it in an earlier run
+            stream = self.get_audio_stream(video_url)
+            loudness_key = self.get_loudness_key(video_url, stream)
+            known_replaygain = self.get_known_replaygain(loudness_key)
+            measure = self.replaygain == True and known_replaygain == None
+
+            # Start ffmpeg reading from its standard input, writing known ReplayGain values or measuring the audio it decodes if enabled
+            command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0"]
+            command += self.build_cover_inputs(metadata)
+            command += self.build_tag_arguments(metadata, 0, 1, known_replaygain) + self.build_codec_arguments(stream.audio_codec) + [new_file_name]
+            if measure == True:
+                command += self.build_pcm_arguments(0)
+            ffmpeg_process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE if measure == True else None)
+            measurement = self.start_measuring(ffmpeg_process) if measure == True else None
+
+            # Feed the downloaded chunks to ffmpeg as they arrive
+            bytes_remaining = stream.filesize
+            try:
+                for chunk in request.stream(stream.url):
+                    ffmpeg_process.stdin.write(chunk)
+
+                    bytes_remaining -= len(chunk)
+                    self.progress_aggregator.on_progress(stream, chunk, bytes_remaining)
+                    self.recorder.count("bytes_downloaded", len(chunk))
+
+            # If ffmpeg exited early, its return code says why
+            except BrokenPipeError:
+                pass
+
+            # If the download failed, stop ffmpeg and remove the partial file
+            except Exception as err_msg:
+                self.recorder.count("download_failures")
+                ffmpeg_process.kill()
+                ffmpeg_process.wait()
+                self.finish_measuring(measurement, new_file_name, False)
+                if os.path.isfile(new_file_name) == True:
+                    os.remove(new_file_name)
+
+                # Raise throttling and connection failures as their own error classes, so the caller can retry them
+                download_error = errors.classify_error(err_msg)
+                if download_error is err_msg:
+                    raise
+                raise download_error from err_msg
+
+            # Tell ffmpeg the stream has ended and wait for it to finish
+            try:
+                ffmpeg_process.stdin.close()
+            except BrokenPipeError:
+                pass
+            return_code = ffmpeg_process.wait()
+            self.finish_measuring(measurement, new_file_name, return_code == 0, loudness_key)
+
+            # If ffmpeg failed, remove what it wrote, as convert() does
+            if return_code != 0:
+                if os.path.isfile(new_file_name) == True:
+                    os.remove(new_file_name)
+                raise subprocess.CalledProcessError(return_code, command)
+
+            # Verify that the converted file was created and return
+            if os.path.isfile(new_file_name) == True:
+                converted_file = new_file_name
+                return converted_file
+
+    def build_pcm_arguments(self, input_number):
+        """ Build the ffmpeg arguments that also decode a track's audio to ffmpeg's standard output for measuring its loudness, if enabled
+
+        Arguments:
+            self - self - This object
+            input_number - int - Number of the ffmpeg input holding the audio
+
+        Returns:
+            arguments - list of strings - The arguments, to go after the converted file's own, which are empty unless ReplayGain is enabled
+        """
+
+        if self.replaygain == False:
+            return []
+
+        # NumPy is optional, so it is only loaded when ReplayGain is enabled
+        from lib import loudness
+        return loudness.build_pcm_arguments(input_number)
+
+    def get_loudness_key(self, video_url, stream):
+        """ Get the key a stream's loudness is cached under, which is the same for every download of the stream
+
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video
+            stream - Stream object - The audio stream
+
+        Returns:
+            loudness_key - string or None - The key, or None if ReplayGain isn't enabled or there is no cache
+        """
+
+        if self.replaygain == False or self.metadata_cache == None:
+            return None
+
+        return "{0}:{1}".format(self.get_video_id(video_url), stream.itag)
+
+    def get_known_replaygain(self, loudness_key):
+        """ Get the ReplayGain values measured for a stream in an earlier run, so they can be written while encoding
+
+        Arguments:
+            self - self - This object
+            loudness_key - string or None - What get_loudness_key() returned for the stream
+
+        Returns:
+            replaygain - dict or None - Track gain in dB and peak, or None if the stream hasn't been measured
+        """
+
+        if loudness_key == None:
+            return None
+
+        return self.metadata_cache.get("loudness", loudness_key)
+
+    def remember_replaygain(self, loudness_key, replaygain):
+        """ Cache the ReplayGain values measured for a stream, so later downloads of it have ffmpeg write them while encoding
+
+        Arguments:
+            self - self - This object
+            loudness_key - string or None - What get_loudness_key() returned for the stream
+            replaygain - dict or None - Track gain in dB and peak
+        """
+
+        if loudness_key != None and replaygain != None:
+            self.metadata_cache.put("loudness", loudness_key, replaygain)
+
+    def start_measuring(self, ffmpeg_process):
+        """ Start measuring the loudness of the samples ffmpeg writes to its standard output, on a thread of its own so ffmpeg never waits on it
+
+        Arguments:
+            self - self - This object
+            ffmpeg_process - Popen object - The ffmpeg process, started with build_pcm_arguments()
+
+        Returns:
+            measurement - tuple or None - The LoudnessMeter, the thread feeding it and the pipe it reads, or None if ReplayGain isn't enabled
+        """
+
+        if self.replaygain == False:
+            return None
+
+        from lib import loudness
+        meter = loudness.LoudnessMeter()
+        measure_thread = threading.Thread(target=meter.read_from, args=(ffmpeg_process.stdout,), name="loudness", daemon=True)
+        measure_thread.start()
+
+        return meter, measure_thread, ffmpeg_process.stdout
+
+    def finish_measuring(self, measurement, new_file_name, succeeded, loudness_key=None):
+        """ Wait for a loudness measurement to read the last of ffmpeg's output and keep its ReplayGain values for tagging and for later downloads of the stream
+
+        Arguments:
+            self - self - This object
+            measurement - tuple or None - What start_measuring() returned
+            new_file_name - filename - The converted file the values belong to
+            succeeded - bool - Whether ffmpeg succeeded, since a failed conversion's values are thrown away
+            loudness_key - string or None - What get_loudness_key() returned for the stream
+        """
+
+        if measurement == None:
+            return
+
+        meter, measure_thread, pcm_file = measurement
+        measure_thread.join()
+        pcm_file.close()
+
+        if succeeded == True:
+            with self.recorder.span("measure_loudness", file=new_file_name):
+                replaygain = meter.get_replaygain()
+            if replaygain != None:
+                self.loudness_results[new_file_name] = replaygain
+            self.remember_replaygain(loudness_key, replaygain)
+
 class Downloader(object):
-    """ Unifies downloading and conversion into one object method
-    
+    """ Unifies downloading, conversion and tagging into one object
+
+    The three steps are available as separate stage methods so that they can be run in their own worker pools, with download_and_convert() running them back to back. In streaming mode, the download and conversion steps are merged into stream_stage(). Output is written to a partial file that is only renamed to its final filename once tagged, so a final filename always holds a finished file. If a journal is given, each stage records its completion there and is skipped if an earlier run already completed it.
+
     Methods:
         __init__() - Initialize the object
+        get_stage() - Get the last stage a video reached in an earlier run
+        record_stage() - Record a video reaching a stage
+        get_converted() - Get the output of a video converted in an earlier run
+        download_stage() - Download a video to a temporary file
+        convert_stage() - Convert a downloaded video to MP3 format
+        convert_batch_stage() - Convert several downloaded videos to MP3 format at once
+        stream_stage() - Download a video straight into MP3 format
+        tag_stage() - Insert metadata into a converted MP3 file
         download_and_convert() - Download and convert a video
     """
 
-    def __init__(self, download_manager, editor):
+    def __init__(self, download_manager, editor, streaming=False, controller=None, job_journal=None):
         """ Initialize the object
         
         Arguments:
             self - self - This object
             download_manager - DownloadManager object - The manager object used to download and convert videos
             editor - Editor object - Tag editor for inserting MP3 metadata
+            streaming - bool - Pipe downloads straight into ffmpeg instead of using a temporary file
+            controller - AdaptiveController object or None - Limits and retries downloads, if set
+            job_journal - Journal object or None - Records the stage each video reaches, if set
             """
 
         self.download_manager = download_manager
         self.editor = editor
+        self.streaming = streaming
+        self.controller = controller
+        self.job_journal = job_journal
+
+    def get_stage(self, video_filename):
+        """ Get the last stage a video reached in an earlier run
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - The video's final filename
+
+        Returns:
+            stage - string or None - The stage, or None if there is no journal or the video isn't in it
+        """
+
+        if self.job_journal == None:
+            return None
+        return self.job_journal.get_stage(video_filename)
+
+    def record_stage(self, video_filename, stage, **fields):
+        """ Record a video reaching a stage, if there is a journal
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - The video's final filename
+            stage - string - The stage reached
+            fields - any - Extra fields to record
+        """
+
+        if self.job_journal != None:
+            self.job_journal.record(video_filename, stage, **fields)
+
+    def get_converted(self, video_filename, video_metadata):
+        """ Get the output of a video converted in an earlier run, in the form convert_stage() returns it
+
+        Arguments:
+            self - self - This object
+            video_filename - filename - The video's final filename
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            converted_file - filename - The converted file
+            video_metadata - dict or None - Tag data still to be inserted, which is None if the encoder wrote it
+        """
+
+        journal_record = self.job_journal.get_record(video_filename)
+        if journal_record.get("tags_pending") != True:
+            video_metadata = None
+
+        # Bring back the loudness measured while converting, so the file isn't decoded again
+        partial_filename = journal.get_partial_filename(video_filename)
+        if journal_record.get("replaygain") != None:
+            self.download_manager.loudness_results[partial_filename] = journal_record["replaygain"]
+
+        return partial_filename, video_metadata
+
+    def download_stage(self, video_url, video_title, video_filename, video_metadata):
+        """ Download a video to a temporary file next to its final filename
 
-    def download_and_convert(self, video_url, video_title, video_filename, video_metadata):
-        """ Download and convert a video in a unified manner, inserting metadata if present
-        
         Arguments:
             self - self - This object
             video_url - string - URL of the YouTube video to download
@@ -244,36 +1168,220 @@ class Downloader(object):
             video_metadata - dict or None - Either provided tag data or Nonetype
 
         Returns:
-            mp3_file - filename - The resultant MP3 format file
+            downloaded_file - filename or None - The temporary file holding the download, or None if an earlier run already converted it
+            video_filename - filename - The desired filename for the downloaded video
+            video_metadata - dict or None - Either provided tag data or Nonetype
         """
 
-        # Create a temporary filename for the preconversion download and begin download
+        # Create a temporary filename for the preconversion download
         temp_video_filename = video_filename + ".temp"
-        downloaded_file = self.download_manager.download(video_url, temp_video_filename)
 
-        # Convert the downloaded file to the MP3 format
-        converted_file = self.download_manager.convert(downloaded_file, video_filename)
+        # Skip the download if an earlier run got this video far enough and its files are still there
+        stage = self.get_stage(video_filename)
+        if stage == "converted" and (os.path.isfile(journal.get_partial_filename(video_filename)) == True or os.path.isfile(video_filename) == True):
+            return None, video_filename, video_metadata
+        if stage == "downloaded" and os.path.isfile(temp_video_filename) == True:
+            self.download_manager.stream_codecs[temp_video_filename] = self.job_journal.get_record(video_filename).get("audio_codec")
+            return temp_video_filename, video_filename, video_metadata
 
-        # Remove the temporary file
-        os.remove(downloaded_file)
+        # Begin download
+        if self.controller != None:
+            downloaded_file = self.controller.run(self.download_manager.download, video_url, temp_video_filename)
+        else:
+            downloaded_file = self.download_manager.download(video_url, temp_video_filename)
 
-        # If metadata was provided, insert it into the new MP3 file
-        if video_metadata != None:
-            tagged_mp3_file = self.editor.insert_metadata(converted_file, video_metadata)
+        self.record_stage(video_filename, "downloaded", audio_codec=self.download_manager.stream_codecs.get(downloaded_file))
 
-        # Return the new MP3 files name
-        mp3_file = converted_file
-        return mp3_file
+        return downloaded_file, video_filename, video_metadata
 
-        
+    def convert_stage(self, downloaded_file, video_filename, video_metadata):
+        """ Convert a downloaded video to MP3 format and remove the temporary file
 
-        
+        Arguments:
+            self - self - This object
+            downloaded_file - filename or None - The temporary file holding the download, or None if an earlier run already converted it
+            video_filename - filename - The desired filename for the converted file
+            video_metadata - dict or None - Either provided tag data or Nonetype
 
-        
+        Returns:
+            converted_file - filename - The converted MP3 file, under its partial filename
+            video_metadata - dict or None - Tag data still to be inserted, which is None if the encoder wrote it
+        """
 
-    
+        # Skip the conversion if an earlier run already did it
+        if downloaded_file == None:
+            return self.get_converted(video_filename, video_metadata)
 
-            
+        # Convert the downloaded file to the MP3 format, tagging it at the same time if the encoder can
+        partial_filename = journal.get_partial_filename(video_filename)
+        try:
+            if video_metadata != None and self.download_manager.tags_while_encoding() == True:
+                try:
+                    converted_file = self.download_manager.convert(downloaded_file, partial_filename, video_metadata)
+                    video_metadata = None
+
+                # If ffmpeg couldn't write the tags, convert without them and leave them to the tag editor, which only handles MP3
+                except subprocess.CalledProcessError:
+                    if self.download_manager.output_format != "mp3":
+                        raise
+                    converted_file = self.download_manager.convert(downloaded_file, partial_filename)
+            else:
+                converted_file = self.download_manager.convert(downloaded_file, partial_filename)
+
+            self.record_stage(video_filename, "converted", tags_pending=video_metadata != None, replaygain=self.download_manager.loudness_results.get(converted_file))
+
+        # Remove the temporary file, whether or not conversion worked
+        finally:
+            os.remove(downloaded_file)
+            self.download_manager.stream_codecs.pop(downloaded_file, None)
+            self.download_manager.loudness_keys.pop(downloaded_file, None)
+
+        return converted_file, video_metadata
+
+    def convert_batch_stage(self, jobs):
+        """ Convert several downloaded videos to MP3 format at once and remove their temporary files
+
+        Arguments:
+            self - self - This object
+            jobs - list of tuples - The downloaded_file/video_filename/video_metadata arguments of convert_stage() for each video
+
+        Returns:
+            converted - list - A converted_file/video_metadata tuple for each video, or the exception raised while converting it
+        """
+
+        # Videos an earlier run already converted are passed straight through
+        converted = [None] * len(jobs)
+        pending_jobs = []
+        for c, (downloaded_file, video_filename, video_metadata) in enumerate(jobs):
+            if downloaded_file == None:
+                converted[c] = self.get_converted(video_filename, video_metadata)
+            else:
+                pending_jobs.append((c, downloaded_file, video_filename, video_metadata))
+
+        if len(pending_jobs) == 0:
+            return converted
+
+        # Tag the files at the same time if the encoder can, converting to partial filenames
+        tags_while_encoding = self.download_manager.tags_while_encoding()
+        if tags_while_encoding == True:
+            file_names = [(downloaded_file, journal.get_partial_filename(video_filename), video_metadata) for c, downloaded_file, video_filename, video_metadata in pending_jobs]
+        else:
+            file_names = [(downloaded_file, journal.get_partial_filename(video_filename), None) for c, downloaded_file, video_filename, video_metadata in pending_jobs]
+
+        try:
+            converted_files = self.download_manager.convert_batch(file_names)
+
+        # Remove the temporary files, whether or not conversion worked
+        finally:
+            for downloaded_file, partial_filename, video_metadata in file_names:
+                os.remove(downloaded_file)
+                self.download_manager.stream_codecs.pop(downloaded_file, None)
+                self.download_manager.loudness_keys.pop(downloaded_file, None)
 
+        for converted_file, (c, downloaded_file, video_filename, video_metadata) in zip(converted_files, pending_jobs):
+            if isinstance(converted_file, Exception) == True:
+                converted[c] = converted_file
+                continue
 
+            if tags_while_encoding == True:
+                video_metadata = None
+            self.record_stage(video_filename, "converted", tags_pending=video_metadata != None, replaygain=self.download_manager.loudness_results.get(converted_file))
+            converted[c] = (converted_file, video_metadata)
 
+        return converted
+
+    def stream_stage(self, video_url, video_title, video_filename, video_metadata):
+        """ Download a video straight into ffmpeg, without a temporary file
+
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video to download
+            video_title - string - Title of the video
+            video_filename - filename - The desired filename for the converted file
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            converted_file - filename - The converted MP3 file, under its partial filename
+            video_metadata - dict or None - Tag data still to be inserted, which is None if the encoder wrote it
+        """
+
+        # Pick up where an earlier run that used a temporary file left off
+        if self.get_stage(video_filename) in ("downloaded", "converted"):
+            return self.convert_stage(*self.download_stage(video_url, video_title, video_filename, video_metadata))
+
+        # Tag the file while encoding it, unless there are no tags
+        partial_filename = journal.get_partial_filename(video_filename)
+        try:
+            if self.controller != None:
+                converted_file = self.controller.run(self.download_manager.stream_and_convert, video_url, partial_filename, video_metadata)
+            else:
+                converted_file = self.download_manager.stream_and_convert(video_url, partial_filename, video_metadata)
+            video_metadata = None
+
+        # If ffmpeg couldn't write the tags, download again and convert without them, leaving them to the tag editor, which only handles MP3
+        except subprocess.CalledProcessError:
+            if video_metadata == None or self.download_manager.output_format != "mp3":
+                raise
+            if self.controller != None:
+                converted_file = self.controller.run(self.download_manager.stream_and_convert, video_url, partial_filename)
+            else:
+                converted_file = self.download_manager.stream_and_convert(video_url, partial_filename)
+
+        self.record_stage(video_filename, "converted", tags_pending=video_metadata != None, replaygain=self.download_manager.loudness_results.get(converted_file))
+
+        return converted_file, video_metadata
+
+    def tag_stage(self, converted_file, video_metadata):
+        """ Insert metadata and any ReplayGain values measured while converting into a converted MP3 file, and rename it to its final filename
+
+        Arguments:
+            self - self - This object
+            converted_file - filename - The converted MP3 file, under its partial filename
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            mp3_file - filename - The resultant MP3 format file
+        """
+
+        mp3_file = journal.get_final_filename(converted_file)
+        replaygain = self.download_manager.loudness_results.pop(converted_file, None)
+
+        # An earlier run may have stopped after the rename but before recording it
+        if os.path.isfile(converted_file) == False and os.path.isfile(mp3_file) == True:
+            self.record_stage(mp3_file, "tagged")
+            return mp3_file
+
+        # If metadata was provided or the loudness was measured, insert it into the new MP3 file
+        if video_metadata != None or replaygain != None:
+            self.editor.insert_metadata(converted_file, video_metadata, replaygain)
+
+        # Rename the finished file in one step, so the final filename never holds a partial file
+        os.replace(converted_file, mp3_file)
+        self.record_stage(mp3_file, "tagged")
+
+        # Return the new MP3 files name
+        return mp3_file
+
+    def download_and_convert(self, video_url, video_title, video_filename, video_metadata):
+        """ Download and convert a video in a unified manner, inserting metadata if present
+        
+        Arguments:
+            self - self - This object
+            video_url - string - URL of the YouTube video to download
+            video_title - string - Title of the video
+            video_filename - filename - The desired filename for the downloaded video
+            video_metadata - dict or None - Either provided tag data or Nonetype
+
+        Returns:
+            mp3_file - filename - The resultant MP3 format file
+        """
+
+        # Run each stage in turn on this thread
+        if self.streaming == True:
+            converted = self.stream_stage(video_url, video_title, video_filename, video_metadata)
+        else:
+            downloaded = self.download_stage(video_url, video_title, video_filename, video_metadata)
+            converted = self.convert_stage(*downloaded)
+        mp3_file = self.tag_stage(*converted)
+
+        return mp3_file
@@ -0,0 +1,302 @@
+# lib/manifest.py
+# Look up tag data for a video in a CSV manifest without loading the whole file
+
+import io
+import os
+import csv
+import sqlite3
+import threading
+import urllib.parse
+
+# Tag names, in the column order of a positional manifest
+TAG_NAMES = ["thumbnail", "title", "artist", "album", "track_num", "genre", "recording_date"]
+
+# Tags that must be whole numbers
+INTEGER_TAGS = ["track_num", "recording_date"]
+
+# Column that holds the video ID or URL of each row in a keyed manifest
+KEY_COLUMN = "video"
+
+class TagManifest(object):
+    """ Tag data for videos, read lazily from a CSV file through an on-disk index
+
+    A manifest is either keyed or positional. A keyed manifest has a header row whose columns are "video" followed by any of the tag names, and each row is matched to a video by the ID or URL in its "video" column, so a missing or reordered playlist entry doesn't shift the tags of the videos after it. A positional manifest is the original format, with no header and the seven tags in order, and its rows are matched to videos by their position in the queue.
+
+    The first time a manifest is used, it is read once from start to finish, each row is validated, and the byte offset of each valid row is stored in an SQLite index next to it. After that a lookup seeks straight to the row and parses only that row, so lookups cost the same however big the manifest is. The index is rebuilt whenever the manifest changes. If the index can't be stored next to the manifest, such as in a read-only directory, it is built in memory for the run instead.
+
+    Methods:
+        __init__() - Initialize the object
+        open_index() - Open the index, building it if needed
+        get() - Look up the tag data of a video
+        build_index() - Index the byte offset of each row
+        iter_records() - Read the manifest a record at a time
+        parse_row() - Turn a row into a tag data dictionary
+        read_row() - Read and parse the row at an offset
+        close() - Close the manifest and its index
+    """
+
+    def __init__(self, tag_data_file, index_file=None):
+        """ Initialize the object, building the index if it is missing or out of date
+
+        Arguments:
+            self - self - This object
+            tag_data_file - filename - Path of the CSV manifest
+            index_file - filename or None - Path of the SQLite index, defaulting to the manifest's path with ".index.sqlite" appended
+        """
+
+        if index_file == None:
+            index_file = tag_data_file + ".index.sqlite"
+
+        self.tag_data_file = tag_data_file
+        self.index_file = index_file
+
+        # The manifest and index are shared by all threads, so access to them is serialized with a lock
+        self.lock = threading.Lock()
+        self.open_tag_data_file = open(tag_data_file, "rb")
+
+        # A manifest in a read-only directory can't have its index stored next to it, so the index is kept in memory for this run instead
+        try:
+            try:
+                info = self.open_index(index_file)
+            except sqlite3.Error as err_msg:
+                print("\t[i] Can't use the tag data index {0} ({1}), indexing in memory instead".format(index_file, err_msg))
+                self.index_file = ":memory:"
+                info = self.open_index(self.index_file)
+
+        except Exception:
+            self.open_tag_data_file.close()
+            raise
+
+        self.keyed = info["keyed"] == "1"
+        self.header = info["header"].split(",") if self.keyed == True else TAG_NAMES
+
+    def open_index(self, index_file):
+        """ Open the index, building it if it is missing or out of date
+
+        Arguments:
+            self - self - This object
+            index_file - filename - Path of the SQLite index, or ":memory:"
+
+        Returns:
+            info - dict - The index's stored details of the manifest
+
+        Raises:
+            sqlite3.Error - The index can't be opened or written
+        """
+
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+        try:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, offset INTEGER, line INTEGER)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT)")
+
+            # Rebuild the index if the manifest changed since it was built
+            file_stat = os.stat(self.tag_data_file)
+            signature = "{0}:{1}".format(file_stat.st_size, file_stat.st_mtime_ns)
+            info = dict(self.connection.execute("SELECT name, value FROM info").fetchall())
+            if info.get("signature") != signature:
+                self.build_index(signature)
+                info = dict(self.connection.execute("SELECT name, value FROM info").fetchall())
+
+        except Exception:
+            self.connection.close()
+            raise
+
+        return info
+
+    def get(self, video_id, position=None):
+        """ Look up the tag data of a video
+
+        Arguments:
+            self - self - This object
+            video_id - string - The YouTube ID of the video, used with keyed manifests
+            position - int or None - Position of the video in its queue, used with positional manifests
+
+        Returns:
+            video_metadata - dict or None - The video's tag data, or None if the manifest has none for it
+        """
+
+        if self.keyed == True:
+            key = video_id
+        elif position != None:
+            key = str(position)
+        else:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT offset FROM rows WHERE key = ?", (key,)).fetchone()
+            if row == None:
+                return None
+
+            return self.read_row(row[0])
+
+    def build_index(self, signature):
+        """ Read the manifest once, validating each row and storing the offset of each valid one
+
+        Arguments:
+            self - self - This object
+            signature - string - Size and modification time of the manifest, stored to tell when it changes
+        """
+
+        self.connection.execute("DELETE FROM rows")
+        self.connection.execute("DELETE FROM info")
+
+        keyed = False
+        header = None
+        position = 0
+        for offset, line_number, row in self.iter_records():
+            # Skip blank lines
+            if len(row) == 0 or (len(row) == 1 and row[0].strip() == ""):
+                continue
+
+            # A header whose first column is "video" makes this a keyed manifest
+            if line_number == 1 and row[0].strip().lower() == KEY_COLUMN:
+                keyed = True
+                header = [cell.strip().lower() for cell in row]
+                unknown_columns = [column for column in header[1:] if column not in TAG_NAMES]
+                if len(unknown_columns) > 0:
+                    raise ValueError("{0}: Unknown column(s) {1}".format(self.tag_data_file, ", ".join(unknown_columns)))
+                continue
+
+            # Validate the row, reporting and skipping bad ones rather than giving up on the whole manifest
+            try:
+                video_metadata = self.parse_row(row, header if keyed == True else TAG_NAMES)
+            except ValueError as err_msg:
+                print("\t[E] {0}, line {1}: {2}".format(self.tag_data_file, line_number, err_msg))
+                if keyed == False:
+                    position += 1
+                continue
+
+            if keyed == True:
+                key = get_video_key(row[0])
+                if key == None:
+                    print("\t[E] {0}, line {1}: Not a video ID or URL: {2}".format(self.tag_data_file, line_number, row[0]))
+                    continue
+            else:
+                key = str(position)
+                position += 1
+
+            # Later rows for the same video replace earlier ones
+            self.connection.execute("INSERT OR REPLACE INTO rows (key, offset, line) VALUES (?, ?, ?)", (key, offset, line_number))
+
+        self.connection.execute("INSERT INTO info (name, value) VALUES (?, ?)", ("keyed", "1" if keyed == True else "0"))
+        self.connection.execute("INSERT INTO info (name, value) VALUES (?, ?)", ("header", ",".join(header) if keyed == True else ""))
+        self.connection.execute("INSERT INTO info (name, value) VALUES (?, ?)", ("signature", signature))
+        self.connection.commit()
+
+    def iter_records(self, offset=0):
+        """ Read the manifest a record at a time, keeping track of where each record starts
+
+        Arguments:
+            self - self - This object
+            offset - int - Byte offset to start reading from
+
+        Returns:
+            records - generator of tuples - A byte offset/line number/row tuple for each record
+        """
+
+        self.open_tag_data_file.seek(offset)
+        line_number = 0
+        while True:
+            record_offset = self.open_tag_data_file.tell()
+            record_line_number = line_number + 1
+            record = self.open_tag_data_file.readline()
+            if record == b"":
+                return
+            line_number += 1
+
+            # A quoted cell can span several lines, so keep reading until the quotes are balanced
+            while record.count(b"\"") % 2 == 1:
+                next_line = self.open_tag_data_file.readline()
+                if next_line == b"":
+                    break
+                record += next_line
+                line_number += 1
+
+            rows = list(csv.reader(io.StringIO(record.decode("utf-8-sig" if record_offset == 0 else "utf-8")), delimiter=","))
+            yield record_offset, record_line_number, rows[0] if len(rows) > 0 else []
+
+    def parse_row(self, row, columns):
+        """ Turn a row into a tag data dictionary, checking that it is well formed
+
+        Arguments:
+            self - self - This object
+            row - list of strings - Cells of the row
+            columns - list of strings - Name of each column
+
+        Returns:
+            video_metadata - dict - Tag data with a value, or Nonetype, for every tag
+        """
+
+        if len(row) != len(columns):
+            raise ValueError("Expected {0} columns, found {1}".format(len(columns), len(row)))
+
+        # Empty cells are replaced with Nonetype, as are tags the manifest has no column for
+        video_metadata = dict.fromkeys(TAG_NAMES)
+        for column, cell in zip(columns, row):
+            if column in video_metadata and cell != "":
+                video_metadata[column] = cell
+
+        for tag_name in INTEGER_TAGS:
+            if video_metadata[tag_name] != None and video_metadata[tag_name].strip().isdigit() == False:
+                raise ValueError("{0} must be a whole number: {1}".format(tag_name, video_metadata[tag_name]))
+
+        return video_metadata
+
+    def read_row(self, offset):
+        """ Read and parse the row at an offset
+
+        Arguments:
+            self - self - This object
+            offset - int - Byte offset of the row
+
+        Returns:
+            video_metadata - dict - Tag data of the row
+        """
+
+        for record_offset, line_number, row in self.iter_records(offset):
+            return self.parse_row(row, self.header)
+
+    def close(self):
+        """ Close the manifest and its index
+
+        Arguments:
+            self - self - This object
+        """
+
+        with self.lock:
+            self.open_tag_data_file.close()
+            self.connection.close()
+
+def get_video_key(cell):
+    """ Get the video ID from a manifest's video cell, which may be an ID or a URL
+
+    Arguments:
+        cell - string - Contents of the cell
+
+    Returns:
+        video_id - string or None - The video ID, or None if the cell holds neither
+    """
+
+    cell = cell.strip()
+    if cell == "":
+        return None
+
+    # A bare ID
+    if "/" not in cell and "?" not in cell:
+        return cell
+
+    parsed_url = urllib.parse.urlsplit(cell if "://" in cell else "https://" + cell)
+
+    # https://www.youtube.com/watch?v=ID
+    query = urllib.parse.parse_qs(parsed_url.query)
+    if "v" in query:
+        return query["v"][0]
+
+    # https://youtu.be/ID, https://www.youtube.com/shorts/ID and https://www.youtube.com/embed/ID
+    path_parts = [part for part in parsed_url.path.split("/") if part != ""]
+    if parsed_url.hostname == "youtu.be" and len(path_parts) > 0:
+        return path_parts[0]
+    if len(path_parts) > 1 and path_parts[0] in ("shorts", "embed", "v", "live"):
+        return path_parts[1]
+
+    return None
@@ -0,0 +1,299 @@
+# lib/metrics.py
+# Time each stage of a run and count what it did, for exporting as a trace and Prometheus metrics
+
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+
+# Upper bounds of the Prometheus duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "bulk_yt_mp3"
+
+class Span(object):
+    """ One timed call to a stage, used as a context manager or finished explicitly
+
+    Methods:
+        __init__() - Initialize the object, starting the clock
+        finish() - Stop the clock and record the span
+    """
+
+    def __init__(self, recorder, name, labels):
+        """ Initialize the object, starting the clock
+
+        Arguments:
+            self - self - This object
+            recorder - Recorder object - The recorder the span is reported to
+            name - string - Name of the stage
+            labels - dict - Extra fields written to the trace
+        """
+
+        self.recorder = recorder
+        self.name = name
+        self.labels = labels
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+
+    def finish(self, error=None):
+        """ Stop the clock and record the span
+
+        Arguments:
+            self - self - This object
+            error - Exception or None - The exception that ended the stage, if it failed
+        """
+
+        self.recorder.record_span(self, time.perf_counter() - self.start, error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(exc_value)
+
+class NullSpan(object):
+    """ A span that records nothing, handed out while metrics are disabled so instrumented code costs next to nothing """
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Recorder(object):
+    """ Collect timing spans and counters from every thread
+
+    Each span is written to a JSON-lines trace as it finishes, and folded into a per-stage duration histogram. Counters are plain totals. Both are written out in the Prometheus text format when the recorder is closed. A disabled recorder hands out a shared span that does nothing, so instrumentation can stay in place at no real cost.
+
+    Methods:
+        __init__() - Initialize the object
+        span() - Start timing a stage
+        count() - Add to a counter
+        record_span() - Record a finished span
+        export_prometheus() - Write the metrics in the Prometheus text format
+        close() - Write out the counters and close the trace
+    """
+
+    def __init__(self, output_directory=None, enabled=True):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            output_directory - string or None - Directory to write trace.jsonl and metrics.prom to, or None to only keep totals in memory
+            enabled - bool - Record anything at all
+        """
+
+        self.output_directory = output_directory
+        self.enabled = enabled
+
+        # Totals, keyed by counter name, and duration histograms, keyed by stage name
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+        self.trace_file = None
+        if enabled == True and output_directory != None:
+            os.makedirs(output_directory, exist_ok=True)
+            self.trace_file = open(os.path.join(output_directory, "trace.jsonl"), "w")
+
+    def span(self, name, **labels):
+        """ Start timing a stage
+
+        Arguments:
+            self - self - This object
+            name - string - Name of the stage
+            labels - any - Extra fields written to the trace, such as the video URL
+
+        Returns:
+            span - Span object - The span, to be finished or used as a context manager
+        """
+
+        if self.enabled == False:
+            return NULL_SPAN
+
+        return Span(self, name, labels)
+
+    def count(self, name, value=1):
+        """ Add to a counter
+
+        Arguments:
+            self - self - This object
+            name - string - Name of the counter
+            value - int or float - Amount to add
+        """
+
+        if self.enabled == False:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_span(self, span, duration, error=None):
+        """ Record a finished span in the trace and its stage's histogram
+
+        Arguments:
+            self - self - This object
+            span - Span object - The span
+            duration - float - How long it took, in seconds
+            error - Exception or None - The exception that ended it, if any
+        """
+
+        with self.lock:
+            histogram = self.histograms.get(span.name)
+            if histogram == None:
+                histogram = self.histograms[span.name] = {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0, "errors": 0}
+
+            histogram["count"] += 1
+            histogram["sum"] += duration
+            if error != None:
+                histogram["errors"] += 1
+            for c in range(len(DURATION_BUCKETS)):
+                if duration <= DURATION_BUCKETS[c]:
+                    histogram["buckets"][c] += 1
+
+            if self.trace_file != None:
+                trace_entry = {"type": "span", "name": span.name, "start": span.start_time, "duration": duration, "thread": threading.current_thread().name}
+                if error != None:
+                    trace_entry["error"] = repr(error)
+                trace_entry.update(span.labels)
+                self.trace_file.write(json.dumps(trace_entry, default=str) + "\n")
+
+    def export_prometheus(self, metrics_file):
+        """ Write the counters and duration histograms in the Prometheus text format
+
+        Arguments:
+            self - self - This object
+            metrics_file - filename - The file to write
+        """
+
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric_name = "{0}_{1}_total".format(METRIC_PREFIX, name)
+                lines.append("# TYPE {} counter".format(metric_name))
+                lines.append("{0} {1}".format(metric_name, value))
+
+            if len(self.histograms) > 0:
+                metric_name = "{}_stage_duration_seconds".format(METRIC_PREFIX)
+                lines.append("# TYPE {} histogram".format(metric_name))
+                for name, histogram in sorted(self.histograms.items()):
+                    for bucket, bucket_count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                        lines.append("{0}_bucket{{stage=\"{1}\",le=\"{2}\"}} {3}".format(metric_name, name, bucket, bucket_count))
+                    lines.append("{0}_bucket{{stage=\"{1}\",le=\"+Inf\"}} {2}".format(metric_name, name, histogram["count"]))
+                    lines.append("{0}_sum{{stage=\"{1}\"}} {2}".format(metric_name, name, histogram["sum"]))
+                    lines.append("{0}_count{{stage=\"{1}\"}} {2}".format(metric_name, name, histogram["count"]))
+
+                metric_name = "{}_stage_errors_total".format(METRIC_PREFIX)
+                lines.append("# TYPE {} counter".format(metric_name))
+                for name, histogram in sorted(self.histograms.items()):
+                    lines.append("{0}{{stage=\"{1}\"}} {2}".format(metric_name, name, histogram["errors"]))
+
+        with open(metrics_file, "w") as open_metrics_file:
+            open_metrics_file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        """ Write the counters to the trace, export the Prometheus metrics and close the trace
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.enabled == False or self.output_directory == None:
+            return
+
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                self.trace_file.write(json.dumps({"type": "counter", "name": name, "value": value}) + "\n")
+            self.trace_file.close()
+
+        self.export_prometheus(os.path.join(self.output_directory, "metrics.prom"))
+
+class Profiler(object):
+    """ Profile every thread with its own cProfile profiler
+
+    Threads started after start() is called are profiled from their first call, through threading.setprofile(). On Python versions where only one profiler can be active at a time, the main thread's profiler covers every thread instead.
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Start profiling this thread and every thread started from now on
+        start_thread() - Start profiling a new thread
+        stop() - Stop profiling and write each thread's stats
+    """
+
+    def __init__(self, output_directory):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            output_directory - string - Directory to write a .prof file for each thread to
+        """
+
+        self.output_directory = output_directory
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ Start profiling this thread and every thread started from now on
+
+        Arguments:
+            self - self - This object
+        """
+
+        os.makedirs(self.output_directory, exist_ok=True)
+        threading.setprofile(self.start_thread)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        self.profiles["{0}-{1}".format(threading.current_thread().name, threading.get_ident())] = profile
+
+    def start_thread(self, frame, event, arg):
+        """ Replace the thread's profile hook with a profiler of its own, on the thread's first call
+
+        Arguments:
+            self - self - This object
+            frame - frame - The current frame
+            event - string - The profiling event
+            arg - any - The event's argument
+        """
+
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return
+
+        with self.lock:
+            self.profiles["{0}-{1}".format(threading.current_thread().name, threading.get_ident())] = profile
+
+    def stop(self):
+        """ Stop profiling and write each thread's stats to its own file, for reading with pstats or snakeviz
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            profile_files - list of filenames - The files written
+        """
+
+        threading.setprofile(None)
+
+        # Stop this thread's profiler first, as the others are stopped from this thread
+        self.profiles["{0}-{1}".format(threading.current_thread().name, threading.get_ident())].disable()
+
+        profile_files = []
+        with self.lock:
+            for thread_name, profile in sorted(self.profiles.items()):
+                profile_file = os.path.join(self.output_directory, "{}.prof".format(thread_name.replace(os.sep, "_").replace(" ", "_")))
+                profile.dump_stats(profile_file)
+                profile_files.append(profile_file)
+
+        return profile_files
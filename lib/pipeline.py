@@ -0,0 +1,191 @@
+# lib/pipeline.py
+# Chain worker pools into a staged pipeline
+
+import threading
+from lib import scheduler
+
+class Pipeline(object):
+    """ Run jobs through a sequence of stages, each with its own worker pool
+
+    The return value of each stage is passed as the arguments of the next stage. Stages are joined by the bounded queues of their worker pools, so a fast stage blocks once the stage after it falls behind rather than piling up work in memory.
+
+    A stage can also be batched, in which case jobs are grouped before being handed to it. A batched stage function takes a list of argument tuples and returns a list with a result, or an exception, for each of them.
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Start the worker pools of all stages
+        submit() - Add a job to the first stage
+        join() - Wait for all jobs to pass through every stage
+        forward() - Hand a job to a stage
+        flush() - Hand a batched stage its last, partial batch
+        run_stage() - Run one stage of a job and forward its result
+        run_batch() - Run one batch of a batched stage and forward its results
+    """
+
+    def __init__(self, stages):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            stages - list of tuples - Stage name/function/worker count tuples, in order, with an optional batch size as a fourth item
+        """
+
+        if len(stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+
+        self.stage_functions = []
+        self.worker_pools = []
+        self.batch_sizes = []
+        for stage in stages:
+            stage_name, stage_function, worker_count = stage[:3]
+            self.stage_functions.append(stage_function)
+            self.worker_pools.append(scheduler.WorkerPool(worker_count, name=stage_name))
+            self.batch_sizes.append(stage[3] if len(stage) > 3 else 1)
+
+        # Jobs waiting to fill a batch, for each stage
+        self.pending_batches = [[] for stage in stages]
+        self.batch_count = 0
+        self.batch_lock = threading.Lock()
+
+        # Results and errors of jobs that went through batched stages, keyed by job ID
+        self.batch_results = {}
+        self.batch_errors = {}
+
+    def start(self):
+        """ Start the worker pools of all stages
+
+        Arguments:
+            self - self - This object
+        """
+
+        for worker_pool in self.worker_pools:
+            worker_pool.start()
+
+    def submit(self, job_id, *args):
+        """ Add a job to the first stage, blocking while its queue is full
+
+        Arguments:
+            self - self - This object
+            job_id - hashable - ID used to report the job's result or error
+            args - any - Arguments passed to the first stage
+        """
+
+        self.forward(0, job_id, args)
+
+    def join(self):
+        """ Wait for all jobs to pass through every stage and stop the workers
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            results - dict - Return values of the last stage, keyed by job ID
+            errors - dict - Exceptions raised in any stage, keyed by job ID
+        """
+
+        # Join the stages in order, since a stage only stops receiving work once the stage before it has finished
+        errors = {}
+        for stage_number in range(len(self.worker_pools)):
+            self.flush(stage_number)
+            results, stage_errors = self.worker_pools[stage_number].join()
+            errors.update(stage_errors)
+
+        # Only the last stage's return values are final results
+        if self.batch_sizes[-1] > 1:
+            results = self.batch_results
+        errors.update(self.batch_errors)
+
+        return results, errors
+
+    def forward(self, stage_number, job_id, args):
+        """ Hand a job to a stage, adding it to the stage's current batch if the stage is batched
+
+        Arguments:
+            self - self - This object
+            stage_number - int - Position of the stage in the pipeline
+            job_id - hashable - ID of the job
+            args - tuple - Arguments for the stage function
+        """
+
+        if self.batch_sizes[stage_number] == 1:
+            self.worker_pools[stage_number].submit(job_id, self.run_stage, stage_number, job_id, args)
+            return
+
+        # Collect jobs until there are enough for a batch
+        with self.batch_lock:
+            self.pending_batches[stage_number].append((job_id, args))
+            if len(self.pending_batches[stage_number]) < self.batch_sizes[stage_number]:
+                return
+
+            batch = self.pending_batches[stage_number]
+            self.pending_batches[stage_number] = []
+            self.batch_count += 1
+            batch_id = ("batch", self.batch_count)
+
+        self.worker_pools[stage_number].submit(batch_id, self.run_batch, stage_number, batch)
+
+    def flush(self, stage_number):
+        """ Hand a batched stage whatever jobs are still waiting for a batch to fill
+
+        Arguments:
+            self - self - This object
+            stage_number - int - Position of the stage in the pipeline
+        """
+
+        with self.batch_lock:
+            batch = self.pending_batches[stage_number]
+            self.pending_batches[stage_number] = []
+            self.batch_count += 1
+            batch_id = ("batch", self.batch_count)
+
+        if len(batch) > 0:
+            self.worker_pools[stage_number].submit(batch_id, self.run_batch, stage_number, batch)
+
+    def run_stage(self, stage_number, job_id, args):
+        """ Run one stage of a job and hand its result to the next stage
+
+        Arguments:
+            self - self - This object
+            stage_number - int - Position of the stage in the pipeline
+            job_id - hashable - ID of the job
+            args - tuple - Arguments for the stage function
+
+        Returns:
+            result - any - The stage's return value if it is the last stage, otherwise None
+        """
+
+        result = self.stage_functions[stage_number](*args)
+
+        # The last stage's result is the result of the job
+        if stage_number == len(self.stage_functions) - 1:
+            return result
+
+        # Otherwise forward it, blocking until the next stage has room
+        self.forward(stage_number + 1, job_id, result)
+
+    def run_batch(self, stage_number, batch):
+        """ Run one batch of a batched stage and hand each job's result to the next stage
+
+        Arguments:
+            self - self - This object
+            stage_number - int - Position of the stage in the pipeline
+            batch - list of tuples - Job ID/arguments tuples
+        """
+
+        # If the whole batch fails, every job in it has failed
+        try:
+            batch_results = self.stage_functions[stage_number]([args for job_id, args in batch])
+        except Exception as err_msg:
+            batch_results = [err_msg] * len(batch)
+
+        for (job_id, args), result in zip(batch, batch_results):
+            if isinstance(result, Exception) == True:
+                with self.batch_lock:
+                    self.batch_errors[job_id] = result
+
+            elif stage_number == len(self.stage_functions) - 1:
+                with self.batch_lock:
+                    self.batch_results[job_id] = result
+
+            else:
+                self.forward(stage_number + 1, job_id, result)
@@ -0,0 +1,298 @@
+# lib/progress.py
+# One progress line for every download running at once
+
+import sys
+import time
+import threading
+
+class ProgressOutput(object):
+    """ Stand in for standard output while the progress line is shown, so other messages don't run into it
+
+    Methods:
+        __init__() - Initialize the object
+        write() - Write text around the progress line
+        flush() - Flush the real output
+    """
+
+    def __init__(self, progress_aggregator, output):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            progress_aggregator - ProgressAggregator object - The aggregator drawing the progress line
+            output - file object - The real standard output
+        """
+
+        self.progress_aggregator = progress_aggregator
+        self.output = output
+
+    def write(self, text):
+        """ Write text around the progress line
+
+        Arguments:
+            self - self - This object
+            text - string - The text to write
+
+        Returns:
+            written - int - Number of characters written
+        """
+
+        return self.progress_aggregator.write(text)
+
+    def flush(self):
+        """ Flush the real output
+
+        Arguments:
+            self - self - This object
+        """
+
+        self.output.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
+
+class ProgressAggregator(object):
+    """ Collect byte counts from every download and render them as a single progress line at a fixed rate
+
+    Downloads report their progress with a single dictionary store and no locking, so reporting costs next to nothing however often chunks arrive. A background thread adds the counts up and redraws the line, showing the overall rate, the number of active downloads and an estimate of the time left for them. Nothing is rendered if disabled or if the output isn't a terminal. While rendering to standard output, it is replaced by a ProgressOutput, so messages printed by the workers clear the line first and it is drawn again under them. A download that stops reporting for longer than the idle timeout is retired, and re-attached if it reports again, so its bytes are only counted once.
+
+    Methods:
+        __init__() - Initialize the object
+        on_progress() - Report progress in the form of pytube's progress callback
+        update() - Report the progress of a download
+        start() - Start rendering
+        stop() - Stop rendering and clear the line
+        write() - Write text around the progress line
+        render() - Redraw the progress line until stopped
+        draw() - Draw the progress line
+        get_status() - Add up the progress of every download
+    """
+
+    def __init__(self, enabled=True, refresh_interval=0.5, output=None, idle_timeout=30.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            enabled - bool - Render progress at all
+            refresh_interval - float - Seconds between redraws
+            output - file object or None - Where to render, defaulting to standard output
+            idle_timeout - float - Seconds without progress after which a download is treated as abandoned
+        """
+
+        if output == None:
+            output = sys.stdout
+
+        self.output = output
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout
+
+        # Only render to a terminal, since a redrawn line is just noise in a log file
+        self.enabled = enabled == True and hasattr(output, "isatty") == True and output.isatty() == True
+
+        # Size/bytes done/last update tuples of downloads in progress, keyed by download
+        self.jobs = {}
+
+        # Totals of finished downloads, only touched by the rendering thread
+        self.finished_count = 0
+        self.finished_bytes = 0
+
+        # Bytes counted for downloads retired while idle, keyed by download, so one that resumes can be re-attached
+        self.retired_jobs = {}
+
+        # Rate smoothing
+        self.last_sample_time = None
+        self.last_sample_bytes = 0
+        self.rate = 0.0
+
+        self.stop_event = threading.Event()
+        self.render_thread = None
+
+        # The progress line, whether it is on screen, and whether the output is at the start of a line so it can be drawn
+        self.line = None
+        self.line_drawn = False
+        self.at_line_start = True
+        self.output_lock = threading.Lock()
+
+        # Standard output, while it is replaced by a ProgressOutput
+        self.replaced_stdout = None
+
+    def on_progress(self, stream, chunk, bytes_remaining):
+        """ Report progress in the form of pytube's on_progress_callback, so it can be passed to YouTube objects
+
+        Arguments:
+            self - self - This object
+            stream - Stream object - The stream being downloaded
+            chunk - bytes - The chunk just downloaded
+            bytes_remaining - int - Bytes of the stream left to download
+        """
+
+        if self.enabled == True:
+            self.jobs[id(stream)] = (stream.filesize, stream.filesize - bytes_remaining, time.monotonic())
+
+    def update(self, job_key, total_bytes, bytes_done):
+        """ Report the progress of a download
+
+        Arguments:
+            self - self - This object
+            job_key - hashable - Identifies the download, such as its filename
+            total_bytes - int - Size of the download
+            bytes_done - int - Bytes downloaded so far
+        """
+
+        if self.enabled == True:
+            self.jobs[job_key] = (total_bytes, bytes_done, time.monotonic())
+
+    def start(self):
+        """ Start rendering on a background thread, if enabled
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.enabled == False:
+            return
+
+        # Route prints from the workers around the progress line
+        if self.output is sys.stdout:
+            self.replaced_stdout = sys.stdout
+            sys.stdout = ProgressOutput(self, self.output)
+
+        self.stop_event.clear()
+        self.render_thread = threading.Thread(target=self.render, name="progress", daemon=True)
+        self.render_thread.start()
+
+    def stop(self):
+        """ Stop rendering and clear the progress line
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.render_thread == None:
+            return
+
+        self.stop_event.set()
+        self.render_thread.join()
+        self.render_thread = None
+
+        with self.output_lock:
+            if self.line_drawn == True:
+                self.output.write("\r\x1b[K")
+                self.output.flush()
+            self.line = None
+            self.line_drawn = False
+
+        if self.replaced_stdout != None:
+            sys.stdout = self.replaced_stdout
+            self.replaced_stdout = None
+
+    def write(self, text):
+        """ Write text to the output, clearing the progress line first and drawing it again once the text ends a line
+
+        Arguments:
+            self - self - This object
+            text - string - The text to write
+
+        Returns:
+            written - int - Number of characters written
+        """
+
+        with self.output_lock:
+            if self.line_drawn == True:
+                self.output.write("\r\x1b[K")
+                self.line_drawn = False
+
+            self.output.write(text)
+            if len(text) > 0:
+                self.at_line_start = text.endswith("\n")
+
+            # print() writes the end of the line separately, so the line is only drawn again once it has been written
+            if self.at_line_start == True and self.line != None:
+                self.output.write(self.line)
+                self.line_drawn = True
+            self.output.flush()
+
+        return len(text)
+
+    def render(self):
+        """ Redraw the progress line every refresh interval until stopped
+
+        Arguments:
+            self - self - This object
+        """
+
+        while self.stop_event.wait(self.refresh_interval) == False:
+            active_count, bytes_done, bytes_remaining = self.get_status()
+
+            # Smooth the rate, so the estimate doesn't jump around with every chunk
+            now = time.monotonic()
+            if self.last_sample_time != None:
+                sample_rate = (bytes_done - self.last_sample_bytes) / max(now - self.last_sample_time, 0.001)
+                self.rate = sample_rate if self.rate == 0.0 else self.rate * 0.7 + sample_rate * 0.3
+            self.last_sample_time = now
+            self.last_sample_bytes = bytes_done
+
+            if self.rate > 0 and bytes_remaining > 0:
+                seconds_left = int(bytes_remaining / self.rate)
+                eta = "{0}:{1:02d}".format(seconds_left // 60, seconds_left % 60)
+            else:
+                eta = "--:--"
+
+            self.draw("[>] {0} downloading, {1} downloaded | {2:.1f} MB at {3:.2f} MB/s | ETA {4}".format(active_count, self.finished_count, bytes_done / (1024 * 1024), self.rate / (1024 * 1024), eta))
+
+    def draw(self, line):
+        """ Draw the progress line, or keep it for later if another message is partway through a line
+
+        Arguments:
+            self - self - This object
+            line - string - The progress line
+        """
+
+        with self.output_lock:
+            self.line = line
+            if self.at_line_start == True:
+                self.output.write("\r\x1b[K" + line)
+                self.output.flush()
+                self.line_drawn = True
+
+    def get_status(self):
+        """ Add up the progress of every download, retiring finished and abandoned ones and re-attaching abandoned ones that resume
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            active_count - int - Number of downloads in progress
+            bytes_done - int - Bytes downloaded by every download so far
+            bytes_remaining - int - Bytes the downloads in progress have left
+        """
+
+        now = time.monotonic()
+        active_count = 0
+        bytes_done = self.finished_bytes
+        bytes_remaining = 0
+
+        # Copying the items is a single step under the GIL, so downloads can keep reporting meanwhile
+        for job_key, (total_bytes, job_bytes_done, last_update) in list(self.jobs.items()):
+            # A retired download that reported again resumed, so its bytes are taken back out of the finished total
+            if job_key in self.retired_jobs:
+                retired_bytes = self.retired_jobs.pop(job_key)
+                self.finished_bytes -= retired_bytes
+                bytes_done -= retired_bytes
+
+            if job_bytes_done >= total_bytes or now - last_update > self.idle_timeout:
+                # Finished, or idle and kept in case it resumes
+                self.jobs.pop(job_key, None)
+                self.finished_bytes += job_bytes_done
+                bytes_done += job_bytes_done
+                if job_bytes_done >= total_bytes:
+                    self.finished_count += 1
+                else:
+                    self.retired_jobs[job_key] = job_bytes_done
+                continue
+
+            active_count += 1
+            bytes_done += job_bytes_done
+            bytes_remaining += total_bytes - job_bytes_done
+
+        return active_count, bytes_done, bytes_remaining
@@ -0,0 +1,192 @@
+# lib/scheduler.py
+# Run queued jobs on a bounded pool of worker threads
+
+import heapq
+import queue
+import threading
+import collections
+from concurrent import futures
+
+class WorkerPool(object):
+    """ Run jobs on a fixed number of worker threads fed by a bounded queue
+
+    Submitting a job blocks while the queue is full, so the number of pending jobs, threads and child processes stays the same no matter how long the video queue is. The result or error of every job is collected centrally, keyed by job ID.
+
+    Methods:
+        __init__() - Initialize the object
+        start() - Start the worker threads
+        submit() - Add a job to the work queue
+        join() - Wait for all submitted jobs to finish
+        worker() - Worker thread loop
+    """
+
+    def __init__(self, worker_count, queue_size=None, name="worker"):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            worker_count - int - Number of worker threads
+            queue_size - int or None - Maximum number of pending jobs, defaults to twice the worker count
+            name - string - Prefix used for the worker thread names
+        """
+
+        if worker_count < 1:
+            raise ValueError("Worker count must be at least 1")
+
+        if queue_size == None:
+            queue_size = worker_count * 2
+
+        self.worker_count = worker_count
+        self.name = name
+        self.work_queue = queue.Queue(maxsize=queue_size)
+
+        # Results and errors of finished jobs, keyed by job ID
+        self.results = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+        self.threads = []
+
+    def start(self):
+        """ Start the worker threads
+
+        Arguments:
+            self - self - This object
+        """
+
+        for c in range(self.worker_count):
+            new_thread = threading.Thread(target=self.worker, name="{0}-{1}".format(self.name, c), daemon=True)
+            new_thread.start()
+            self.threads.append(new_thread)
+
+    def submit(self, job_id, function, *args):
+        """ Add a job to the work queue, blocking while the queue is full
+
+        Arguments:
+            self - self - This object
+            job_id - hashable - ID used to report the job's result or error
+            function - callable - The function to run
+            args - any - Arguments passed to the function
+        """
+
+        self.work_queue.put((job_id, function, args))
+
+    def join(self):
+        """ Wait for all submitted jobs to finish and stop the worker threads
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            results - dict - Return values of successful jobs, keyed by job ID
+            errors - dict - Exceptions raised by failed jobs, keyed by job ID
+        """
+
+        # Tell each worker to exit once the queue has been drained
+        for thread in self.threads:
+            self.work_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+        return self.results, self.errors
+
+    def worker(self):
+        """ Take jobs off the queue and run them until told to stop
+
+        Arguments:
+            self - self - This object
+        """
+
+        while True:
+            job = self.work_queue.get()
+
+            # A None job is the signal to exit
+            if job == None:
+                break
+
+            job_id, function, args = job
+            try:
+                result = function(*args)
+                with self.lock:
+                    self.results[job_id] = result
+
+            except Exception as err_msg:
+                with self.lock:
+                    self.errors[job_id] = err_msg
+
+def imap(function, items, worker_count):
+    """ Apply a function to each item on a pool of worker threads, yielding the outcomes in order as soon as they are ready
+
+    Items are only taken from the iterable as workers free up, so the items can come from a generator and the first outcome is available before the rest of the items are known.
+
+    Arguments:
+        function - callable - The function to apply to each item
+        items - iterable - The items to apply it to
+        worker_count - int - Number of worker threads
+
+    Returns:
+        outcomes - generator of tuples - An item/result/error tuple for each item, where result is None if the function raised an error and error is None if it didn't
+    """
+
+    # Keep a bounded number of items in flight, so memory use doesn't grow with the number of items
+    window_size = worker_count * 2
+
+    with futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        pending = collections.deque()
+
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+
+            # Hand back the oldest items that are already done, waiting on the oldest one if the window is full
+            while len(pending) > 0 and (pending[0][1].done() == True or len(pending) >= window_size):
+                yield get_outcome(*pending.popleft())
+
+        # Hand back whatever is left
+        while len(pending) > 0:
+            yield get_outcome(*pending.popleft())
+
+def get_outcome(item, future):
+    """ Wait for a future and split it into a result and an error
+
+    Arguments:
+        item - any - The item the future was submitted for
+        future - Future object - The future to wait for
+
+    Returns:
+        item - any - The item the future was submitted for
+        result - any or None - The return value, or None if there was an error
+        error - Exception or None - The exception raised, or None if there wasn't one
+    """
+
+    try:
+        return item, future.result(), None
+    except Exception as err_msg:
+        return item, None, err_msg
+
+def order_jobs(items, key, window=0):
+    """ Reorder items so that those with the smallest key come first, keeping the original order between equal keys
+
+    With a window, at most that many items are held back at once and the smallest of them is handed out whenever another arrives, so a long generator can be reordered without reading it all in and the first item is handed out early. Without one, every item is read before the first is handed out, which orders them exactly.
+
+    Arguments:
+        items - iterable - The items to reorder, which may be a generator
+        key - callable - Gives the sort key of an item, called once per item as it arrives
+        window - int - Number of items to hold back at once, or 0 to read every item first
+
+    Returns:
+        ordered_items - generator - The items in their new order
+    """
+
+    # The arrival count breaks ties, so equal keys keep their order and items themselves are never compared
+    heap = []
+    c = 0
+    for item in items:
+        heapq.heappush(heap, (key(item), c, item))
+        c += 1
+
+        if window > 0 and len(heap) > window:
+            yield heapq.heappop(heap)[2]
+
+    while len(heap) > 0:
+        yield heapq.heappop(heap)[2]
@@ -0,0 +1,274 @@
+# lib/segmented.py
+# Download a file over several connections at once, in resumable byte ranges
+
+import os
+import json
+import time
+import random
+import threading
+import urllib.request
+from lib import errors
+from lib import scheduler
+
+class SegmentedDownloader(object):
+    """ Download a file as a set of byte range segments fetched over several connections at once
+
+    Segments are written in place into a file preallocated to the full size. The segments completed so far are recorded in a state file next to the download, so a failed or interrupted download resumes from the segments it still needs rather than starting over. A segment that fails is retried after an exponential backoff with jitter, so a host that has just throttled or reset the connection isn't asked again straight away.
+
+    Methods:
+        __init__() - Initialize the object
+        download() - Download a URL to a file
+        get_size() - Get the size of the file at a URL
+        open_url() - Make a request
+        load_state() - Load the list of completed segments
+        save_state() - Record the list of completed segments
+        fetch_segment() - Download one segment into the file
+        get_backoff_delay() - Get how long to wait before retrying a segment
+    """
+
+    def __init__(self, segment_size=1024 * 1024, connection_count=4, max_retries=3, timeout=30, transport=None, base_delay=0.5, max_delay=30.0):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            segment_size - int - Size of each segment in bytes
+            connection_count - int - Number of segments to download at once
+            max_retries - int - Number of times to retry a failed segment before giving up
+            timeout - int - Socket timeout in seconds
+            transport - Transport object or None - Shared transport to make requests through, instead of urllib
+            base_delay - float - Backoff delay of the first retry of a segment, in seconds
+            max_delay - float - Longest backoff delay, in seconds
+        """
+
+        self.segment_size = segment_size
+        self.connection_count = connection_count
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.transport = transport
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def download(self, url, file_name, total_size=None, on_progress=None):
+        """ Download a URL to a file, resuming from an earlier attempt if one was left behind
+
+        Arguments:
+            self - self - This object
+            url - string - The URL to download, which must support range requests
+            file_name - filename - The file to download to
+            total_size - int or None - Size of the file, looked up with a HEAD request if not given
+            on_progress - callable or None - Called with the filename, the size and the bytes downloaded so far after each chunk
+
+        Returns:
+            downloaded_file - filename - The name of the downloaded file
+        """
+
+        if total_size == None:
+            total_size = self.get_size(url)
+
+        state_file = file_name + ".segments"
+        segment_count = (total_size + self.segment_size - 1) // self.segment_size
+
+        # Pick up where an earlier attempt left off, or start afresh with a preallocated file
+        completed_segments = self.load_state(state_file, file_name, total_size)
+        if completed_segments == None:
+            completed_segments = set()
+            with open(file_name, "wb") as open_file:
+                open_file.truncate(total_size)
+            self.save_state(state_file, total_size, completed_segments)
+
+        # All connections write into the one file, so seeking and writing is serialized with a lock
+        file_lock = threading.Lock()
+        segment_errors = []
+
+        # Bytes written so far, counting segments finished by earlier attempts
+        progress = [min(len(completed_segments) * self.segment_size, total_size), on_progress]
+
+        with open(file_name, "r+b") as open_file:
+            pending_segments = [c for c in range(segment_count) if c not in completed_segments]
+            fetch = lambda segment_number: self.fetch_segment(url, open_file, file_lock, segment_number, total_size, progress)
+
+            for segment_number, result, err_msg in scheduler.imap(fetch, pending_segments, self.connection_count):
+                if err_msg != None:
+                    segment_errors.append(err_msg)
+                    continue
+
+                # Record each finished segment once its data has reached the file, so a retry doesn't fetch it again
+                with file_lock:
+                    open_file.flush()
+                completed_segments.add(segment_number)
+                self.save_state(state_file, total_size, completed_segments)
+
+        # Leave the partial file and state behind for the next attempt to resume from
+        if len(segment_errors) > 0:
+            message = "{0} of {1} segments failed to download: {2}".format(len(segment_errors), segment_count, segment_errors[0])
+
+            # Keep the class of the first error, so callers can tell throttling from other failures
+            download_error = errors.classify_error(segment_errors[0])
+            if isinstance(download_error, errors.DownloadError) == True:
+                raise download_error.__class__(message)
+            raise Exception(message)
+
+        os.remove(state_file)
+
+        downloaded_file = file_name
+        return downloaded_file
+
+    def get_size(self, url):
+        """ Get the size of the file at a URL
+
+        Arguments:
+            self - self - This object
+            url - string - The URL of the file
+
+        Returns:
+            total_size - int - Size of the file in bytes
+        """
+
+        with self.open_url(url, "HEAD") as response:
+            return int(response.headers["Content-Length"])
+
+    def open_url(self, url, method, headers=None):
+        """ Make a request through the shared transport if there is one, otherwise through urllib
+
+        Arguments:
+            self - self - This object
+            url - string - The URL to request
+            method - string - The HTTP method
+            headers - dict or None - Request headers
+
+        Returns:
+            response - response object - The response, usable as a context manager
+        """
+
+        if headers == None:
+            headers = {}
+
+        if self.transport != None:
+            return self.transport.request(method, url, headers)
+
+        url_request = urllib.request.Request(url, headers=headers, method=method)
+        return urllib.request.urlopen(url_request, timeout=self.timeout)
+
+    def load_state(self, state_file, file_name, total_size):
+        """ Load the list of completed segments left by an earlier attempt
+
+        Arguments:
+            self - self - This object
+            state_file - filename - The state file of the download
+            file_name - filename - The file being downloaded
+            total_size - int - Size of the file
+
+        Returns:
+            completed_segments - set of ints or None - Numbers of the completed segments, or None if there is nothing to resume
+        """
+
+        if os.path.isfile(state_file) == False or os.path.isfile(file_name) == False:
+            return None
+
+        with open(state_file) as open_state_file:
+            try:
+                state = json.load(open_state_file)
+            except ValueError:
+                return None
+
+        # Segments can only be reused if the file and segment layout are unchanged
+        if state["size"] != total_size or state["segment_size"] != self.segment_size or os.path.getsize(file_name) != total_size:
+            return None
+
+        return set(state["completed"])
+
+    def save_state(self, state_file, total_size, completed_segments):
+        """ Record the list of completed segments, replacing the old state file atomically
+
+        Arguments:
+            self - self - This object
+            state_file - filename - The state file of the download
+            total_size - int - Size of the file
+            completed_segments - set of ints - Numbers of the completed segments
+        """
+
+        state = {
+            "size": total_size,
+            "segment_size": self.segment_size,
+            "completed": sorted(completed_segments)
+        }
+
+        with open(state_file + ".temp", "w") as open_state_file:
+            json.dump(state, open_state_file)
+        os.replace(state_file + ".temp", state_file)
+
+    def fetch_segment(self, url, open_file, file_lock, segment_number, total_size, progress=None):
+        """ Download one segment and write it into place, retrying if the connection drops
+
+        Arguments:
+            self - self - This object
+            url - string - The URL being downloaded
+            open_file - file object - The preallocated file, opened for writing
+            file_lock - Lock object - Lock serializing writes to the file
+            segment_number - int - Number of the segment to download
+            total_size - int - Size of the file
+            progress - list or None - Bytes written so far and the progress callback, shared by every segment of the file
+
+        Returns:
+            segment_size - int - Number of bytes written
+        """
+
+        start = segment_number * self.segment_size
+        end = min(start + self.segment_size, total_size) - 1
+
+        attempt = 0
+        while True:
+            # Bytes of this attempt counted towards the progress, which are taken back off if it fails
+            attempt_bytes = 0
+
+            try:
+                with self.open_url(url, "GET", {"Range": "bytes={0}-{1}".format(start, end)}) as response:
+                    # A server that ignores the range would send the whole file
+                    if response.status != 206 and not (response.status == 200 and start == 0 and end == total_size - 1):
+                        raise Exception("Server does not support range requests (HTTP {})".format(response.status))
+
+                    # Write the segment into place a chunk at a time
+                    position = start
+                    while position <= end:
+                        chunk = response.read(min(64 * 1024, end - position + 1))
+                        if len(chunk) == 0:
+                            raise Exception("Connection closed {0} bytes into segment {1}".format(position - start, segment_number))
+
+                        with file_lock:
+                            open_file.seek(position)
+                            open_file.write(chunk)
+                            if progress != None:
+                                progress[0] += len(chunk)
+                                bytes_done = progress[0]
+                        position += len(chunk)
+                        attempt_bytes += len(chunk)
+
+                        if progress != None and progress[1] != None:
+                            progress[1](open_file.name, total_size, bytes_done)
+
+                return end - start + 1
+
+            except Exception:
+                # The retry writes the whole segment again, so don't count these bytes twice
+                if progress != None and attempt_bytes > 0:
+                    with file_lock:
+                        progress[0] -= attempt_bytes
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+                time.sleep(self.get_backoff_delay(attempt - 1))
+
+    def get_backoff_delay(self, attempt):
+        """ Get how long to wait before retrying a segment, using exponential backoff with full jitter
+
+        Arguments:
+            self - self - This object
+            attempt - int - Number of retries made so far
+
+        Returns:
+            delay - float - Delay in seconds
+        """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
@@ -1,48 +1,92 @@
 # lib/tag_editor.py
 # Edit tags of downloaded MP3 files
 
-import eyed3
+from lib import metrics
 
 class Editor(object):
   """ Edit tags of downloaded MP3 files
 
   Methods:
     __init__() - Initialize the object
-    insert_metadata() - Adds provided thumbnail and tags to an MP3 file
+    insert_metadata() - Adds provided thumbnail, tags and ReplayGain values to an MP3 file
+    write_tags() - Writes the thumbnail, tags and ReplayGain values with eyeD3
   """
 
-  def __init__(self, verbosity):
+  def __init__(self, verbosity, artwork_cache=None, recorder=None):
     """ Initialize the object
 
     Arguments:
       self - self - This object
       verbosity - bool - Verbose output
+      artwork_cache - ArtworkCache object or None - Shared cache of processed cover images
+      recorder - Recorder object or None - Records timing spans and counters, if set
     """
 
+    if recorder == None:
+      recorder = metrics.Recorder(enabled=False)
+
     self.verbosity = verbosity
+    self.artwork_cache = artwork_cache
+    self.recorder = recorder
 
-  def insert_metadata(self, mp3_file, metadata):
-    """ Adds thumbnail and tag information to an MP3 file
+  def insert_metadata(self, mp3_file, metadata, replaygain=None):
+    """ Adds thumbnail and tag information to an MP3 file, along with ReplayGain values if they were measured
     
     Arguments:
       self - self - This object
       mp3_file - filename - The file to add the metadata to
-      metadata - dict - The metadata to add
+      metadata - dict or None - The metadata to add, or None to keep the file's existing tags
+      replaygain - dict or None - Track gain in dB and peak to add as ReplayGain tags
 
     Returns:
       tagged_mp3_file - filename - Name of the tagged MP3 file
     """
 
-    # Load the file and initialize the tags
+    with self.recorder.span("insert_metadata", file=mp3_file):
+      return self.write_tags(mp3_file, metadata, replaygain)
+
+  def write_tags(self, mp3_file, metadata, replaygain=None):
+    """ Write thumbnail, tag and ReplayGain information to an MP3 file with eyeD3
+
+    Arguments:
+      self - self - This object
+      mp3_file - filename - The file to add the metadata to
+      metadata - dict or None - The metadata to add, or None to keep the file's existing tags
+      replaygain - dict or None - Track gain in dB and peak to add as ReplayGain tags
+
+    Returns:
+      tagged_mp3_file - filename - Name of the tagged MP3 file
+    """
+
+    # eyeD3 is slow to import, so it is only loaded once there is something to tag
+    import eyed3
+
+    # Load the file and initialize the tags, keeping any that ffmpeg wrote while encoding if there is no metadata to replace them
     open_mp3_file = eyed3.load(mp3_file)
-    open_mp3_file.initTag(version=(2, 3, 0))
+    if metadata != None or open_mp3_file.tag == None:
+      open_mp3_file.initTag(version=(2, 3, 0))
 
-    # If a thumbnail is present, open and read it as binary and set it
-    if metadata["thumbnail"] != None:
-      with open(metadata["thumbnail"], "rb") as thumbnail_file:
-        raw_thumbnail = thumbnail_file.read()
+    # Add the ReplayGain values as the TXXX frames players look for
+    if replaygain != None:
+      open_mp3_file.tag.user_text_frames.set("{:.2f} dB".format(replaygain["track_gain"]), "REPLAYGAIN_TRACK_GAIN")
+      open_mp3_file.tag.user_text_frames.set("{:.6f}".format(replaygain["track_peak"]), "REPLAYGAIN_TRACK_PEAK")
+
+    # Save now if there is no metadata
+    if metadata == None:
+      open_mp3_file.tag.save()
+      tagged_mp3_file = mp3_file
+      return tagged_mp3_file
 
-      open_mp3_file.tag.images.set(3, raw_thumbnail, "image/jpeg", "cover")
+    # If a thumbnail is present, take it from the artwork cache or open and read it as binary, and set it
+    if metadata["thumbnail"] != None:
+      if self.artwork_cache != None:
+        raw_thumbnail, mime_type, content_hash = self.artwork_cache.get(metadata["thumbnail"])
+      else:
+        with open(metadata["thumbnail"], "rb") as thumbnail_file:
+          raw_thumbnail = thumbnail_file.read()
+        mime_type = "image/jpeg"
+
+      open_mp3_file.tag.images.set(3, raw_thumbnail, mime_type, "cover")
 
     # See if any other tags are present in the metadata dictionary and set the ones that are
     if metadata["title"] != None:
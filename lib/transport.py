@@ -0,0 +1,498 @@
+# lib/transport.py
+# Shared HTTP transport with keep-alive connection pooling and bandwidth limiting
+
+import json
+import time
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+
+# Headers pytube sends with every request
+BASE_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+# The range pytube asks for when it only wants a stream's size from the response headers
+SIZE_RANGE = "0-99999999999"
+
+# Most stream sizes to keep waiting for pytube to ask for them
+MAX_STREAM_SIZES = 1000
+
+class TokenBucket(object):
+    """ Limit the rate at which bytes are transferred, shared by all threads
+
+    Methods:
+        __init__() - Initialize the object
+        reserve() - Take tokens for a number of bytes without waiting
+        consume() - Wait until a number of bytes may be transferred
+    """
+
+    def __init__(self, rate, burst=None):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            rate - int - Maximum rate in bytes per second
+            burst - int or None - Number of bytes that may be transferred at once after a pause, defaults to one second's worth
+        """
+
+        if burst == None:
+            burst = rate
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, byte_count):
+        """ Take tokens for a number of bytes without waiting, so callers that can't block, such as coroutines, can wait in their own way
+
+        Arguments:
+            self - self - This object
+            byte_count - int - Number of bytes about to be transferred
+
+        Returns:
+            wait_time - float - Seconds to wait before transferring them
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            # Take the tokens even if that puts the bucket in debt, then wait for the debt to be paid off
+            self.tokens -= byte_count
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        return wait_time
+
+    def consume(self, byte_count):
+        """ Take tokens for a number of bytes, sleeping for as long as the bucket is in debt
+
+        Arguments:
+            self - self - This object
+            byte_count - int - Number of bytes about to be transferred
+        """
+
+        wait_time = self.reserve(byte_count)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class TransportResponse(object):
+    """ A response from the transport, which hands its connection back to the pool once the body has been read or it is closed
+
+    Methods:
+        __init__() - Initialize the object
+        read() - Read from the body of the response
+        info() - Get the response headers
+        getheader() - Get a single response header
+        close() - Release the connection
+    """
+
+    def __init__(self, transport, pool_key, connection, response, url):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            transport - Transport object - The transport the response came from
+            pool_key - tuple - Scheme/host/port tuple of the connection pool
+            connection - HTTPConnection object - The connection the response arrived on
+            response - HTTPResponse object - The underlying response
+            url - string - The URL that was requested
+        """
+
+        self.transport = transport
+        self.pool_key = pool_key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self.released = False
+
+    def read(self, amt=None):
+        """ Read from the body of the response, within the bandwidth limit
+
+        Arguments:
+            self - self - This object
+            amt - int or None - Maximum number of bytes to read, or None to read everything
+
+        Returns:
+            data - bytes - The data read, which is empty once the body is exhausted
+        """
+
+        if self.released == True:
+            return b""
+
+        # A connection that failed part way through a body can't carry another request, so give up its slot before raising
+        try:
+            data = self.response.read(amt)
+        except Exception:
+            self.close()
+            raise
+
+        if self.transport.token_bucket != None and len(data) > 0:
+            self.transport.token_bucket.consume(len(data))
+
+        # Once the whole body has been read, the connection can be reused
+        if amt == None or len(data) == 0 or self.response.isclosed() == True:
+            self.close()
+
+        return data
+
+    def info(self):
+        """ Get the response headers, as urllib responses do
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            headers - HTTPMessage object - The response headers
+        """
+
+        return self.headers
+
+    def getheader(self, name, default=None):
+        """ Get a single response header
+
+        Arguments:
+            self - self - This object
+            name - string - Name of the header
+            default - any - Value to return if the header is missing
+
+        Returns:
+            value - string or any - Value of the header
+        """
+
+        return self.response.getheader(name, default)
+
+    def close(self):
+        """ Release the connection, returning it to the pool if the body was read to the end
+
+        Arguments:
+            self - self - This object
+        """
+
+        if self.released == True:
+            return
+        self.released = True
+
+        reusable = self.response.isclosed() == True and self.response.will_close == False
+        self.transport.release(self.pool_key, self.connection, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Transport(object):
+    """ One HTTP client shared by every thread, used for both metadata and media requests
+
+    Connections are kept alive and reused between requests to the same host, no more than max_connections_per_host connections are open to each host at once, and the bytes read by every thread are limited by one shared token bucket. A request waits for as long as it takes for one of the host's connections to come free, so every response must be read to the end or closed.
+
+    Methods:
+        __init__() - Initialize the object
+        request() - Make an HTTP request
+        execute_request() - Make a request the way pytube's request module does
+        get_stream_size_response() - Get the response pytube reads a stream's size from
+        install() - Route pytube's requests through this transport
+        acquire() - Take a connection from the pool
+        release() - Return a connection to the pool
+        stats() - Get connection reuse counts
+    """
+
+    def __init__(self, max_connections_per_host=8, max_rate=None, timeout=30):
+        """ Initialize the object
+
+        Arguments:
+            self - self - This object
+            max_connections_per_host - int - Maximum number of connections open to each host at once
+            max_rate - int or None - Maximum total download rate in bytes per second, or None for no limit
+            timeout - int - Socket timeout in seconds
+        """
+
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+
+        self.token_bucket = None
+        if max_rate != None:
+            self.token_bucket = TokenBucket(max_rate)
+
+        # Idle connections, connection slots and the number of open connections, keyed by scheme/host/port
+        self.idle_connections = {}
+        self.host_slots = {}
+        self.open_connections = {}
+        self.lock = threading.Lock()
+
+        # Headers of streams' whole range, looked up before pytube asks for them, keyed by the stream URL
+        self.stream_sizes = {}
+
+        # Counts for working out how often connections are reused
+        self.request_count = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.peak_connections = 0
+
+    def request(self, method, url, headers=None, data=None, redirect_limit=5):
+        """ Make an HTTP request, following redirects
+
+        Arguments:
+            self - self - This object
+            method - string - The HTTP method
+            url - string - The URL to request
+            headers - dict or None - Extra request headers
+            data - bytes or None - The request body
+            redirect_limit - int - Maximum number of redirects to follow
+
+        Returns:
+            response - TransportResponse object - The response, which must be read to the end or closed
+        """
+
+        request_headers = dict(BASE_HEADERS)
+        if headers != None:
+            request_headers.update(headers)
+
+        for c in range(redirect_limit + 1):
+            parsed_url = urllib.parse.urlsplit(url)
+            if parsed_url.scheme not in ("http", "https"):
+                raise ValueError("Invalid URL: {}".format(url))
+
+            default_port = 443 if parsed_url.scheme == "https" else 80
+            pool_key = (parsed_url.scheme, parsed_url.hostname, parsed_url.port or default_port)
+            path = parsed_url.path or "/"
+            if parsed_url.query != "":
+                path += "?" + parsed_url.query
+
+            connection, reused = self.acquire(pool_key)
+            try:
+                connection.request(method, path, body=data, headers=request_headers)
+                response = connection.getresponse()
+
+            # A kept-alive connection may have been closed by the server while idle, so retry once on a fresh one
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.release(pool_key, connection, False)
+                if reused == False:
+                    raise
+                connection, reused = self.acquire(pool_key, fresh=True)
+                try:
+                    connection.request(method, path, body=data, headers=request_headers)
+                    response = connection.getresponse()
+                except Exception:
+                    self.release(pool_key, connection, False)
+                    raise
+
+            except Exception:
+                self.release(pool_key, connection, False)
+                raise
+
+            transport_response = TransportResponse(self, pool_key, connection, response, url)
+
+            # Follow redirects, as urllib does
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location") != None:
+                transport_response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                if response.status == 303:
+                    method = "GET"
+                    data = None
+                continue
+
+            # Raise errors the same way urllib does, so callers can handle them as before
+            if response.status >= 400:
+                transport_response.read()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+            # A HEAD response has no body, so its connection is free straight away
+            if method == "HEAD":
+                transport_response.close()
+
+            return transport_response
+
+        raise urllib.error.HTTPError(url, response.status, "Too many redirects", response.headers, None)
+
+    def execute_request(self, url, method=None, headers=None, data=None, timeout=None):
+        """ Make a request with the same signature as pytube's request._execute_request
+
+        Arguments:
+            self - self - This object
+            url - string - The URL to request
+            method - string or None - The HTTP method, defaulting to GET
+            headers - dict or None - Extra request headers
+            data - bytes or dict or None - The request body
+            timeout - any - Ignored, the transport's own timeout is used
+
+        Returns:
+            response - TransportResponse object - The response
+        """
+
+        if method == None:
+            method = "GET"
+
+        # pytube sends innertube request bodies as dicts, which go over the wire as JSON
+        if data != None and isinstance(data, bytes) == False:
+            data = json.dumps(data).encode("utf-8")
+
+        # pytube asks for a stream's size with a GET for its whole range, while still holding the unread response for its first range, and then drops it without reading or closing it
+        if method == "GET" and data == None:
+            stream_url, stream_range = split_range_parameter(url)
+            if stream_range == SIZE_RANGE:
+                return self.get_stream_size_response(stream_url, headers)
+
+            # So look the size up before the first range is requested, while no connection is held
+            if stream_range != None and stream_range.startswith("0-") == True:
+                try:
+                    size_response = self.request("HEAD", "{0}&range={1}".format(stream_url, SIZE_RANGE), headers)
+                except urllib.error.HTTPError:
+                    size_response = None
+
+                if size_response != None:
+                    with self.lock:
+                        self.stream_sizes[stream_url] = size_response
+                        if len(self.stream_sizes) > MAX_STREAM_SIZES:
+                            del self.stream_sizes[next(iter(self.stream_sizes))]
+
+        return self.request(method, url, headers, data)
+
+    def get_stream_size_response(self, stream_url, headers=None):
+        """ Get the response pytube reads a stream's size from, which holds the headers of a request for the whole stream and has no body
+
+        Arguments:
+            self - self - This object
+            stream_url - string - URL of the stream, without its range parameter
+            headers - dict or None - Extra request headers
+
+        Returns:
+            response - TransportResponse object - The closed response
+        """
+
+        with self.lock:
+            size_response = self.stream_sizes.pop(stream_url, None)
+
+        # If it wasn't looked up beforehand, make the GET and close it straight away, leaving just its headers
+        if size_response == None:
+            size_response = self.request("GET", "{0}&range={1}".format(stream_url, SIZE_RANGE), headers)
+            size_response.close()
+
+        return size_response
+
+    def install(self):
+        """ Route all of pytube's metadata and media requests through this transport
+
+        Arguments:
+            self - self - This object
+        """
+
+        from pytube import request
+        request._execute_request = self.execute_request
+
+    def acquire(self, pool_key, fresh=False):
+        """ Take a connection to a host, waiting for as long as the host's connection cap is reached
+
+        Arguments:
+            self - self - This object
+            pool_key - tuple - Scheme/host/port tuple of the host
+            fresh - bool - Open a new connection even if an idle one is available
+
+        Returns:
+            connection - HTTPConnection object - The connection
+            reused - bool - Whether it is a kept-alive connection from an earlier request
+        """
+
+        with self.lock:
+            if pool_key not in self.host_slots:
+                self.host_slots[pool_key] = threading.BoundedSemaphore(self.max_connections_per_host)
+                self.idle_connections[pool_key] = []
+                self.open_connections[pool_key] = 0
+            host_slot = self.host_slots[pool_key]
+
+        host_slot.acquire()
+
+        with self.lock:
+            self.request_count += 1
+
+            # Reuse an idle connection if there is one
+            idle_connections = self.idle_connections[pool_key]
+            if fresh == False and len(idle_connections) > 0:
+                self.connections_reused += 1
+                return idle_connections.pop(), True
+
+            # Close an idle connection to make room for the new one, so the host never has more connections open than slots
+            stale_connection = None
+            if self.open_connections[pool_key] >= self.max_connections_per_host and len(idle_connections) > 0:
+                stale_connection = idle_connections.pop(0)
+                self.open_connections[pool_key] -= 1
+
+            self.connections_opened += 1
+            self.open_connections[pool_key] += 1
+            self.peak_connections = max(self.peak_connections, self.open_connections[pool_key])
+
+        if stale_connection != None:
+            stale_connection.close()
+
+        scheme, host, port = pool_key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        return connection, False
+
+    def release(self, pool_key, connection, reusable):
+        """ Return a connection to the pool, or close it if it can't be reused, and give up its slot
+
+        Arguments:
+            self - self - This object
+            pool_key - tuple - Scheme/host/port tuple of the host
+            connection - HTTPConnection object - The connection
+            reusable - bool - Whether the connection can carry another request
+        """
+
+        with self.lock:
+            if reusable == True:
+                self.idle_connections[pool_key].append(connection)
+            else:
+                self.open_connections[pool_key] -= 1
+
+        if reusable == False:
+            connection.close()
+
+        self.host_slots[pool_key].release()
+
+    def stats(self):
+        """ Get connection reuse counts
+
+        Arguments:
+            self - self - This object
+
+        Returns:
+            stats - dict - Number of requests, connections opened and reused, the most connections open to one host at once, and the reuse ratio
+        """
+
+        with self.lock:
+            reuse_ratio = 0.0
+            if self.request_count > 0:
+                reuse_ratio = self.connections_reused / self.request_count
+
+            return {
+                "requests": self.request_count,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+                "peak_connections": self.peak_connections,
+                "reuse_ratio": reuse_ratio
+            }
+
+def split_range_parameter(url):
+    """ Split pytube's range parameter off the end of a stream URL
+
+    Arguments:
+        url - string - The URL
+
+    Returns:
+        stream_url - string - The URL without its range parameter
+        stream_range - string or None - The range asked for, or None if there isn't one
+    """
+
+    stream_url, separator, stream_range = url.rpartition("&range=")
+    if separator == "" or "&" in stream_range:
+        return url, None
+    return stream_url, stream_range
@@ -0,0 +1,108 @@
+# tests/test_adaptive.py
+# Tests for sorting download errors and for the adaptive concurrency controller, against the benchmark media server
+
+import os
+import email.message
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+import importlib.util
+import concurrent.futures
+from lib import adaptive, errors
+
+# The benchmark server isn't in a package, so load it from its path
+SERVER_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fake_server.py")
+server_spec = importlib.util.spec_from_file_location("fake_server", SERVER_FILE)
+fake_server = importlib.util.module_from_spec(server_spec)
+server_spec.loader.exec_module(fake_server)
+
+def make_http_error(code, reason, headers=None):
+    """ Make an HTTP error as urllib raises it """
+
+    http_headers = email.message.Message()
+    for name, value in (headers or {}).items():
+        http_headers[name] = value
+    return urllib.error.HTTPError("https://example.com/videoplayback", code, reason, http_headers, None)
+
+class ClassifyErrorTest(unittest.TestCase):
+
+    def test_too_many_requests_and_unavailable_are_throttling(self):
+        for code in (429, 503):
+            self.assertIsInstance(errors.classify_error(make_http_error(code, "Whatever")), errors.ThrottledError)
+
+    def test_forbidden_is_throttling_only_with_a_signal(self):
+        self.assertIsInstance(errors.classify_error(make_http_error(403, "Forbidden", {"Retry-After": "30"})), errors.ThrottledError)
+        self.assertIsInstance(errors.classify_error(make_http_error(403, "Rate limit exceeded")), errors.ThrottledError)
+
+        # An expired or refused stream URL is passed on as it is, so it isn't retried
+        forbidden = make_http_error(403, "Forbidden")
+        self.assertIs(errors.classify_error(forbidden), forbidden)
+
+    def test_other_errors(self):
+        self.assertIsInstance(errors.classify_error(make_http_error(500, "Internal Server Error")), errors.TransientError)
+        self.assertIsInstance(errors.classify_error(ConnectionResetError()), errors.TransientError)
+
+        not_found = make_http_error(404, "Not Found")
+        self.assertIs(errors.classify_error(not_found), not_found)
+
+        unavailable = errors.VideoUnavailableError("Private video")
+        self.assertIs(errors.classify_error(unavailable), unavailable)
+
+class AdaptiveControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def start_server(self, throttle_count):
+        server = fake_server.BenchmarkServer(latency=0.02, throttle_count=throttle_count)
+        base_url = server.start()
+        self.addCleanup(server.stop)
+        return base_url
+
+    def test_limit_drops_when_throttled_and_recovers(self):
+        base_url = self.start_server(4)
+        controller = adaptive.AdaptiveController(8, initial_workers=4, base_delay=0.05, max_delay=0.1, max_retries=10)
+        limits = []
+
+        def download(c):
+            limits.append(controller.limit)
+            filename = os.path.join(self.directory.name, "{}.wav".format(c))
+            with urllib.request.urlopen("{0}/media/vid{1}/140?size=20000".format(base_url, c)) as response:
+                with open(filename, "wb") as open_file:
+                    open_file.write(response.read())
+            return filename
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            filenames = list(executor.map(lambda c: controller.run(download, c), range(40)))
+
+        # Every download got through in the end
+        self.assertEqual([os.path.getsize(filename) for filename in filenames], [20000] * 40)
+
+        # The throttled requests cut the limit below where it started, and it grew again once they stopped
+        stats = controller.stats()
+        self.assertGreaterEqual(stats["throttles"], 1)
+        self.assertGreaterEqual(stats["retries"], 4)
+        lowest_limit = min(limits)
+        self.assertLess(lowest_limit, 4)
+        self.assertGreater(controller.limit, lowest_limit)
+
+    def test_limit_grows_without_throttling(self):
+        base_url = self.start_server(0)
+        controller = adaptive.AdaptiveController(8, initial_workers=2)
+
+        def download(c):
+            with urllib.request.urlopen("{0}/media/vid{1}/140?size=20000".format(base_url, c)) as response:
+                return len(response.read())
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(executor.map(lambda c: controller.run(download, c), range(30))), [20000] * 30)
+
+        self.assertEqual(controller.stats()["throttles"], 0)
+        self.assertGreater(controller.stats()["peak_limit"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
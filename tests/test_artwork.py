@@ -0,0 +1,115 @@
+# tests/test_artwork.py
+# Tests for keying the shared cover image cache by path and content
+
+import os
+import tempfile
+import unittest
+import importlib.util
+from lib import artwork
+
+# Tiny stand-ins for cover images, which are only processed if Pillow is installed
+PNG_DATA = b"\x89PNG\r\n\x1a\n" + b"png cover" * 10
+JPEG_DATA = b"\xff\xd8\xff\xe0" + b"jpeg cover" * 10
+
+class ArtworkCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_image(self, name, image_data):
+        """ Write an image into the test directory and return its path """
+
+        image_file = os.path.join(self.directory.name, name)
+        with open(image_file, "wb") as open_image_file:
+            open_image_file.write(image_data)
+        return image_file
+
+    def test_same_path_is_read_once(self):
+        artwork_cache = artwork.ArtworkCache()
+        image_file = self.write_image("cover.png", PNG_DATA)
+
+        self.assertEqual(artwork_cache.get(image_file)[:2], (PNG_DATA, "image/png"))
+        self.assertEqual(artwork_cache.get(image_file)[:2], (PNG_DATA, "image/png"))
+        self.assertEqual(artwork_cache.stats(), {"hits": 1, "misses": 1, "images": 1, "bytes_saved": 0})
+
+    def test_same_content_under_different_paths_is_held_once(self):
+        artwork_cache = artwork.ArtworkCache()
+        first_hash = artwork_cache.get(self.write_image("first.jpg", JPEG_DATA))[2]
+        second_hash = artwork_cache.get(self.write_image("second.jpg", JPEG_DATA))[2]
+
+        # Each path is read, but the image is only held once
+        self.assertEqual(first_hash, second_hash)
+        self.assertEqual(artwork_cache.stats()["misses"], 2)
+        self.assertEqual(artwork_cache.stats()["images"], 1)
+        self.assertEqual(artwork_cache.cached_bytes, len(JPEG_DATA))
+
+    def test_edited_file_is_read_again(self):
+        artwork_cache = artwork.ArtworkCache()
+        image_file = self.write_image("cover.jpg", JPEG_DATA)
+        first_hash = artwork_cache.get(image_file)[2]
+
+        # A new size and modification time make a new path key
+        self.write_image("cover.jpg", PNG_DATA + b"edited")
+        os.utime(image_file, (1000000000, 1000000000))
+        image_data, mime_type, second_hash = artwork_cache.get(image_file)
+
+        self.assertNotEqual(first_hash, second_hash)
+        self.assertEqual((image_data, mime_type), (PNG_DATA + b"edited", "image/png"))
+        self.assertEqual(artwork_cache.stats()["misses"], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        artwork_cache = artwork.ArtworkCache(max_bytes=len(PNG_DATA) + len(JPEG_DATA) + 10)
+        png_file = self.write_image("cover.png", PNG_DATA)
+        jpeg_file = self.write_image("cover.jpg", JPEG_DATA)
+        other_file = self.write_image("other.jpg", JPEG_DATA + b"other")
+
+        artwork_cache.get(png_file)
+        artwork_cache.get(jpeg_file)
+        artwork_cache.get(png_file)
+        artwork_cache.get(other_file)
+
+        # The JPEG was used least recently, so it made room for the new image
+        self.assertEqual(artwork_cache.stats()["images"], 2)
+        artwork_cache.get(png_file)
+        artwork_cache.get(jpeg_file)
+        self.assertEqual(artwork_cache.stats()["hits"], 2)
+        self.assertEqual(artwork_cache.stats()["misses"], 4)
+
+    def test_unprocessed_image_file_is_used_where_it_is(self):
+        artwork_cache = artwork.ArtworkCache()
+        image_file = self.write_image("cover.jpg", JPEG_DATA)
+
+        self.assertEqual(artwork_cache.get_file(image_file), image_file)
+        self.assertEqual(artwork_cache.stats()["misses"], 0)
+
+    def test_processed_image_file_is_written_once_per_content(self):
+        artwork_cache = artwork.ArtworkCache(max_dimension=500)
+        first_file = artwork_cache.get_file(self.write_image("first.png", PNG_DATA))
+        second_file = artwork_cache.get_file(self.write_image("second.png", PNG_DATA))
+
+        self.assertEqual(first_file, second_file)
+        self.assertTrue(first_file.endswith(".png"))
+        with open(first_file, "rb") as processed_file:
+            self.assertEqual(processed_file.read(), PNG_DATA)
+
+        # Closing removes the processed files
+        artwork_cache.close()
+        self.assertFalse(os.path.exists(first_file))
+
+    @unittest.skipUnless(importlib.util.find_spec("PIL") != None, "Pillow is not installed")
+    def test_large_image_is_scaled_down(self):
+        import io
+        from PIL import Image
+
+        raw_image = io.BytesIO()
+        Image.new("RGB", (1200, 800), (200, 30, 30)).save(raw_image, "PNG")
+        image_file = self.write_image("large.png", raw_image.getvalue())
+
+        image_data, mime_type, content_hash = artwork.ArtworkCache(max_dimension=300).get(image_file)
+
+        self.assertEqual(mime_type, "image/jpeg")
+        self.assertEqual(Image.open(io.BytesIO(image_data)).size, (300, 200))
+
+if __name__ == "__main__":
+    unittest.main()
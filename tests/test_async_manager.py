@@ -0,0 +1,72 @@
+# tests/test_async_manager.py
+# Tests for the asyncio engine's fetches keeping to the shared transport's limits, against a local server
+
+import time
+import asyncio
+import threading
+import unittest
+import http.server
+import importlib.util
+from lib import transport
+
+# Body served for every GET
+BODY = b"x" * 50000
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serve a fixed body for GETs """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+@unittest.skipUnless(importlib.util.find_spec("pytube") != None, "pytube is not installed")
+class AsyncFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/videoplayback".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch_all(self, http_transport, fetch_count):
+        """ Fetch the body several times at once through an AsyncDownloader using the transport, returning the bodies and the seconds taken """
+
+        # The engine imports the manager, which imports pytube, so it is only loaded once the test is known to run
+        from lib import async_manager, manager, tag_editor
+
+        async_downloader = async_manager.AsyncDownloader(manager.DownloadManager(False, transport=http_transport), tag_editor.Editor(False))
+
+        async def fetch(url):
+            return b"".join([chunk async for chunk in async_downloader.fetch(url)])
+
+        async def fetch_all():
+            return await asyncio.gather(*[fetch(self.url) for c in range(fetch_count)])
+
+        start = time.monotonic()
+        bodies = asyncio.run(fetch_all())
+        return bodies, time.monotonic() - start
+
+    def test_rate_limit_holds(self):
+        # The bucket starts with one second's worth, so three bodies at one body per second take at least two seconds
+        bodies, seconds = self.fetch_all(transport.Transport(max_rate=len(BODY)), 3)
+
+        self.assertEqual(bodies, [BODY] * 3)
+        self.assertGreaterEqual(seconds, 1.9)
+
+    def test_unlimited_without_rate(self):
+        bodies, seconds = self.fetch_all(transport.Transport(), 3)
+
+        self.assertEqual(bodies, [BODY] * 3)
+        self.assertLess(seconds, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
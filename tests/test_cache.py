@@ -0,0 +1,98 @@
+# tests/test_cache.py
+# Tests for the metadata cache's time to live and eviction
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+from lib import cache
+
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk-yt-mp3.py")
+
+# The real clock, for working out times while time.time is patched
+real_time = time.time
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "cache", "metadata.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_cache(self, **options):
+        metadata_cache = cache.MetadataCache(self.cache_file, **options)
+        self.addCleanup(metadata_cache.close)
+        return metadata_cache
+
+    def test_entries_last_between_runs(self):
+        metadata_cache = cache.MetadataCache(self.cache_file)
+        metadata_cache.put("video", "vid1", {"title": "Song", "duration": 200})
+        metadata_cache.close()
+
+        self.assertEqual(self.open_cache().get("video", "vid1"), {"title": "Song", "duration": 200})
+
+    def test_entries_expire_after_their_kind_ttl(self):
+        metadata_cache = self.open_cache(ttls={"playlist": 60})
+
+        with mock.patch("time.time", return_value=1000.0):
+            metadata_cache.put("video", "vid1", {"title": "Song"})
+            metadata_cache.put("playlist", "list1", ["https://www.youtube.com/watch?v=vid1"])
+
+        # Two minutes later the playlist has expired but the video, kept for a week, hasn't
+        with mock.patch("time.time", return_value=1120.0):
+            self.assertEqual(metadata_cache.get("playlist", "list1"), None)
+            self.assertEqual(metadata_cache.get("video", "vid1"), {"title": "Song"})
+
+        self.assertEqual(metadata_cache.stats(), {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_expired_entries_are_evicted_on_open(self):
+        metadata_cache = cache.MetadataCache(self.cache_file, ttls={"video": 60})
+        with mock.patch("time.time", return_value=real_time() - 120):
+            metadata_cache.put("video", "vid1", {"title": "Song"})
+        metadata_cache.put("video", "vid2", {"title": "Other Song"})
+        metadata_cache.close()
+
+        reopened_cache = self.open_cache(ttls={"video": 60})
+        self.assertEqual(reopened_cache.stats()["evictions"], 1)
+        self.assertEqual(reopened_cache.get("video", "vid2"), {"title": "Other Song"})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        metadata_cache = self.open_cache(max_entries=2)
+
+        for c, video_id in enumerate(("vid1", "vid2", "vid3")):
+            with mock.patch("time.time", return_value=real_time() + c):
+                metadata_cache.put("video", video_id, {"title": video_id})
+
+        # Using the oldest entry keeps it, so the next oldest goes
+        with mock.patch("time.time", return_value=real_time() + 10):
+            metadata_cache.get("video", "vid1")
+        metadata_cache.evict()
+
+        self.assertEqual(metadata_cache.get("video", "vid2"), None)
+        self.assertEqual(metadata_cache.get("video", "vid1"), {"title": "vid1"})
+        self.assertEqual(metadata_cache.get("video", "vid3"), {"title": "vid3"})
+
+    def test_refresh_ignores_but_replaces_entries(self):
+        metadata_cache = cache.MetadataCache(self.cache_file)
+        metadata_cache.put("video", "vid1", {"title": "Old Title"})
+        metadata_cache.close()
+
+        refreshing_cache = self.open_cache(refresh=True)
+        self.assertEqual(refreshing_cache.get("video", "vid1"), None)
+        refreshing_cache.put("video", "vid1", {"title": "New Title"})
+
+        self.assertEqual(self.open_cache().get("video", "vid1"), {"title": "New Title"})
+
+class CacheOptionTest(unittest.TestCase):
+
+    def test_negative_ttl_is_refused(self):
+        output = subprocess.run([sys.executable, PROGRAM_FILE, "--no-daemon", "--cache-ttl", "-5", "https://www.youtube.com/watch?v=vid1"], stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertIn("[E] Cache TTL can't be negative", output)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# tests/test_daemon.py
+# Tests for checking daemon jobs before they are queued
+
+import os
+import unittest
+import importlib.util
+from lib import daemon
+
+# bulk-yt-mp3.py can't be imported by name, so load it from its path
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk-yt-mp3.py")
+program_spec = importlib.util.spec_from_file_location("bulk_yt_mp3", PROGRAM_FILE)
+program = importlib.util.module_from_spec(program_spec)
+program_spec.loader.exec_module(program)
+
+class CheckJobOptionsTest(unittest.TestCase):
+
+    def test_good_options_pass(self):
+        program.check_job_options({"use_threading": True, "worker_count": 8, "job_timeout": 30, "output_format": "opus", "priority_sources": ["videos", "resumed"], "order_window": 0})
+        program.check_job_options({"job_timeout": None, "priority_sources": None})
+
+    def test_bad_options_are_refused(self):
+        bad_options = [
+            {"worker_count": "8"},
+            {"worker_count": 0},
+            {"worker_count": True},
+            {"convert_batch_size": 2.5},
+            {"order_window": -1},
+            {"streaming": "yes"},
+            {"job_timeout": -5},
+            {"output_format": "wav"},
+            {"stream_policy": None},
+            {"priority_sources": "videos"},
+            {"priority_sources": ["everything"]},
+            {"max_rate": 1000}
+        ]
+
+        for options in bad_options:
+            with self.assertRaises(ValueError, msg=str(options)):
+                program.check_job_options(options)
+
+class DaemonSubmitTest(unittest.TestCase):
+
+    def test_checked_job_is_refused_before_queueing(self):
+        daemon_server = daemon.DaemonServer("/nonexistent/daemon.sock", lambda job_request: {}, lambda job_request: program.check_job_options(job_request["options"]))
+
+        with self.assertRaises(ValueError):
+            daemon_server.handle_request({"action": "submit", "video_urls": ["https://www.youtube.com/watch?v=vid1"], "outdir": "/music", "options": {"worker_count": "lots"}})
+        self.assertEqual(daemon_server.get_status(), [])
+        self.assertTrue(daemon_server.job_queue.empty())
+
+        # A good job is queued
+        response = daemon_server.handle_request({"action": "submit", "video_urls": ["https://www.youtube.com/watch?v=vid1"], "outdir": "/music", "options": {"worker_count": 2}})
+        self.assertEqual(response, {"ok": True, "job": 1})
+        self.assertEqual(daemon_server.get_status(1)[0]["state"], "queued")
+
+if __name__ == "__main__":
+    unittest.main()
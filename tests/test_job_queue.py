@@ -0,0 +1,128 @@
+# tests/test_job_queue.py
+# Tests for the shared job queue and its workers
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from lib import errors
+from lib import job_queue
+
+class FlakyDownloader(object):
+    """ Fails the first few downloads, then writes the file it is given """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.filenames = []
+
+    def download_and_convert(self, video_url, video_title, video_filename, video_metadata):
+        self.filenames.append(video_filename)
+        if self.failures > 0:
+            self.failures -= 1
+            with open(video_filename + ".temp", "wb") as open_file:
+                open_file.write(b"half")
+            raise errors.DownloadError("Connection reset")
+
+        with open(video_filename, "wb") as open_file:
+            open_file.write(b"audio")
+        return video_filename
+
+class StolenLeaseDownloader(object):
+    """ Writes the file it is given, but lets another worker take the lease over while downloading """
+
+    def __init__(self, video_job_queue):
+        self.video_job_queue = video_job_queue
+
+    def download_and_convert(self, video_url, video_title, video_filename, video_metadata):
+        with open(video_filename, "wb") as open_file:
+            open_file.write(b"stale audio")
+
+        # The lease expires and another worker takes the video over and finishes it first
+        self.video_job_queue.connection.execute("UPDATE jobs SET lease_expires = 0")
+        job_id, video_url, video_title, final_filename, video_metadata = self.video_job_queue.lease("worker-2")
+        with open(final_filename, "wb") as open_file:
+            open_file.write(b"audio")
+        self.video_job_queue.complete(job_id, "worker-2", final_filename)
+        return video_filename
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.video_job_queue = job_queue.JobQueue(os.path.join(self.directory.name, "queue.sqlite"), max_attempts=3, retry_delay=0.0)
+        self.video_filename = os.path.join(self.directory.name, "Song.mp3")
+        self.video_job_queue.add("vid1", "https://www.youtube.com/watch?v=vid1", "Song", self.video_filename, None)
+
+    def tearDown(self):
+        self.video_job_queue.close()
+        self.directory.cleanup()
+
+    def test_fail_returns_the_new_state(self):
+        for expected_state in ("pending", "pending", "failed"):
+            job_id = self.video_job_queue.lease("worker-1")[0]
+            self.assertEqual(self.video_job_queue.fail(job_id, "worker-1", "Connection reset"), expected_state)
+
+        # A worker that doesn't hold the lease changes nothing
+        self.assertEqual(self.video_job_queue.fail(job_id, "worker-2", "Connection reset"), None)
+        self.assertEqual(self.video_job_queue.stats()["failed"], 1)
+
+    def test_retries_are_not_counted_as_failures(self):
+        downloader = FlakyDownloader(2)
+        queue_worker = job_queue.QueueWorker(self.video_job_queue, downloader, worker_count=1, poll_interval=0.01)
+
+        self.assertEqual(queue_worker.run(), {"completed": 1, "failed": 0, "retried": 2, "lost": 0})
+        self.assertEqual(self.video_job_queue.stats()["failed"], 0)
+
+        # Each lease downloaded to a name of its own, and only the finished file is left
+        self.assertEqual(len(set(downloader.filenames)), 3)
+        self.assertNotIn(self.video_filename, downloader.filenames)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["Song.mp3", "queue.sqlite"])
+
+    def test_failed_job_waits_for_its_retry_delay(self):
+        self.video_job_queue.retry_delay = 30.0
+        job_id = self.video_job_queue.lease("worker-1")[0]
+
+        with mock.patch("random.uniform", return_value=30.0):
+            self.assertEqual(self.video_job_queue.fail(job_id, "worker-1", "Connection reset"), "pending")
+
+        # Not leased again until the delay has passed, but still unfinished
+        self.assertEqual(self.video_job_queue.lease("worker-1"), None)
+        self.assertFalse(self.video_job_queue.is_finished())
+
+        self.video_job_queue.connection.execute("UPDATE jobs SET lease_expires = 0")
+        self.assertEqual(self.video_job_queue.lease("worker-1")[0], job_id)
+
+    def test_retry_delay_grows_with_attempts(self):
+        self.video_job_queue.retry_delay = 30.0
+        self.video_job_queue.max_retry_delay = 100.0
+
+        with mock.patch("random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([self.video_job_queue.get_retry_delay(attempts) for attempts in (1, 2, 3)], [30.0, 60.0, 100.0])
+
+    def test_lost_lease_does_not_overwrite_output(self):
+        queue_worker = job_queue.QueueWorker(self.video_job_queue, StolenLeaseDownloader(self.video_job_queue), worker_count=1, poll_interval=0.01)
+
+        self.assertEqual(queue_worker.run(), {"completed": 0, "failed": 0, "retried": 0, "lost": 1})
+
+        # The output of the worker that holds the lease is kept, and the stale download is thrown away
+        with open(self.video_filename, "rb") as open_file:
+            self.assertEqual(open_file.read(), b"audio")
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["Song.mp3", "queue.sqlite"])
+
+    def test_database_errors_are_retried(self):
+        lease = self.video_job_queue.lease
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky_lease(worker_id):
+            if len(failures) > 0:
+                raise failures.pop()
+            return lease(worker_id)
+
+        self.video_job_queue.lease = flaky_lease
+        queue_worker = job_queue.QueueWorker(self.video_job_queue, FlakyDownloader(0), worker_count=1, poll_interval=0.01)
+
+        self.assertEqual(queue_worker.run(), {"completed": 1, "failed": 0, "retried": 0, "lost": 0})
+
+if __name__ == "__main__":
+    unittest.main()
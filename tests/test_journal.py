@@ -0,0 +1,76 @@
+# tests/test_journal.py
+# Tests for the run journal's in-memory state when resuming
+
+import os
+import tempfile
+import unittest
+from lib import journal
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.directory.name, journal.JOURNAL_FILE_NAME)
+
+        job_journal = journal.Journal(self.journal_file)
+        job_journal.start({"video_urls": [], "playlist_url": None})
+        for c, stage in enumerate(("tagged", "downloaded", "queued")):
+            video_filename = os.path.join(self.directory.name, "Song {}.mp3".format(c))
+            job_journal.record(video_filename, "queued", url="https://www.youtube.com/watch?v=vid{}".format(c), video_id="vid{}".format(c), title="Song {}".format(c), metadata={"title": "Song {}".format(c), "artist": "Someone"})
+            if stage != "queued":
+                job_journal.record(video_filename, "downloaded", audio_codec="opus")
+            if stage == "tagged":
+                job_journal.record(video_filename, "converted", tags_pending=False, replaygain=None)
+                job_journal.record(video_filename, "tagged")
+        job_journal.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_keeps_only_unfinished_stages_in_memory(self):
+        job_journal = journal.Journal(self.journal_file)
+        job_journal.resume()
+
+        # The tagged video is forgotten
+        self.assertEqual(job_journal.stages, {os.path.join(self.directory.name, "Song 1.mp3"): "downloaded", os.path.join(self.directory.name, "Song 2.mp3"): "queued"})
+
+        # Only the downloaded video keeps the fields it needs to resume, and no tag data is held
+        song_1 = os.path.join(self.directory.name, "Song 1.mp3")
+        self.assertEqual(list(job_journal.stage_fields), [song_1])
+        self.assertEqual(job_journal.get_record(song_1), {"file": song_1, "stage": "downloaded", "audio_codec": "opus"})
+
+        # Tag data is streamed back from the file for the unfinished videos
+        unfinished_videos = list(job_journal.iter_unfinished())
+        self.assertEqual([video[1] for video in unfinished_videos], ["vid1", "vid2"])
+        self.assertEqual(unfinished_videos[0][4]["artist"], "Someone")
+        job_journal.close()
+
+    def test_queued_videos_are_found_by_id_and_directory(self):
+        job_journal = journal.Journal(self.journal_file)
+        job_journal.resume()
+
+        self.assertEqual(job_journal.get_video_filename("vid1", self.directory.name), os.path.join(self.directory.name, "Song 1.mp3"))
+        self.assertEqual(job_journal.get_video_filename("vid1", os.path.join(self.directory.name, "Playlist")), None)
+        self.assertEqual(job_journal.get_video_filename("vid9", self.directory.name), None)
+
+        # Finished videos are left to the library index, and so are videos once they finish
+        self.assertEqual(job_journal.get_video_filename("vid0", self.directory.name), None)
+        job_journal.record(os.path.join(self.directory.name, "Song 1.mp3"), "converted", tags_pending=False, replaygain=None)
+        job_journal.record(os.path.join(self.directory.name, "Song 1.mp3"), "tagged")
+        self.assertEqual(job_journal.get_video_filename("vid1", self.directory.name), None)
+        self.assertEqual(job_journal.stage_fields, {})
+        self.assertEqual(list(job_journal.stages), [os.path.join(self.directory.name, "Song 2.mp3")])
+        job_journal.close()
+
+    def test_new_run_does_not_replace_an_interrupted_journal(self):
+        with open(self.journal_file) as journal_file:
+            journal_data = journal_file.read()
+
+        with self.assertRaises(journal.JournalError):
+            journal.Journal(self.journal_file).start({"video_urls": [], "playlist_url": None})
+
+        with open(self.journal_file) as journal_file:
+            self.assertEqual(journal_file.read(), journal_data)
+
+if __name__ == "__main__":
+    unittest.main()
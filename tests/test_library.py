@@ -0,0 +1,82 @@
+# tests/test_library.py
+# Tests for the library index's scan of files already on disk
+
+import os
+import tempfile
+import unittest
+import importlib.util
+from lib import library
+
+# bulk-yt-mp3.py can't be imported by name, so load it from its path
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk-yt-mp3.py")
+program_spec = importlib.util.spec_from_file_location("bulk_yt_mp3", PROGRAM_FILE)
+program = importlib.util.module_from_spec(program_spec)
+program_spec.loader.exec_module(program)
+
+class StubDownloadManager(object):
+    """ Knows the IDs and cached titles of videos, and fails the test if asked to look one up """
+
+    output_format = "mp3"
+
+    def __init__(self, titles):
+        self.titles = titles
+
+    def get_video_id(self, video_url):
+        return video_url.split("=")[-1]
+
+    def get_known_title(self, video_url):
+        return self.titles.get(self.get_video_id(video_url))
+
+class LibraryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outdir = self.directory.name
+
+        os.makedirs(os.path.join(self.outdir, "Some Playlist"))
+        for file_name in ("First Song.mp3", os.path.join("Some Playlist", "Second Song.mp3"), "Third Song.partial.mp3", ".hidden.mp3", "notes.txt"):
+            with open(os.path.join(self.outdir, file_name), "wb") as open_file:
+                open_file.write(b"audio")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scan_indexes_files_on_disk(self):
+        library_index = library.LibraryIndex(self.outdir)
+
+        self.assertEqual(library_index.scan(), 2)
+        self.assertEqual(sorted(library_index.untracked_paths), sorted(["First Song.mp3", os.path.join("Some Playlist", "Second Song.mp3")]))
+        self.assertEqual(library_index.entries[library.UNTRACKED_PREFIX + "First Song.mp3"]["title"], "First Song")
+
+        # A second scan has nothing new to add, even from the saved index
+        library_index.save()
+        library_index = library.LibraryIndex(self.outdir)
+        self.assertEqual(library_index.scan(), 0)
+        self.assertTrue(library_index.has_untracked_files())
+
+    def test_adopt_and_record_move_files_under_their_videos(self):
+        library_index = library.LibraryIndex(self.outdir)
+        library_index.scan()
+
+        self.assertTrue(library_index.adopt("vid1", os.path.join(self.outdir, "First Song.mp3")))
+        self.assertFalse(library_index.adopt("vid3", os.path.join(self.outdir, "Missing Song.mp3")))
+        self.assertEqual(library_index.lookup("vid1"), os.path.join(self.outdir, "First Song.mp3"))
+
+        library_index.record("vid2", os.path.join(self.outdir, "Some Playlist", "Second Song.mp3"), True)
+        self.assertFalse(library_index.has_untracked_files())
+        self.assertEqual(sorted(library_index.entries), ["vid1", "vid2"])
+
+    def test_select_videos_skips_files_on_disk_without_looking_them_up(self):
+        library_index = library.LibraryIndex(self.outdir)
+        library_index.scan()
+        download_manager = StubDownloadManager({"vid1": "First Song", "vid2": "New Song"})
+        video_urls = ["https://www.youtube.com/watch?v=vid1", "https://www.youtube.com/watch?v=vid2", "https://www.youtube.com/watch?v=vid3"]
+
+        selected_videos = list(program.select_videos(download_manager, video_urls, self.outdir, None, library_index, {}, [], set()))
+
+        # Only the video whose file is on disk is skipped, and it is now indexed under its ID
+        self.assertEqual([video_id for video_url, video_id, video_metadata in selected_videos], ["vid2", "vid3"])
+        self.assertEqual(library_index.lookup("vid1"), os.path.join(self.outdir, "First Song.mp3"))
+
+if __name__ == "__main__":
+    unittest.main()
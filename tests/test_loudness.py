@@ -0,0 +1,71 @@
+# tests/test_loudness.py
+# Tests for the EBU R128 loudness meter behind ReplayGain, using synthetic tones
+
+import unittest
+import importlib.util
+
+# NumPy is optional, so the meter is only loaded if it is installed
+if importlib.util.find_spec("numpy") != None:
+    import numpy
+    from lib import loudness
+
+def build_tone(amplitudes, seconds, frequency=997):
+    """ Build a sine tone as interleaved 32-bit float samples, with an amplitude for each channel """
+
+    times = numpy.arange(int(48000 * seconds)) / 48000
+    wave = numpy.sin(2 * numpy.pi * frequency * times)
+    return numpy.stack([wave * amplitude for amplitude in amplitudes], axis=1).astype("<f4")
+
+def measure(samples, chunk_size=None):
+    """ Measure samples with a new meter, feeding them in chunks of chunk_size bytes if given """
+
+    meter = loudness.LoudnessMeter()
+    pcm_data = samples.tobytes()
+    if chunk_size == None:
+        chunk_size = len(pcm_data)
+    for position in range(0, len(pcm_data), chunk_size):
+        meter.add(pcm_data[position:position + chunk_size])
+    return meter
+
+@unittest.skipUnless(importlib.util.find_spec("numpy") != None, "NumPy is not installed")
+class LoudnessMeterTest(unittest.TestCase):
+
+    def test_reference_tone(self):
+        # A 997 Hz sine at -20 dBFS in both channels is the standard's -20 LUFS reference
+        meter = measure(build_tone([0.1, 0.1], 5))
+        self.assertAlmostEqual(meter.get_loudness(), -20.0, delta=0.01)
+
+        replaygain = meter.get_replaygain()
+        self.assertAlmostEqual(replaygain["track_gain"], 2.0, delta=0.01)
+        self.assertAlmostEqual(replaygain["track_peak"], 0.1, places=5)
+
+    def test_channels_are_summed(self):
+        # A -6 dBFS sine in one channel alone carries a quarter of the power of a 0 dBFS stereo pair
+        self.assertAlmostEqual(measure(build_tone([0.5, 0.0], 5)).get_loudness(), -9.03, delta=0.01)
+
+    def test_chunk_size_does_not_matter(self):
+        samples = build_tone([0.1, 0.1], 3)
+
+        # Chunks that end partway through a sample and a second
+        self.assertAlmostEqual(measure(samples, 12345).get_loudness(), measure(samples).get_loudness(), places=6)
+
+    def test_silence_is_gated_out(self):
+        # Silence falls below the absolute gate, so it doesn't drag the track down to -23 LUFS
+        samples = numpy.concatenate((build_tone([0.1, 0.1], 10), numpy.zeros((48000 * 10, 2), dtype="<f4")))
+        self.assertAlmostEqual(measure(samples).get_loudness(), -20.0, delta=0.1)
+
+    def test_quiet_passage_is_gated_out(self):
+        # A passage 20 LU below the rest falls below the relative gate, so it doesn't drag the track down to -23 LUFS either
+        samples = numpy.concatenate((build_tone([0.1, 0.1], 10), build_tone([0.01, 0.01], 10)))
+        self.assertAlmostEqual(measure(samples).get_loudness(), -20.0, delta=0.1)
+
+    def test_too_short_or_silent_has_no_loudness(self):
+        # Shorter than one 400 ms gating block
+        meter = measure(build_tone([0.1, 0.1], 0.3))
+        self.assertEqual(meter.get_loudness(), None)
+        self.assertEqual(meter.get_replaygain(), None)
+
+        self.assertEqual(measure(numpy.zeros((48000 * 2, 2), dtype="<f4")).get_replaygain(), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+# tests/test_manager.py
+# Tests for looking videos up once and reusing the lookup until they are downloaded, for reading playlists lazily, and for picking audio streams
+
+import os
+import types
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+from lib import cache
+
+class FakeYouTube(object):
+    """ Stands in for pytube's YouTube, counting how often a video is looked up """
+
+    lookups = []
+
+    def __init__(self, url, on_progress_callback=None):
+        FakeYouTube.lookups.append(url)
+        self.video_id = url.split("=")[-1]
+        self.title = "Title " + self.video_id
+        self.length = 200
+        self.streams = types.SimpleNamespace(filter=lambda only_audio: [types.SimpleNamespace(bitrate=128000, audio_codec="mp4a.40.2", itag=140)])
+
+    def check_availability(self):
+        pass
+
+class FakePlaylist(object):
+    """ Stands in for pytube's Playlist, counting how many video URLs have been read from it """
+
+    read_count = 0
+
+    def __init__(self, playlist_url):
+        self.playlist_url = playlist_url
+
+    def url_generator(self):
+        for c in range(50):
+            FakePlaylist.read_count += 1
+            yield "https://www.youtube.com/watch?v=video{:06d}".format(c)
+
+# The manager imports pytube, so it is only loaded once the tests are known to run
+@unittest.skipUnless(importlib.util.find_spec("pytube") != None, "pytube is not installed")
+class ResolveVideoTest(unittest.TestCase):
+
+    def setUp(self):
+        from lib import manager
+
+        FakeYouTube.lookups = []
+        patcher = mock.patch.object(manager, "YouTube", FakeYouTube)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.download_manager = manager.DownloadManager(False)
+        self.video_url = "https://www.youtube.com/watch?v=abcdefghijk"
+
+    def test_lookup_is_reused_for_the_download(self):
+        self.assertEqual(self.download_manager.get_video_title(self.video_url), "Title abcdefghijk")
+        self.assertEqual(self.download_manager.get_known_duration(self.video_url), 200)
+
+        # The stream is picked from the manifest fetched with the title
+        stream = self.download_manager.get_audio_stream(self.video_url)
+        self.assertEqual(stream.itag, 140)
+        self.assertEqual(FakeYouTube.lookups, [self.video_url])
+
+    def test_manifest_is_released_after_the_download(self):
+        self.download_manager.get_audio_stream(self.video_url)
+        resolved_video = self.download_manager.resolve_video(self.video_url)
+        self.assertEqual(resolved_video.youtube, None)
+
+        # The title is still known, but downloading again fetches a fresh manifest
+        self.assertEqual(self.download_manager.get_known_title(self.video_url), "Title abcdefghijk")
+        self.download_manager.get_audio_stream(self.video_url)
+        self.assertEqual(len(FakeYouTube.lookups), 2)
+
+    def test_concurrent_resolution_keeps_order(self):
+        video_urls = ["https://www.youtube.com/watch?v=video{:06d}".format(c) for c in range(8)]
+
+        resolved_videos, errors = self.download_manager.resolve_videos(video_urls, 4)
+
+        self.assertEqual(errors, {})
+        self.assertEqual([resolved_video.url for resolved_video in resolved_videos], video_urls)
+
+        # Resolving them again reuses every lookup
+        self.download_manager.resolve_videos(video_urls, 4)
+        self.assertEqual(sorted(FakeYouTube.lookups), video_urls)
+
+@unittest.skipUnless(importlib.util.find_spec("pytube") != None, "pytube is not installed")
+class PlaylistTest(unittest.TestCase):
+
+    def setUp(self):
+        from lib import manager
+
+        FakeYouTube.lookups = []
+        FakePlaylist.read_count = 0
+        for name, fake in (("YouTube", FakeYouTube), ("Playlist", FakePlaylist)):
+            patcher = mock.patch.object(manager, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.metadata_cache = cache.MetadataCache(os.path.join(self.directory.name, "metadata.sqlite"))
+        self.addCleanup(self.metadata_cache.close)
+
+        self.download_manager = manager.DownloadManager(False, self.metadata_cache)
+        self.playlist_url = "https://www.youtube.com/playlist?list=PLtest"
+
+    def test_first_video_resolves_before_the_playlist_is_read(self):
+        resolved_videos = self.download_manager.iter_playlist(self.playlist_url, 2)
+
+        video_url, resolved_video, err_msg = next(resolved_videos)
+        self.assertEqual(resolved_video.title, "Title video000000")
+        self.assertLess(FakePlaylist.read_count, 10)
+
+        # The playlist is only cached once it has been read to the end
+        self.assertEqual(self.metadata_cache.get("playlist", "PLtest"), None)
+        resolved_videos.close()
+
+    def test_whole_playlist_is_resolved_in_order_and_cached(self):
+        video_list = self.download_manager.parse_playlist(self.playlist_url, 4)
+
+        self.assertEqual([video_title for video_url, video_title in video_list], ["Title video{:06d}".format(c) for c in range(50)])
+        self.assertEqual(len(self.metadata_cache.get("playlist", "PLtest")), 50)
+
+        # The next listing comes from the cache
+        self.assertEqual(len(list(self.download_manager.iter_playlist_urls(self.playlist_url))), 50)
+        self.assertEqual(FakePlaylist.read_count, 50)
+
+def build_stream(itag, bitrate, audio_codec):
+    """ Build a stand-in for an audio only stream """
+
+    return types.SimpleNamespace(itag=itag, bitrate=bitrate, audio_codec=audio_codec)
+
+# The usual audio streams of a video, AAC in MP4 and Opus in WebM
+AUDIO_STREAMS = [build_stream(139, 48000, "mp4a.40.5"), build_stream(140, 128000, "mp4a.40.2"), build_stream(249, 50000, "opus"), build_stream(250, 70000, "opus"), build_stream(251, 160000, "opus")]
+
+@unittest.skipUnless(importlib.util.find_spec("pytube") != None, "pytube is not installed")
+class StreamPolicyTest(unittest.TestCase):
+
+    def select_itag(self, output_format, stream_policy, streams=AUDIO_STREAMS):
+        """ Pick a stream with a new download manager and return its itag """
+
+        from lib import manager
+
+        download_manager = manager.DownloadManager(False, output_format=output_format, stream_policy=stream_policy)
+        return download_manager.select_audio_stream(streams).itag
+
+    def test_codec_policy_picks_a_stream_that_can_be_copied(self):
+        self.assertEqual(self.select_itag("m4a", "codec"), 140)
+        self.assertEqual(self.select_itag("opus", "codec"), 251)
+
+        # MP3 can't hold either codec, so the best stream is taken to be encoded
+        self.assertEqual(self.select_itag("mp3", "codec"), 251)
+
+    def test_codec_policy_falls_back_to_the_best_stream(self):
+        self.assertEqual(self.select_itag("opus", "codec", AUDIO_STREAMS[:2]), 140)
+
+    def test_best_policy_picks_the_highest_bitrate(self):
+        self.assertEqual(self.select_itag("m4a", "best"), 251)
+
+        # Ties go to the stream that can be copied
+        tied_streams = [build_stream(251, 128000, "opus"), build_stream(140, 128000, "mp4a.40.2")]
+        self.assertEqual(self.select_itag("m4a", "best", tied_streams), 140)
+        self.assertEqual(self.select_itag("opus", "best", tied_streams), 251)
+
+    def test_smallest_policy_picks_the_lowest_adequate_bitrate(self):
+        # Both 128 kbit/s and 160 kbit/s are adequate, while the rest are below 96 kbit/s
+        self.assertEqual(self.select_itag("mp3", "smallest"), 140)
+
+        # Without an adequate stream, the best one is taken
+        self.assertEqual(self.select_itag("mp3", "smallest", AUDIO_STREAMS[2:4]), 250)
+
+    def test_picked_stream_is_copied_when_it_can_be(self):
+        from lib import manager
+
+        self.assertEqual(manager.DownloadManager(False, output_format="m4a").build_codec_arguments("mp4a.40.2"), ["-c:a", "copy"])
+        self.assertEqual(manager.DownloadManager(False, output_format="opus").build_codec_arguments("mp4a.40.2"), ["-c:a", "libopus", "-b:a", "128k"])
+        self.assertEqual(manager.DownloadManager(False, output_format="mp3").build_codec_arguments(None), [])
+
+    def test_no_audio_streams(self):
+        from lib import errors
+
+        with self.assertRaises(errors.VideoUnavailableError):
+            self.select_itag("mp3", "codec", [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# tests/test_manifest.py
+# Tests for looking up tag data in an indexed CSV manifest
+
+import os
+import tempfile
+import unittest
+from lib import manifest
+
+MANIFEST_DATA = "video,title,artist\nvid1,First Song,Some Artist\nhttps://www.youtube.com/watch?v=vid2,Second Song,\n"
+
+class TagManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tag_data_file = os.path.join(self.directory.name, "tags.csv")
+        with open(self.tag_data_file, "w") as open_file:
+            open_file.write(MANIFEST_DATA)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_keyed_lookup_uses_index_next_to_manifest(self):
+        tag_manifest = manifest.TagManifest(self.tag_data_file)
+        try:
+            self.assertEqual(tag_manifest.get("vid2")["title"], "Second Song")
+            self.assertEqual(tag_manifest.get("vid2")["artist"], None)
+            self.assertEqual(tag_manifest.get("vid3"), None)
+        finally:
+            tag_manifest.close()
+
+        self.assertTrue(os.path.isfile(self.tag_data_file + ".index.sqlite"))
+
+    def test_unwritable_index_falls_back_to_memory(self):
+        # An index in a directory that can't be created stands in for a read-only one, which root could still write to
+        index_file = os.path.join(self.directory.name, "missing", "tags.index.sqlite")
+        tag_manifest = manifest.TagManifest(self.tag_data_file, index_file)
+        try:
+            self.assertEqual(tag_manifest.index_file, ":memory:")
+            self.assertEqual(tag_manifest.get("vid1")["title"], "First Song")
+        finally:
+            tag_manifest.close()
+
+        self.assertFalse(os.path.exists(index_file))
+
+if __name__ == "__main__":
+    unittest.main()
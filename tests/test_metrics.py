@@ -0,0 +1,107 @@
+# tests/test_metrics.py
+# Tests for recording stage timings and counters, exporting them as a trace and Prometheus metrics, and profiling threads
+
+import os
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from lib import metrics
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def read_trace(self):
+        """ Read every entry of the trace written to the test directory """
+
+        with open(os.path.join(self.directory.name, "trace.jsonl")) as trace_file:
+            return [json.loads(line) for line in trace_file]
+
+    def test_spans_and_counters_are_exported(self):
+        recorder = metrics.Recorder(self.directory.name)
+
+        # Spans of 0.2 and 3 seconds, the second of which fails
+        with mock.patch("time.perf_counter", side_effect=[10.0, 10.2]):
+            with recorder.span("download", video_url="https://www.youtube.com/watch?v=vid1"):
+                pass
+        with mock.patch("time.perf_counter", side_effect=[20.0, 23.0]):
+            with self.assertRaises(ValueError):
+                with recorder.span("download", video_url="https://www.youtube.com/watch?v=vid2"):
+                    raise ValueError("throttled")
+
+        recorder.count("videos_succeeded")
+        recorder.count("videos_succeeded", 2)
+        recorder.close()
+
+        # Each span is in the trace with its labels, followed by the counters
+        trace = self.read_trace()
+        self.assertEqual([(entry["type"], entry["name"]) for entry in trace], [("span", "download"), ("span", "download"), ("counter", "videos_succeeded")])
+        self.assertEqual(trace[0]["video_url"], "https://www.youtube.com/watch?v=vid1")
+        self.assertAlmostEqual(trace[0]["duration"], 0.2)
+        self.assertNotIn("error", trace[0])
+        self.assertEqual(trace[1]["error"], "ValueError('throttled')")
+        self.assertEqual(trace[2]["value"], 3)
+
+        with open(os.path.join(self.directory.name, "metrics.prom")) as metrics_file:
+            metric_lines = metrics_file.read().splitlines()
+
+        self.assertIn("bulk_yt_mp3_videos_succeeded_total 3", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_duration_seconds_bucket{stage=\"download\",le=\"0.1\"} 0", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_duration_seconds_bucket{stage=\"download\",le=\"0.25\"} 1", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_duration_seconds_bucket{stage=\"download\",le=\"5.0\"} 2", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_duration_seconds_bucket{stage=\"download\",le=\"+Inf\"} 2", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_duration_seconds_count{stage=\"download\"} 2", metric_lines)
+        self.assertIn("bulk_yt_mp3_stage_errors_total{stage=\"download\"} 1", metric_lines)
+
+    def test_counts_from_many_threads_add_up(self):
+        recorder = metrics.Recorder()
+
+        def count():
+            for c in range(1000):
+                recorder.count("http_requests")
+
+        threads = [threading.Thread(target=count) for c in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(recorder.counters, {"http_requests": 4000})
+
+    def test_disabled_recorder_records_nothing(self):
+        recorder = metrics.Recorder(self.directory.name, False)
+
+        self.assertIs(recorder.span("convert"), metrics.NULL_SPAN)
+        with recorder.span("convert"):
+            pass
+        recorder.count("tracks_copied")
+        recorder.close()
+
+        self.assertEqual(recorder.counters, {})
+        self.assertEqual(recorder.histograms, {})
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_stats_are_written(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        profiler = metrics.Profiler(os.path.join(directory.name, "profiles"))
+        profiler.start()
+        thread = threading.Thread(target=sum, args=(range(1000),), name="worker")
+        thread.start()
+        thread.join()
+        profile_files = profiler.stop()
+
+        # The main thread always has a file, and the worker its own where the Python version allows it
+        self.assertTrue(any(os.path.basename(profile_file).startswith("MainThread-") for profile_file in profile_files))
+        for profile_file in profile_files:
+            self.assertTrue(os.path.isfile(profile_file))
+
+if __name__ == "__main__":
+    unittest.main()
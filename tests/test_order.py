@@ -0,0 +1,69 @@
+# tests/test_order.py
+# Tests for ordering the download queue by priority class and longest video first
+
+import os
+import unittest
+import importlib.util
+
+# bulk-yt-mp3.py can't be imported by name, so load it from its path
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk-yt-mp3.py")
+program_spec = importlib.util.spec_from_file_location("bulk_yt_mp3", PROGRAM_FILE)
+program = importlib.util.module_from_spec(program_spec)
+program_spec.loader.exec_module(program)
+
+class StubDownloadManager(object):
+    """ Knows the length of the videos it has resolved, and records which stream manifests were dropped """
+
+    def __init__(self, durations):
+        self.durations = durations
+        self.dropped_manifests = []
+
+    def get_known_duration(self, video_url):
+        return self.durations.get(video_url)
+
+    def drop_stream_manifest(self, video_url):
+        self.dropped_manifests.append(video_url)
+
+def build_queue(video_urls):
+    """ Build video url/title/filename/metadata tuples for the URLs """
+
+    return [(video_url, video_url.upper(), video_url + ".mp3", None) for video_url in video_urls]
+
+class OrderVideoQueueTest(unittest.TestCase):
+
+    def order(self, durations, video_urls, **kwargs):
+        """ Order a queue of the videos and return their URLs in the new order """
+
+        download_manager = StubDownloadManager(durations)
+        video_queue = program.order_video_queue(download_manager, build_queue(video_urls), **kwargs)
+        return [video[0] for video in video_queue]
+
+    def test_queue_order_is_kept(self):
+        self.assertEqual(self.order({"a": 10, "b": 600, "c": 300}, ["a", "b", "c"]), ["a", "b", "c"])
+
+    def test_longest_videos_come_first(self):
+        self.assertEqual(self.order({"a": 10, "b": 600, "c": 300, "d": 600}, ["a", "b", "c", "d"], order="longest"), ["b", "d", "c", "a"])
+
+    def test_unknown_length_is_taken_as_the_average(self):
+        # "c" is resolved after 100 and 500, so it is placed as a 300 second video, ahead of 200 and behind 500
+        durations = {"a": 100, "b": 500, "d": 200, "e": 400}
+        self.assertEqual(self.order(durations, ["a", "b", "c", "d", "e"], order="longest"), ["b", "e", "c", "d", "a"])
+
+    def test_priority_class_comes_before_length(self):
+        priorities = {"a": 1, "b": 1, "c": 0, "d": 0}
+        video_urls = self.order({"a": 900, "b": 100, "c": 50, "d": 200}, ["a", "b", "c", "d"], order="longest", get_priority=lambda video: priorities[video[0]])
+
+        self.assertEqual(video_urls, ["d", "c", "a", "b"])
+
+    def test_manifests_are_dropped_only_without_a_window(self):
+        download_manager = StubDownloadManager({"a": 10, "b": 20})
+        list(program.order_video_queue(download_manager, build_queue(["a", "b"]), "longest"))
+        self.assertEqual(download_manager.dropped_manifests, ["a", "b"])
+
+        # A window holds few enough videos to keep their manifests
+        download_manager = StubDownloadManager({"a": 10, "b": 20})
+        list(program.order_video_queue(download_manager, build_queue(["a", "b"]), "longest", window=1))
+        self.assertEqual(download_manager.dropped_manifests, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# tests/test_pipeline.py
+# Tests for handing jobs between the stages of a pipeline
+
+import threading
+import unittest
+from lib import pipeline
+
+class PipelineTest(unittest.TestCase):
+
+    def test_each_stage_gets_the_last_ones_result(self):
+        calls = []
+        lock = threading.Lock()
+
+        def download(number, title):
+            with lock:
+                calls.append(("download", number))
+            return number, title.upper()
+
+        def convert(number, title):
+            with lock:
+                calls.append(("convert", number))
+            return (title + ".mp3",)
+
+        def tag(filename):
+            return "tagged " + filename
+
+        download_pipeline = pipeline.Pipeline([("download", download, 3), ("convert", convert, 2), ("tag", tag, 1)])
+        download_pipeline.start()
+        for c in range(6):
+            download_pipeline.submit(c, c, "song {}".format(c))
+        results, errors = download_pipeline.join()
+
+        self.assertEqual(errors, {})
+        self.assertEqual(results, {c: "tagged SONG {}.mp3".format(c) for c in range(6)})
+
+        # Every job went through both earlier stages
+        self.assertEqual(sorted(calls), sorted([("download", c) for c in range(6)] + [("convert", c) for c in range(6)]))
+
+    def test_failed_job_stops_at_its_stage(self):
+        tagged = []
+
+        def convert(number):
+            if number == 2:
+                raise ValueError("ffmpeg failed")
+            return (number,)
+
+        def tag(number):
+            tagged.append(number)
+            return number
+
+        download_pipeline = pipeline.Pipeline([("download", lambda number: (number,), 2), ("convert", convert, 2), ("tag", tag, 1)])
+        download_pipeline.start()
+        for c in range(4):
+            download_pipeline.submit(c, c)
+        results, errors = download_pipeline.join()
+
+        self.assertEqual(sorted(results), [0, 1, 3])
+        self.assertEqual(list(errors), [2])
+        self.assertEqual(str(errors[2]), "ffmpeg failed")
+        self.assertNotIn(2, tagged)
+
+    def test_batched_stage_gets_whole_and_partial_batches(self):
+        batches = []
+        lock = threading.Lock()
+
+        def convert_batch(jobs):
+            with lock:
+                batches.append(sorted(number for (number,) in jobs))
+            return [ValueError("bad") if number == 4 else (number * 2,) for (number,) in jobs]
+
+        download_pipeline = pipeline.Pipeline([("download", lambda number: (number,), 1), ("convert", convert_batch, 1, 3), ("tag", lambda number: number, 1)])
+        download_pipeline.start()
+        for c in range(7):
+            download_pipeline.submit(c, c)
+        results, errors = download_pipeline.join()
+
+        # Two full batches and the last, partial one handed over on join
+        self.assertEqual(sorted(len(batch) for batch in batches), [1, 3, 3])
+        self.assertEqual(sorted(number for batch in batches for number in batch), list(range(7)))
+
+        # Errors returned for single jobs in a batch are reported for those jobs only
+        self.assertEqual(results, {c: c * 2 for c in range(7) if c != 4})
+        self.assertEqual(list(errors), [4])
+
+    def test_needs_a_stage(self):
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline([])
+
+if __name__ == "__main__":
+    unittest.main()
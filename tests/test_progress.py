@@ -0,0 +1,96 @@
+# tests/test_progress.py
+# Tests for adding up the progress of every download and drawing it around other messages
+
+import io
+import sys
+import unittest
+from unittest import mock
+from lib import progress
+
+class FakeTerminal(io.StringIO):
+    """ Collects output while claiming to be a terminal, so progress is rendered """
+
+    def isatty(self):
+        return True
+
+class ProgressStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.progress_aggregator = progress.ProgressAggregator(output=FakeTerminal(), idle_timeout=30.0)
+
+    def test_downloads_are_added_up(self):
+        with mock.patch("time.monotonic", return_value=100.0):
+            self.progress_aggregator.update("first.mp3", 1000, 400)
+            self.progress_aggregator.update("second.mp3", 2000, 500)
+            self.progress_aggregator.update("third.mp3", 300, 300)
+            self.assertEqual(self.progress_aggregator.get_status(), (2, 1200, 2100))
+
+            # The finished download stays counted once it is retired
+            self.assertEqual(self.progress_aggregator.finished_count, 1)
+            self.assertEqual(self.progress_aggregator.get_status(), (2, 1200, 2100))
+
+    def test_pytube_progress_is_keyed_by_stream(self):
+        stream = mock.Mock(filesize=1000)
+        self.progress_aggregator.on_progress(stream, b"", 250)
+        self.progress_aggregator.on_progress(stream, b"", 100)
+
+        self.assertEqual(self.progress_aggregator.get_status(), (1, 900, 100))
+
+    def test_idle_download_is_reattached_when_it_resumes(self):
+        with mock.patch("time.monotonic", return_value=100.0):
+            self.progress_aggregator.update("slow.mp3", 1000, 400)
+
+        # Idle for longer than the timeout, so it is retired with its bytes kept
+        with mock.patch("time.monotonic", return_value=131.0):
+            self.assertEqual(self.progress_aggregator.get_status(), (0, 400, 0))
+
+        # It resumes from where it was, and its bytes are only counted once
+        with mock.patch("time.monotonic", return_value=140.0):
+            self.progress_aggregator.update("slow.mp3", 1000, 600)
+            self.assertEqual(self.progress_aggregator.get_status(), (1, 600, 400))
+
+            self.progress_aggregator.update("slow.mp3", 1000, 1000)
+            self.assertEqual(self.progress_aggregator.get_status(), (0, 1000, 0))
+        self.assertEqual(self.progress_aggregator.finished_count, 1)
+        self.assertEqual(self.progress_aggregator.retired_jobs, {})
+
+class ProgressOutputTest(unittest.TestCase):
+
+    def test_messages_clear_and_redraw_the_line(self):
+        terminal = FakeTerminal()
+        progress_aggregator = progress.ProgressAggregator(output=terminal)
+
+        progress_aggregator.draw("[>] progress")
+        progress_aggregator.write("\t[i] Downloading")
+
+        # The line isn't drawn partway through a message, only once the message ends
+        progress_aggregator.draw("[>] newer progress")
+        progress_aggregator.write("\n")
+
+        self.assertEqual(terminal.getvalue(), "\r\x1b[K[>] progress" + "\r\x1b[K\t[i] Downloading" + "\n[>] newer progress")
+
+    def test_standard_output_is_replaced_while_rendering(self):
+        terminal = FakeTerminal()
+        with mock.patch("sys.stdout", terminal):
+            progress_aggregator = progress.ProgressAggregator(refresh_interval=60.0)
+            progress_aggregator.start()
+            self.assertIsInstance(sys.stdout, progress.ProgressOutput)
+
+            progress_aggregator.draw("[>] progress")
+            print("\t[i] Converting")
+            progress_aggregator.stop()
+
+            self.assertIs(sys.stdout, terminal)
+
+        self.assertEqual(terminal.getvalue(), "\r\x1b[K[>] progress" + "\r\x1b[K\t[i] Converting\n[>] progress" + "\r\x1b[K")
+
+    def test_disabled_without_a_terminal(self):
+        progress_aggregator = progress.ProgressAggregator(output=io.StringIO())
+        progress_aggregator.update("first.mp3", 1000, 400)
+        progress_aggregator.start()
+
+        self.assertEqual(progress_aggregator.render_thread, None)
+        self.assertEqual(progress_aggregator.jobs, {})
+
+if __name__ == "__main__":
+    unittest.main()
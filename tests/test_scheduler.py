@@ -0,0 +1,124 @@
+# tests/test_scheduler.py
+# Tests for the bounded worker pool, the ordered parallel map and reordering jobs
+
+import time
+import threading
+import unittest
+from lib import scheduler
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_results_and_errors_are_collected_by_job_id(self):
+        def work(number):
+            if number % 3 == 0:
+                raise ValueError("bad number {}".format(number))
+            return number * 10
+
+        worker_pool = scheduler.WorkerPool(3)
+        worker_pool.start()
+        for c in range(10):
+            worker_pool.submit(c, work, c)
+        results, errors = worker_pool.join()
+
+        self.assertEqual(results, {c: c * 10 for c in range(10) if c % 3 != 0})
+        self.assertEqual(sorted(errors), [0, 3, 6, 9])
+        self.assertEqual(str(errors[6]), "bad number 6")
+
+        # The workers have stopped
+        self.assertEqual(worker_pool.threads, [])
+
+    def test_workers_and_queue_are_bounded(self):
+        running = []
+        peak_running = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def work():
+            with lock:
+                running.append(1)
+                peak_running.append(len(running))
+            release.wait(5)
+            with lock:
+                running.pop()
+
+        worker_pool = scheduler.WorkerPool(2, queue_size=1)
+        worker_pool.start()
+
+        # Two jobs run and one waits in the queue, so the fourth submission blocks until a worker frees up
+        submitted = []
+        def submit_all():
+            for c in range(4):
+                worker_pool.submit(c, work)
+                submitted.append(c)
+
+        submit_thread = threading.Thread(target=submit_all)
+        submit_thread.start()
+        time.sleep(0.2)
+        self.assertEqual(len(submitted), 3)
+
+        release.set()
+        submit_thread.join(5)
+        results, errors = worker_pool.join()
+
+        self.assertEqual(len(submitted), 4)
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual(max(peak_running), 2)
+
+    def test_worker_count_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            scheduler.WorkerPool(0)
+
+class ImapTest(unittest.TestCase):
+
+    def test_outcomes_come_back_in_order(self):
+        # Earlier items take longer, so they finish last
+        def work(number):
+            time.sleep((5 - number) * 0.02)
+            if number == 2:
+                raise ValueError("two")
+            return number * number
+
+        outcomes = list(scheduler.imap(work, range(5), 5))
+
+        self.assertEqual([item for item, result, error in outcomes], [0, 1, 2, 3, 4])
+        self.assertEqual([result for item, result, error in outcomes], [0, 1, None, 9, 16])
+        self.assertEqual(str(outcomes[2][2]), "two")
+
+    def test_items_are_taken_lazily(self):
+        taken = []
+        def items():
+            for c in range(100):
+                taken.append(c)
+                yield c
+
+        # The first outcome is handed back long before every item has been read
+        outcomes = scheduler.imap(lambda number: number, items(), 2)
+        self.assertEqual(next(outcomes), (0, 0, None))
+        self.assertLess(len(taken), 10)
+        outcomes.close()
+
+class OrderJobsTest(unittest.TestCase):
+
+    def test_whole_queue_is_sorted_stably(self):
+        items = [("a", 3), ("b", 1), ("c", 3), ("d", 2), ("e", 1)]
+
+        ordered_items = list(scheduler.order_jobs(items, lambda item: item[1]))
+
+        self.assertEqual([name for name, size in ordered_items], ["b", "e", "d", "a", "c"])
+
+    def test_window_hands_items_out_early(self):
+        taken = []
+        def items():
+            for size in [5, 1, 4, 2, 3, 0]:
+                taken.append(size)
+                yield size
+
+        ordered_items = scheduler.order_jobs(items(), lambda size: size, 2)
+
+        # The smallest of the first three is handed out once the third arrives
+        self.assertEqual(next(ordered_items), 1)
+        self.assertEqual(taken, [5, 1, 4])
+        self.assertEqual(list(ordered_items), [2, 3, 0, 4, 5])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# tests/test_segmented.py
+# Tests for segmented downloads, against a local server that drops connections
+
+import os
+import tempfile
+import threading
+import unittest
+import http.server
+from unittest import mock
+from lib import segmented
+
+# Body served in byte ranges
+BODY = bytes(c % 251 for c in range(300000))
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """ Serve byte ranges of BODY, cutting the first few responses off halfway """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        range_start, range_end = self.headers["Range"][len("bytes="):].split("-")
+        body = BODY[int(range_start):int(range_end) + 1]
+
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(range_start, range_end, len(BODY)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        with self.server.lock:
+            drop = self.server.drops_left > 0
+            self.server.drops_left -= 1
+
+        if drop == True:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class SegmentedDownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.drops_left = 2
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/media".format(self.server.server_address[1])
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "download")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_retries_back_off_and_progress_stays_within_size(self):
+        segmented_downloader = segmented.SegmentedDownloader(segment_size=100000, connection_count=1, base_delay=0.25)
+        reported = []
+
+        with mock.patch("lib.segmented.time.sleep") as sleep:
+            segmented_downloader.download(self.url, self.file_name, len(BODY), lambda file_name, total_size, bytes_done: reported.append(bytes_done))
+
+        with open(self.file_name, "rb") as open_file:
+            self.assertEqual(open_file.read(), BODY)
+
+        # Each dropped segment was retried after a delay no longer than the backoff allows
+        self.assertEqual(sleep.call_count, 2)
+        for call, max_delay in zip(sleep.call_args_list, (0.25, 0.5)):
+            self.assertLessEqual(call.args[0], max_delay)
+
+        # Bytes of the failed attempts weren't counted twice
+        self.assertLessEqual(max(reported), len(BODY))
+        self.assertEqual(reported[-1], len(BODY))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+# tests/test_startup.py
+# Tests that the program's quick paths don't load the modules only downloads need
+
+import os
+import sys
+import unittest
+import subprocess
+
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk-yt-mp3.py")
+
+# Modules that help, version and argument errors should never load
+HEAVY_MODULES = ("sqlite3", "pytube", "eyed3", "numpy", "av", "asyncio")
+
+# Run the program, then report which heavy modules it loaded on the last line
+CHECK_SCRIPT = """
+import sys
+import runpy
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print("LOADED:" + ",".join(module_name for module_name in {} if module_name in sys.modules))
+""".format(repr(HEAVY_MODULES))
+
+class StartupTest(unittest.TestCase):
+
+    def get_loaded_modules(self, *arguments):
+        """ Run the program with arguments in a fresh interpreter, returning the heavy modules it loaded """
+
+        output = subprocess.run([sys.executable, "-c", CHECK_SCRIPT, PROGRAM_FILE] + list(arguments), stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        last_line = output.strip().splitlines()[-1]
+        self.assertTrue(last_line.startswith("LOADED:"), output)
+        return [module_name for module_name in last_line[len("LOADED:"):].split(",") if module_name != ""]
+
+    def test_help_loads_no_heavy_modules(self):
+        self.assertEqual(self.get_loaded_modules("-h"), [])
+
+    def test_version_and_bad_option_load_no_heavy_modules(self):
+        self.assertEqual(self.get_loaded_modules("-v"), [])
+        self.assertEqual(self.get_loaded_modules("--no-such-option"), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+# tests/test_tagging.py
+# Tests for tags written by ffmpeg while converting, and the tag editor fallback, using the sample MP3s
+
+import os
+import types
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+import http.server
+import importlib.util
+from unittest import mock
+from lib import cache, journal, tag_editor
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Chemical Valley.mp3")
+
+class SampleHandler(http.server.BaseHTTPRequestHandler):
+    """ Serve the sample file for every GET, standing in for a media server """
+
+    def do_GET(self):
+        with open(SAMPLE_FILE, "rb") as sample_file:
+            sample_data = sample_file.read()
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(sample_data)))
+        self.end_headers()
+        self.wfile.write(sample_data)
+
+    def log_message(self, *args):
+        pass
+
+@unittest.skipUnless(shutil.which("ffmpeg") != None, "ffmpeg is not installed")
+@unittest.skipUnless(importlib.util.find_spec("eyed3") != None, "eyeD3 is not installed")
+@unittest.skipUnless(importlib.util.find_spec("pytube") != None, "pytube is not installed")
+class TaggingTest(unittest.TestCase):
+
+    def setUp(self):
+        # The manager imports pytube, so it is only loaded once the test is known to run
+        from lib import manager
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.video_filename = os.path.join(self.directory.name, "Chemical Valley.mp3")
+        self.downloaded_file = os.path.join(self.directory.name, "Chemical Valley.temp")
+        shutil.copyfile(SAMPLE_FILE, self.downloaded_file)
+
+        # A small cover image, made with ffmpeg so no imaging library is needed
+        self.cover_file = os.path.join(self.directory.name, "cover.jpg")
+        subprocess.check_output(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "color=c=red:s=16x16", "-frames:v", "1", self.cover_file])
+
+        self.metadata = {"thumbnail": self.cover_file, "title": "Chemical Valley", "artist": "Some Artist", "album": "Some Album", "track_num": "3", "genre": None, "recording_date": "2019"}
+        self.downloader = manager.Downloader(manager.DownloadManager(False), tag_editor.Editor(False))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def serve_sample(self):
+        """ Serve the sample file locally and make the download manager stream it for any video """
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SampleHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        stream = types.SimpleNamespace(url="http://127.0.0.1:{}/videoplayback?id=1".format(server.server_address[1]), filesize=os.path.getsize(SAMPLE_FILE), audio_codec=None, itag=140)
+        self.downloader.download_manager.get_audio_stream = lambda video_url: stream
+
+    def check_tags(self, mp3_file, cover_data):
+        import eyed3
+
+        tag = eyed3.load(mp3_file).tag
+        self.assertEqual(tag.version, (2, 3, 0))
+        self.assertEqual(tag.title, "Chemical Valley")
+        self.assertEqual(tag.artist, "Some Artist")
+        self.assertEqual(tag.album, "Some Album")
+        self.assertEqual(tag.track_num[0], 3)
+        self.assertEqual(tag.getBestDate().year, 2019)
+
+        # The cover is the only picture, as the front cover, stored unchanged
+        self.assertEqual(len(tag.images), 1)
+        self.assertEqual(tag.images[0].picture_type, 3)
+        self.assertEqual(tag.images[0].image_data, cover_data)
+
+    def test_tags_written_while_encoding(self):
+        converted_file, video_metadata = self.downloader.convert_stage(self.downloaded_file, self.video_filename, dict(self.metadata))
+
+        # ffmpeg wrote every tag, leaving nothing for the tag editor
+        self.assertEqual(converted_file, journal.get_partial_filename(self.video_filename))
+        self.assertEqual(video_metadata, None)
+        self.assertFalse(os.path.exists(self.downloaded_file))
+
+        mp3_file = self.downloader.tag_stage(converted_file, video_metadata)
+        self.assertEqual(mp3_file, self.video_filename)
+        self.assertFalse(os.path.exists(converted_file))
+
+        with open(self.cover_file, "rb") as cover_file:
+            self.check_tags(mp3_file, cover_file.read())
+
+    def test_tags_written_by_editor_when_ffmpeg_fails(self):
+        # ffmpeg can't open a cover image that isn't one, but eyeD3 embeds its bytes as they are
+        cover_data = b"not an image"
+        with open(self.cover_file, "wb") as cover_file:
+            cover_file.write(cover_data)
+
+        converted_file, video_metadata = self.downloader.convert_stage(self.downloaded_file, self.video_filename, dict(self.metadata))
+
+        # The file was converted again without tags, which are left to the tag editor
+        self.assertEqual(converted_file, journal.get_partial_filename(self.video_filename))
+        self.assertTrue(os.path.isfile(converted_file))
+        self.assertEqual(video_metadata, self.metadata)
+        self.assertFalse(os.path.exists(self.downloaded_file))
+
+        mp3_file = self.downloader.tag_stage(converted_file, video_metadata)
+        self.assertEqual(mp3_file, self.video_filename)
+        self.check_tags(mp3_file, cover_data)
+
+    def test_streaming_tags_written_by_editor_when_ffmpeg_fails(self):
+        self.serve_sample()
+        cover_data = b"not an image"
+        with open(self.cover_file, "wb") as cover_file:
+            cover_file.write(cover_data)
+
+        converted_file, video_metadata = self.downloader.stream_stage("https://www.youtube.com/watch?v=sample", "Chemical Valley", self.video_filename, dict(self.metadata))
+
+        # The stream was downloaded again and converted without tags, which are left to the tag editor
+        self.assertEqual(converted_file, journal.get_partial_filename(self.video_filename))
+        self.assertTrue(os.path.isfile(converted_file))
+        self.assertEqual(video_metadata, self.metadata)
+
+        mp3_file = self.downloader.tag_stage(converted_file, video_metadata)
+        self.check_tags(mp3_file, cover_data)
+
+    def test_streaming_removes_partial_file_when_ffmpeg_fails(self):
+        self.serve_sample()
+        partial_filename = journal.get_partial_filename(self.video_filename)
+
+        # An ffmpeg that writes part of its output file and then fails
+        bin_directory = os.path.join(self.directory.name, "bin")
+        os.mkdir(bin_directory)
+        with open(os.path.join(bin_directory, "ffmpeg"), "w") as ffmpeg_file:
+            ffmpeg_file.write("#!/bin/sh\nfor output_file; do :; done\necho partial > \"$output_file\"\ncat > /dev/null\nexit 1\n")
+        os.chmod(os.path.join(bin_directory, "ffmpeg"), 0o755)
+
+        with mock.patch.dict(os.environ, {"PATH": bin_directory + os.pathsep + os.environ["PATH"]}):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.downloader.download_manager.stream_and_convert("https://www.youtube.com/watch?v=sample", partial_filename, None)
+
+        self.assertFalse(os.path.exists(partial_filename))
+
+    def use_replaygain(self):
+        """ Turn ReplayGain on, with a metadata cache to keep measured values in """
+
+        metadata_cache = cache.MetadataCache(os.path.join(self.directory.name, "metadata.sqlite"))
+        self.addCleanup(metadata_cache.close)
+        self.downloader.download_manager.metadata_cache = metadata_cache
+        self.downloader.download_manager.replaygain = True
+        return metadata_cache
+
+    def test_known_replaygain_written_while_encoding(self):
+        import eyed3
+
+        self.serve_sample()
+        metadata_cache = self.use_replaygain()
+        metadata_cache.put("loudness", "sampleVideo:140", {"track_gain": -4.5, "track_peak": 0.912345})
+
+        converted_file, video_metadata = self.downloader.stream_stage("https://www.youtube.com/watch?v=sampleVideo", "Chemical Valley", self.video_filename, dict(self.metadata))
+
+        # ffmpeg wrote the tags and the ReplayGain values, so nothing was measured and the tag editor has nothing to do
+        self.assertEqual(video_metadata, None)
+        self.assertEqual(self.downloader.download_manager.loudness_results, {})
+
+        with mock.patch.object(self.downloader.editor, "insert_metadata") as insert_metadata:
+            mp3_file = self.downloader.tag_stage(converted_file, video_metadata)
+        insert_metadata.assert_not_called()
+
+        tag = eyed3.load(mp3_file).tag
+        self.assertEqual(tag.title, "Chemical Valley")
+        self.assertEqual(tag.user_text_frames.get("REPLAYGAIN_TRACK_GAIN").text, "-4.50 dB")
+        self.assertEqual(tag.user_text_frames.get("REPLAYGAIN_TRACK_PEAK").text, "0.912345")
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy") != None, "NumPy is not installed")
+    def test_measured_replaygain_is_cached(self):
+        self.serve_sample()
+        metadata_cache = self.use_replaygain()
+        partial_filename = journal.get_partial_filename(self.video_filename)
+
+        self.downloader.download_manager.stream_and_convert("https://www.youtube.com/watch?v=sampleVideo", partial_filename)
+
+        # Measured while converting, kept for the tag editor and for the next download of the stream
+        replaygain = self.downloader.download_manager.loudness_results[partial_filename]
+        self.assertEqual(metadata_cache.get("loudness", "sampleVideo:140"), replaygain)
+
+    def test_batch_converts_each_file_with_its_own_tags(self):
+        import eyed3
+
+        # Three copies of the sample, the second of which isn't audio and fails the batch's single ffmpeg run
+        file_names = []
+        for c in range(3):
+            old_file_name = os.path.join(self.directory.name, "input{}.temp".format(c))
+            if c == 1:
+                with open(old_file_name, "wb") as old_file:
+                    old_file.write(b"not audio")
+            else:
+                shutil.copyfile(SAMPLE_FILE, old_file_name)
+            metadata = dict(self.metadata, title="Track {}".format(c), thumbnail=None)
+            file_names.append((old_file_name, os.path.join(self.directory.name, "output{}.mp3".format(c)), metadata))
+
+        converted_files = self.downloader.download_manager.convert_batch(file_names)
+
+        # The bad input's error is reported for it alone, and the others are still converted with their tags
+        self.assertIsInstance(converted_files[1], Exception)
+        self.assertFalse(os.path.exists(file_names[1][1]))
+        for c in (0, 2):
+            self.assertEqual(converted_files[c], file_names[c][1])
+            self.assertEqual(eyed3.load(converted_files[c]).tag.title, "Track {}".format(c))
+
+if __name__ == "__main__":
+    unittest.main()
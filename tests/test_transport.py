@@ -0,0 +1,116 @@
+# tests/test_transport.py
+# Tests for the shared HTTP transport, against a local server
+
+import json
+import time
+import threading
+import unittest
+import http.server
+from lib import transport
+
+# Body served for every GET
+BODY = b"x" * 100000
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serve a fixed body for GETs, its headers for HEADs and echo the body of POSTs, keeping connections alive """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.do_HEAD()
+        self.wfile.write(BODY)
+
+    def do_POST(self):
+        request_body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(request_body)))
+        self.end_headers()
+        self.wfile.write(request_body)
+
+    def log_message(self, *args):
+        pass
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/videoplayback?id=1".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stream(self, http_transport):
+        """ Read a stream the way pytube's request.stream does, holding the first range's response unread while asking for the size """
+
+        response = http_transport.execute_request("{}&range=0-99999".format(self.url))
+        size_response = http_transport.execute_request("{}&range=0-99999999999".format(self.url))
+        file_size = int(size_response.info()["Content-Length"])
+        return file_size, response.read()
+
+    def run_in_threads(self, target, thread_count, timeout=10):
+        """ Run a function on several threads at once, failing instead of hanging if they wait forever for a connection """
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target()), daemon=True) for c in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout)
+            self.assertFalse(thread.is_alive(), "request hung waiting for a connection")
+        return results
+
+    def test_dict_body_is_sent_as_json(self):
+        http_transport = transport.Transport()
+        request_body = {"context": {"client": {"clientName": "ANDROID", "clientVersion": "17.31.35"}}}
+
+        response = http_transport.execute_request(self.url, method="POST", headers={"Content-Type": "application/json"}, data=request_body)
+
+        self.assertEqual(json.loads(response.read()), request_body)
+
+    def test_pytube_streams_stay_within_the_connection_cap(self):
+        http_transport = transport.Transport(max_connections_per_host=2)
+
+        # More streams than connections, each needing the size while its first range is unread, neither deadlock nor open extra connections
+        results = self.run_in_threads(lambda: self.stream(http_transport), 6)
+
+        self.assertEqual(results, [(len(BODY), BODY)] * 6)
+        self.assertLessEqual(http_transport.stats()["peak_connections"], 2)
+
+        # Every connection was handed back, so both are free for the next streams
+        self.assertEqual(self.run_in_threads(lambda: self.stream(http_transport), 2), [(len(BODY), BODY)] * 2)
+
+    def test_size_request_does_not_hold_a_connection(self):
+        http_transport = transport.Transport(max_connections_per_host=1)
+
+        # Asking for the size without having asked for the first range still leaves the connection free
+        size_response = http_transport.execute_request("{}&range=0-99999999999".format(self.url))
+        self.assertEqual(int(size_response.info()["Content-Length"]), len(BODY))
+
+        self.assertEqual(self.run_in_threads(lambda: http_transport.execute_request(self.url).read(), 1), [BODY])
+
+    def test_held_response_makes_others_wait(self):
+        http_transport = transport.Transport(max_connections_per_host=1)
+        held_response = http_transport.execute_request(self.url)
+
+        # The cap is strict, so the next request waits until the held response is closed
+        results = []
+        request_thread = threading.Thread(target=lambda: results.append(http_transport.execute_request(self.url).read()), daemon=True)
+        request_thread.start()
+        time.sleep(0.3)
+        self.assertEqual(results, [])
+
+        held_response.close()
+        request_thread.join(10)
+        self.assertEqual(results, [BODY])
+        self.assertEqual(http_transport.stats()["peak_connections"], 1)
+
+if __name__ == "__main__":
+    unittest.main()